@@ -0,0 +1,105 @@
+import hashlib
+import json
+import zlib
+
+from sqlalchemy import select
+
+from app.db import Blob, SessionArtifact, AgentSession, insert_stmt
+
+ARTIFACT_KINDS = ("plan", "final_plan", "diff", "trace")
+
+# Kinds that predate the blob store and may still live on agent_sessions
+LEGACY_KINDS = {"plan", "diff", "trace"}
+
+# Stored as text; everything else is JSON
+TEXT_KINDS = {"diff"}
+
+
+def _encode(kind: str, value) -> bytes:
+    if kind in TEXT_KINDS:
+        return value.encode("utf-8")
+    return json.dumps(value, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+
+def _decode(kind: str, raw: bytes):
+    if kind in TEXT_KINDS:
+        return raw.decode("utf-8")
+    return json.loads(raw)
+
+
+def put_artifact(db, session_id: str, kind: str, value):
+    """
+    Stores an artifact for a session, deduplicated by content hash.
+    Runs in the caller's transaction.
+    """
+    if value is None:
+        return
+
+    raw = _encode(kind, value)
+    digest = hashlib.sha256(raw).hexdigest()
+
+    db.execute(
+        insert_stmt(db, Blob)
+        .values(sha256=digest, size=len(raw), data=zlib.compress(raw))
+        .on_conflict_do_nothing(index_elements=["sha256"])
+    )
+
+    stmt = insert_stmt(db, SessionArtifact).values(
+        session_id=session_id, kind=kind, blob_sha256=digest, size=len(raw)
+    )
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["session_id", "kind"],
+            set_={"blob_sha256": digest, "size": len(raw)},
+        )
+    )
+
+
+def _artifact_stmt(session_id: str, kind: str):
+    return (
+        select(Blob.data)
+        .join(SessionArtifact, SessionArtifact.blob_sha256 == Blob.sha256)
+        .where(SessionArtifact.session_id == session_id, SessionArtifact.kind == kind)
+    )
+
+
+def _legacy_stmt(session_id: str, kind: str):
+    return select(getattr(AgentSession, kind)).where(AgentSession.id == session_id)
+
+
+def _sizes_stmt(session_id: str):
+    return select(SessionArtifact.kind, SessionArtifact.size).where(
+        SessionArtifact.session_id == session_id
+    )
+
+
+def get_artifact(db, session_id: str, kind: str):
+    """
+    Loads one artifact, falling back to the legacy inline column for
+    sessions written before artifacts were split out.
+    """
+    data = db.execute(_artifact_stmt(session_id, kind)).scalar()
+    if data is not None:
+        return _decode(kind, zlib.decompress(data))
+    if kind not in LEGACY_KINDS:
+        return None
+
+    return db.execute(_legacy_stmt(session_id, kind)).scalar()
+
+
+async def aget_artifact(db, session_id: str, kind: str):
+    """
+    Async variant of get_artifact for the read endpoints.
+    """
+    data = (await db.execute(_artifact_stmt(session_id, kind))).scalar()
+    if data is not None:
+        return _decode(kind, zlib.decompress(data))
+    if kind not in LEGACY_KINDS:
+        return None
+
+    return (await db.execute(_legacy_stmt(session_id, kind))).scalar()
+
+
+async def aartifact_sizes(db, session_id: str) -> dict[str, int]:
+    rows = (await db.execute(_sizes_stmt(session_id))).all()
+    return {kind: size for kind, size in rows}
@@ -1,7 +1,522 @@
-import json, time, uuid
+import atexit
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+
+from app.config import settings
+from app.metrics import register_gauge
+
+FSYNC_POLICIES = {"always", "interval", "never"}
+
+GENESIS_HASH = "0" * 64
+HASH_PREFIX = b', "hash": "'
+SEALED_SUFFIX_LEN = len(HASH_PREFIX) + 64 + 2
+
+# Failed batches are kept and retried this often; beyond MAX_PENDING
+# unwritten entries the oldest are dropped (and counted)
+RETRY_INTERVAL = 1.0
+MAX_PENDING = 100_000
+
+
+# -------------------------------
+# Hash chain
+# -------------------------------
+
+
+def chain_hash(prev_hash: str, body: bytes) -> str:
+    return hashlib.sha256(prev_hash.encode() + body).hexdigest()
+
+
+def seal(body: str, prev_hash: str) -> tuple[str, str]:
+    """
+    Appends the chain hash as the last key of a JSON entry.
+    The hash covers the previous entry's hash and the exact entry bytes.
+    """
+    h = chain_hash(prev_hash, body.encode())
+    return f'{body[:-1]}, "hash": "{h}"}}', h
+
+
+def unseal(line: bytes) -> tuple[bytes, str]:
+    """
+    Splits a sealed line (without newline) into (entry bytes, hash)
+    without parsing the JSON.
+    """
+    if line[-SEALED_SUFFIX_LEN : -SEALED_SUFFIX_LEN + len(HASH_PREFIX)] != HASH_PREFIX:
+        raise ValueError("Audit entry is not hash-chained")
+    return line[:-SEALED_SUFFIX_LEN] + b"}", line[-66:-2].decode()
+
+
+def entry_seq(body: bytes) -> int:
+    return int(body.rsplit(b'"seq": ', 1)[1][:-1])
+
+
+def merkle_root(leaves: list[str]) -> str:
+    level = [bytes.fromhex(h) for h in leaves]
+    if not level:
+        return GENESIS_HASH
+
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [
+            hashlib.sha256(level[i] + level[i + 1]).digest()
+            for i in range(0, len(level), 2)
+        ]
+
+    return level[0].hex()
+
+
+def _last_line(path: str) -> bytes | None:
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos, tail = end, b""
+
+        while pos > 0:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+            lines = tail.rstrip(b"\n").rsplit(b"\n", 1)
+            if len(lines) == 2 or pos == 0:
+                return lines[-1] or None
+
+    return None
+
+
+_RETRY = object()
+
+
+class AuditWriter:
+    """
+    Background audit sink.
+
+    Entries are queued by callers and written in batches by one thread
+    through a long-lived append handle. Every batch is written under an
+    exclusive flock on `<path>.lock`, so several uvicorn workers can share
+    one log, and the file is rotated (and gzip-compressed) by size or age.
+    The lock file itself is never rotated: a rotation (rename, reopen and
+    chain carry-over) happens entirely under the lock, so no process can
+    start a new file from a stale chain head.
+
+    Each entry carries a sequence number and a hash chaining it to the
+    previous entry. Every `checkpoint_every` entries a checkpoint (byte
+    range, chain endpoints and Merkle root of the entry hashes) is appended
+    to `<path>.ckpt`, which lets app.audit_verify check ranges in parallel.
+
+    fsync policy:
+    - always   → fsync after every batch
+    - interval → fsync at most every `fsync_interval` seconds
+    - never    → leave it to the OS
+
+    A batch that fails to write is kept and retried ahead of new entries.
+    `pending`, `dropped` and `error` expose the failure to /health and
+    /metrics, and flush() raises while entries are unwritten.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        fsync: str = "always",
+        fsync_interval: float = 1.0,
+        batch_size: int = 100,
+        flush_interval: float = 0.2,
+        rotate_bytes: int = 0,
+        rotate_seconds: int = 0,
+        compress: bool = True,
+        checkpoint_every: int = 10_000,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown audit fsync policy: {fsync}")
+
+        self.path = os.path.abspath(path)
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compress = compress
+        self.checkpoint_every = checkpoint_every
+        self.ckpt_path = self.path + ".ckpt"
+        self.lock_path = self.path + ".lock"
+
+        self._queue: queue.Queue = queue.Queue()
+        self._handle = None
+        self._lock_handle = None
+        self._opened_at = 0.0
+        self._last_fsync = 0.0
+        self._compressors: list[threading.Thread] = []
+        self._rotations = 0
+        self._head = None  # (inode, size, seq, hash) after our last write
+        self._pending: list[dict] = []  # entries of failed batches, oldest first
+        self.dropped = 0
+        self.error: str | None = None
+        self._ckpt = None  # (inode, size, record) of the last checkpoint seen
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    # ---------------------------
+    # Public API
+    # ---------------------------
+
+    def write(self, entry: dict):
+        self._queue.put(entry)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self):
+        """
+        Blocks until everything queued so far has been written (or has
+        failed to). Raises if entries are waiting for a retry.
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+        if self._pending:
+            raise RuntimeError(
+                f"Audit log has {len(self._pending)} unwritten entries: {self.error}"
+            )
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+        for t in self._compressors:
+            t.join()
+
+    # ---------------------------
+    # Writer thread
+    # ---------------------------
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=RETRY_INTERVAL if self._pending else None)
+            except queue.Empty:
+                item = _RETRY
+            batch, waiters, stop = [], [], False
+
+            deadline = time.monotonic() + self.flush_interval
+            while item is not _RETRY:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+
+                if stop or waiters or len(batch) >= self.batch_size:
+                    break
+
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+            batch = self._pending + batch
+            if batch:
+                try:
+                    self._write_batch(batch)
+                    self._pending, self.error = [], None
+                except Exception as e:
+                    # never take the pipeline down because of the audit sink:
+                    # keep the entries for the next attempt
+                    self.error = f"{type(e).__name__}: {e}"
+                    overflow = len(batch) - MAX_PENDING
+                    if overflow > 0:
+                        self.dropped += overflow
+                        batch = batch[overflow:]
+                    self._pending = batch
+
+            for w in waiters:
+                w.set()
+
+            if stop:
+                if self._handle:
+                    self._handle.close()
+                if self._lock_handle:
+                    self._lock_handle.close()
+                return
+
+    def _write_batch(self, batch: list[dict]):
+        bodies = [json.dumps(e)[:-1] for e in batch]
+
+        handle = self._lock()
+        try:
+            try:
+                seq, prev = self._chain_head(handle)
+            except ValueError:
+                # log written before chaining: start a fresh chain
+                self._rotate(0, GENESIS_HASH)
+                seq, prev = 0, GENESIS_HASH
+
+            if self._rotation_due(handle):
+                self._rotate(seq, prev)
+            handle = self._handle
+
+            lines = []
+            for body in bodies:
+                seq += 1
+                line, prev = seal(f'{body}, "seq": {seq}}}', prev)
+                lines.append(line + "\n")
+
+            handle.write("".join(lines).encode())
+            handle.flush()
+            self._sync(handle)
+
+            st = os.fstat(handle.fileno())
+            self._head = (st.st_ino, st.st_size, seq, prev)
+
+            # the entries are written: a failed checkpoint must not make the
+            # caller retry them, and is attempted again after the next batch
+            try:
+                last = self._last_checkpoint()
+                if seq - (last["seq_end"] if last else 0) >= self.checkpoint_every:
+                    self._checkpoint(seq, prev)
+            except Exception as e:
+                self.error = f"checkpoint: {type(e).__name__}: {e}"
+        finally:
+            fcntl.flock(self._lock_handle, fcntl.LOCK_UN)
+
+    # ---------------------------
+    # Chain state (read under lock)
+    # ---------------------------
+
+    def _chain_head(self, handle) -> tuple[int, str]:
+        st = os.fstat(handle.fileno())
+        if self._head and self._head[:2] == (st.st_ino, st.st_size):
+            return self._head[2], self._head[3]
+
+        # another worker wrote since our last batch
+        if st.st_size:
+            body, h = unseal(_last_line(self.path))
+            return entry_seq(body), h
+
+        last = self._last_checkpoint()
+        if last:
+            return last["seq_end"], last["last_hash"]
+
+        return 0, GENESIS_HASH
+
+    def _last_checkpoint(self) -> dict | None:
+        try:
+            st = os.stat(self.ckpt_path)
+        except FileNotFoundError:
+            return None
+
+        if self._ckpt and self._ckpt[:2] == (st.st_ino, st.st_size):
+            return self._ckpt[2]
+
+        line = _last_line(self.ckpt_path)
+        record = json.loads(line) if line else None
+        self._ckpt = (st.st_ino, st.st_size, record)
+        return record
+
+    def _checkpoint(self, seq: int, last_hash: str):
+        """
+        Seals everything written since the previous checkpoint.
+        """
+        last = self._last_checkpoint()
+        offset = last["offset_end"] if last else 0
+        prev_hash = last["last_hash"] if last else GENESIS_HASH
+
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            leaves = [unseal(line.rstrip(b"\n"))[1] for line in f]
+            end = f.tell()
+
+        if not leaves:
+            return
+
+        self._append_checkpoint(
+            {
+                "seq_start": seq - len(leaves) + 1,
+                "seq_end": seq,
+                "offset_start": offset,
+                "offset_end": end,
+                "prev_hash": prev_hash,
+                "last_hash": last_hash,
+                "root": merkle_root(leaves),
+            }
+        )
+
+    def _append_checkpoint(self, record: dict):
+        with open(self.ckpt_path, "ab") as f:
+            f.write((json.dumps(record) + "\n").encode())
+            f.flush()
+            if self.fsync != "never":
+                os.fsync(f.fileno())
+
+    def _sync(self, handle):
+        if self.fsync == "never":
+            return
+
+        now = time.monotonic()
+        if self.fsync == "interval" and now - self._last_fsync < self.fsync_interval:
+            return
+
+        os.fsync(handle.fileno())
+        self._last_fsync = now
+
+    # ---------------------------
+    # File handling
+    # ---------------------------
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._handle = open(self.path, "ab")
+        self._opened_at = self._first_timestamp() or time.time()
+
+    def _first_timestamp(self) -> float | None:
+        try:
+            with open(self.path, "rb") as f:
+                line = f.readline()
+            return json.loads(line)["timestamp"] if line else None
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _lock(self):
+        """
+        Takes the writers' lock and returns a handle on the file currently
+        at `path`, reopening it if another process rotated it meanwhile.
+        """
+        if self._lock_handle is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._lock_handle = open(self.lock_path, "ab")
+
+        fcntl.flock(self._lock_handle, fcntl.LOCK_EX)
+        try:
+            try:
+                current = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                current = None
+
+            if self._handle is not None and current != os.fstat(self._handle.fileno()).st_ino:
+                self._handle.close()
+                self._handle = None
+            if self._handle is None:
+                self._open()
+        except BaseException:
+            fcntl.flock(self._lock_handle, fcntl.LOCK_UN)
+            raise
+
+        return self._handle
+
+    def _rotation_due(self, handle) -> bool:
+        size = os.fstat(handle.fileno()).st_size
+        if not size:
+            return False
+
+        too_big = self.rotate_bytes and size >= self.rotate_bytes
+        too_old = self.rotate_seconds and time.time() - self._opened_at >= self.rotate_seconds
+        return bool(too_big or too_old)
+
+    def _rotate(self, seq: int, last_hash: str):
+        """
+        Moves the current file aside and starts a new one. Runs under the
+        writers' lock, which stays held until the chain is carried over.
+        """
+        if seq:
+            self._checkpoint(seq, last_hash)
+
+        stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        self._rotations += 1
+        rotated = f"{self.path}.{stamp}.{os.getpid()}.{self._rotations}"
+        os.rename(self.path, rotated)
+        if os.path.exists(self.ckpt_path):
+            os.rename(self.ckpt_path, rotated + ".ckpt")
+
+        self._handle.close()
+        self._open()
+
+        # empty checkpoint carrying the chain into the new file
+        self._ckpt = None
+        self._append_checkpoint(
+            {
+                "seq_start": seq + 1,
+                "seq_end": seq,
+                "offset_start": 0,
+                "offset_end": 0,
+                "prev_hash": last_hash,
+                "last_hash": last_hash,
+                "root": GENESIS_HASH,
+            }
+        )
+
+        if self.compress:
+            t = threading.Thread(target=_compress, args=(rotated,), daemon=True)
+            t.start()
+            self._compressors.append(t)
+
+
+def _compress(path: str):
+    with open(path, "rb") as src, gzip.open(f"{path}.gz", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(path)
+
+
+# -------------------------------
+# Module-level sink
+# -------------------------------
+
+_writer: AuditWriter | None = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_writer() -> AuditWriter:
+    global _writer
+
+    with _writer_lock:
+        if _writer is None:
+            _writer = AuditWriter(
+                settings.audit_log_path,
+                fsync=settings.audit_fsync,
+                fsync_interval=settings.audit_fsync_interval,
+                batch_size=settings.audit_batch_size,
+                flush_interval=settings.audit_flush_interval,
+                rotate_bytes=settings.audit_rotate_bytes,
+                rotate_seconds=settings.audit_rotate_seconds,
+                compress=settings.audit_compress,
+                checkpoint_every=settings.audit_checkpoint_every,
+            )
+            atexit.register(_writer.close)
+
+    return _writer
 
 
 def write_audit_log(data: dict):
     entry = {"id": str(uuid.uuid4()), "timestamp": time.time(), **data}
-    with open("audit.log", "a") as f:
-        f.write(json.dumps(entry) + "\n")
+    get_audit_writer().write(entry)
+
+
+def audit_status() -> dict:
+    """
+    Health of the module-level sink: unwritten and dropped entries and the
+    last write error.
+    """
+    if _writer is None:
+        return {"pending": 0, "dropped": 0, "error": None}
+    return {"pending": _writer.pending, "dropped": _writer.dropped, "error": _writer.error}
+
+
+register_gauge(
+    "safeagent_audit_pending",
+    "Audit entries waiting to be written after a failed write",
+    lambda: audit_status()["pending"],
+)
+register_gauge(
+    "safeagent_audit_dropped",
+    "Audit entries dropped after failed writes exceeded the retry buffer",
+    lambda: audit_status()["dropped"],
+)
@@ -0,0 +1,222 @@
+"""
+Verifies the hash chain of SafeAgent audit logs.
+
+    python -m app.audit_verify [audit.log] [--from-seq N] [--to-seq M] [--workers K]
+
+Checkpoint segments of the live log are verified in parallel by byte range;
+rotated (gzip) files are verified one process per file. With a seq range only
+the overlapping segments are read.
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from app.audit import GENESIS_HASH, chain_hash, entry_seq, merkle_root, unseal
+from app.config import settings
+
+
+# -------------------------------
+# Segment verification (worker side)
+# -------------------------------
+
+
+def _verify_segments(path: str, segments: list[dict]) -> dict:
+    """
+    Re-hashes each segment from its recorded start and compares the result
+    with the checkpoint. A segment with offset_end=None runs to EOF.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    checked = 0
+    last_seq, last_hash = None, None
+
+    try:
+        with opener(path, "rb") as f:
+            for seg in segments:
+                f.seek(seg["offset_start"])
+                pos = seg["offset_start"]
+                prev = seg["prev_hash"]
+                seq = seg["seq_start"]
+                leaves = []
+
+                while seg["offset_end"] is None or pos < seg["offset_end"]:
+                    raw = f.readline()
+                    if not raw:
+                        break
+                    pos += len(raw)
+
+                    body, h = unseal(raw.rstrip(b"\n"))
+                    if chain_hash(prev, body) != h:
+                        raise ValueError(f"hash mismatch at seq {seq}")
+                    if entry_seq(body) != seq:
+                        raise ValueError(f"expected seq {seq}, found {entry_seq(body)}")
+
+                    leaves.append(h)
+                    prev = h
+                    seq += 1
+
+                checked += len(leaves)
+                last_seq, last_hash = seq - 1, prev
+
+                if seg["offset_end"] is None:
+                    continue
+                if pos != seg["offset_end"]:
+                    raise ValueError(f"segment ending at seq {seg['seq_end']} is truncated")
+                if seq - 1 != seg["seq_end"] or prev != seg["last_hash"]:
+                    raise ValueError(f"chain does not reach checkpoint at seq {seg['seq_end']}")
+                if merkle_root(leaves) != seg["root"]:
+                    raise ValueError(f"Merkle root mismatch at seq {seg['seq_end']}")
+
+    except (OSError, ValueError, IndexError) as e:
+        return {"path": path, "ok": False, "error": str(e), "entries": checked}
+
+    return {
+        "path": path,
+        "ok": True,
+        "entries": checked,
+        "last_seq": last_seq,
+        "last_hash": last_hash,
+    }
+
+
+# -------------------------------
+# Planning (driver side)
+# -------------------------------
+
+
+def _checkpoint_file(log_path: str) -> str:
+    return (log_path[:-3] if log_path.endswith(".gz") else log_path) + ".ckpt"
+
+
+def _load_checkpoints(log_path: str) -> list[dict]:
+    try:
+        with open(_checkpoint_file(log_path), "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def discover_logs(path: str) -> list[tuple[str, list[dict]]]:
+    """
+    Returns [(log file, checkpoints)] for the live log and its rotations,
+    ordered by position in the chain.
+    """
+    candidates = [
+        p
+        for p in glob.glob(f"{glob.escape(path)}.*")
+        if not p.endswith(".ckpt") and os.path.exists(_checkpoint_file(p))
+    ]
+    # a rotation still being compressed exists as both plain and .gz
+    candidates = [
+        p for p in candidates if not (p.endswith(".gz") and os.path.exists(p[:-3]))
+    ]
+    if os.path.exists(path):
+        candidates.append(path)
+
+    logs = [(p, _load_checkpoints(p)) for p in candidates]
+    logs = [(p, c) for p, c in logs if c or p == path]
+    logs.sort(key=lambda item: item[1][0]["seq_start"] if item[1] else float("inf"))
+    return logs
+
+
+def plan_jobs(
+    logs: list[tuple[str, list[dict]]],
+    from_seq: int | None = None,
+    to_seq: int | None = None,
+) -> tuple[list[tuple[str, list[dict]]], list[str]]:
+    """
+    Checks checkpoint continuity across all files (metadata only) and returns
+    the segment jobs overlapping [from_seq, to_seq] plus any continuity errors.
+    """
+    errors = []
+    jobs = []
+    prev_hash = GENESIS_HASH
+
+    for path, ckpts in logs:
+        segments = []
+
+        for c in ckpts:
+            if c["prev_hash"] != prev_hash:
+                errors.append(f"{path}: checkpoint at seq {c['seq_start']} breaks the chain")
+            prev_hash = c["last_hash"]
+            if c["seq_end"] >= c["seq_start"]:
+                segments.append(dict(c))
+
+        # entries written after the last checkpoint
+        tail_start = ckpts[-1]["offset_end"] if ckpts else 0
+        tail_seq = ckpts[-1]["seq_end"] + 1 if ckpts else 1
+        segments.append(
+            {
+                "seq_start": tail_seq,
+                "seq_end": None,
+                "offset_start": tail_start,
+                "offset_end": None,
+                "prev_hash": prev_hash,
+            }
+        )
+
+        segments = [
+            s
+            for s in segments
+            if (to_seq is None or s["seq_start"] <= to_seq)
+            and (from_seq is None or s["seq_end"] is None or s["seq_end"] >= from_seq)
+        ]
+        if not segments:
+            continue
+
+        if path.endswith(".gz"):
+            jobs.append((path, segments))
+        else:
+            jobs.extend((path, [s]) for s in segments)
+
+    return jobs, errors
+
+
+def verify(
+    path: str,
+    from_seq: int | None = None,
+    to_seq: int | None = None,
+    workers: int | None = None,
+) -> dict:
+    logs = discover_logs(path)
+    jobs, errors = plan_jobs(logs, from_seq, to_seq)
+
+    if len(jobs) <= 1 or workers == 1:
+        results = [_verify_segments(p, segs) for p, segs in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_verify_segments, *zip(*jobs)))
+
+    errors += [f"{r['path']}: {r['error']}" for r in results if not r["ok"]]
+    head = results[-1] if results and results[-1]["ok"] else {}
+
+    return {
+        "ok": not errors,
+        "files": len(logs),
+        "segments": sum(len(segs) for _, segs in jobs),
+        "entries": sum(r["entries"] for r in results),
+        "head_seq": head.get("last_seq"),
+        "head_hash": head.get("last_hash"),
+        "errors": errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify the SafeAgent audit hash chain")
+    parser.add_argument("path", nargs="?", default=settings.audit_log_path)
+    parser.add_argument("--from-seq", type=int)
+    parser.add_argument("--to-seq", type=int)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args(argv)
+
+    report = verify(args.path, args.from_seq, args.to_seq, args.workers)
+    print(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
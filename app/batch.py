@@ -0,0 +1,206 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
+from uuid import uuid4
+
+from sqlalchemy import func, select
+
+from app import cluster
+from app.config import settings
+from app.db import SessionLocal, Batch, BatchItem
+from app.metrics import register_gauge
+from app.llm import response_cache
+from app.pipeline import run_pipeline
+
+TERMINAL_STATUSES = {"success", "failed", "rejected"}
+
+# -------------------------------
+# Scheduler
+# -------------------------------
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide pool shared by all batches, so concurrent batches queue
+    behind each other instead of multiplying clone/LLM/verifier load.
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.batch_concurrency,
+                thread_name_prefix="safeagent-batch",
+            )
+    return _executor
+
+
+def _set_item(batch_id: str, position: int, session_id: str, **fields):
+    with SessionLocal() as db:
+        if not cluster.holds(db, session_id):
+            # a peer took the session over and reports the item itself
+            return
+        db.query(BatchItem).filter_by(batch_id=batch_id, position=position).update(
+            {**fields, "updated_at": datetime.utcnow()}
+        )
+        db.commit()
+
+
+def _run_item(
+    repo_url: str,
+    prompt: str,
+    session_id: str,
+    candidates: int | None,
+    batch_id: str | None,
+    position: int | None,
+):
+    global _pending
+
+    with _executor_lock:
+        _pending -= 1
+
+    with ExitStack() as scope:
+        scope.enter_context(cluster.held(session_id))
+        if batch_id:
+            _set_item(batch_id, position, session_id, status="running")
+            # repos of one batch with identical files share LLM responses
+            scope.enter_context(response_cache(batch_id))
+
+        try:
+            result = run_pipeline(repo_url, prompt, session_id, candidates)
+            status, error = result["status"], result.get("error")
+        except Exception as e:
+            status, error = "failed", str(e)
+
+        # still under the lease, so the write is fenced
+        if batch_id:
+            _set_item(batch_id, position, session_id, status=status, error=error)
+
+
+def schedule(
+    repo_url: str,
+    prompt: str,
+    session_id: str,
+    candidates: int | None = None,
+    batch_id: str | None = None,
+    position: int | None = None,
+):
+    """
+    Runs one session on the shared pool: a batch item, or a session this
+    node took over from a failed peer.
+    """
+    global _pending
+
+    executor = get_executor()
+    with _executor_lock:
+        _pending += 1
+
+    executor.submit(
+        _run_item, repo_url, prompt, session_id, candidates, batch_id, position
+    )
+
+
+def submit_batch(repo_urls: list[str], prompt: str, candidates: int | None = None) -> str:
+    """
+    Records the batch with one queued item per distinct repo and schedules
+    the items. Session ids are assigned up front so clients can follow
+    each run's events before it starts. In a cluster each item is leased
+    to its repo's owner node instead of running here.
+    """
+    batch_id = str(uuid4())
+    jobs = [
+        (position, url, str(uuid4()))
+        for position, url in enumerate(dict.fromkeys(repo_urls))
+    ]
+
+    with SessionLocal() as db:
+        db.add(Batch(id=batch_id, prompt=prompt))
+        db.add_all(
+            BatchItem(
+                batch_id=batch_id,
+                position=position,
+                repo_url=url,
+                session_id=session_id,
+                status="queued",
+            )
+            for position, url, session_id in jobs
+        )
+        if cluster.enabled():
+            for position, url, session_id in jobs:
+                cluster.queue(db, session_id, url, prompt, candidates, batch_id, position)
+        db.commit()
+
+    if cluster.enabled():
+        # claims this node's share now; peers pick up theirs on their next beat
+        cluster.reap()
+        return batch_id
+
+    for position, url, session_id in jobs:
+        schedule(url, prompt, session_id, candidates, batch_id, position)
+
+    return batch_id
+
+
+register_gauge(
+    "safeagent_batch_queue_depth",
+    "Batch items waiting for a worker",
+    lambda: _pending,
+)
+
+
+# -------------------------------
+# Progress
+# -------------------------------
+
+
+async def batch_progress(db, batch_id: str) -> dict | None:
+    batch = await db.get(Batch, batch_id)
+    if batch is None:
+        return None
+
+    counts = dict(
+        (
+            await db.execute(
+                select(BatchItem.status, func.count())
+                .where(BatchItem.batch_id == batch_id)
+                .group_by(BatchItem.status)
+            )
+        ).all()
+    )
+    items = (
+        (
+            await db.execute(
+                select(BatchItem)
+                .where(BatchItem.batch_id == batch_id)
+                .order_by(BatchItem.position)
+            )
+        )
+        .scalars()
+        .all()
+    )
+
+    total = sum(counts.values())
+    done = sum(n for status, n in counts.items() if status in TERMINAL_STATUSES)
+
+    return {
+        "batch_id": batch.id,
+        "created_at": batch.created_at,
+        "prompt": batch.prompt,
+        "total": total,
+        "done": done,
+        "counts": counts,
+        "items": [
+            {
+                "repo_url": item.repo_url,
+                "session_id": item.session_id,
+                "status": item.status,
+                "error": item.error,
+            }
+            for item in items
+        ],
+    }
@@ -0,0 +1,454 @@
+import hashlib
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, or_, select, update
+
+from app.config import settings
+from app.db import (
+    SessionLocal,
+    AgentSession,
+    BatchItem,
+    ClusterNode,
+    SessionArtifact,
+    SessionLease,
+    insert_stmt,
+)
+from app.metrics import register_gauge
+
+LOST_NODE_ERROR = "Node running this session stopped responding"
+LOST_LEASE_ERROR = "Session was taken over by another node"
+
+# -------------------------------
+# Membership
+# -------------------------------
+
+_node_id = None
+_nodes: dict[str, str] = {}
+_nodes_at = 0.0
+_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(settings.node_url)
+
+
+def node_id() -> str:
+    global _node_id
+
+    if _node_id is None:
+        _node_id = settings.node_id or f"{socket.gethostname()}-{os.getpid()}"
+    return _node_id
+
+
+def heartbeat():
+    """
+    Marks this node alive and extends every lease it holds.
+    """
+    now = datetime.utcnow()
+
+    with SessionLocal() as db:
+        db.execute(
+            insert_stmt(db, ClusterNode)
+            .values(id=node_id(), url=settings.node_url, started_at=now, heartbeat_at=now)
+            .on_conflict_do_update(
+                index_elements=["id"],
+                set_={"url": settings.node_url, "heartbeat_at": now},
+            )
+        )
+        db.execute(
+            update(SessionLease)
+            .where(SessionLease.node_id == node_id())
+            .values(expires_at=now + timedelta(seconds=settings.node_lease_sec))
+        )
+        db.commit()
+
+
+def live_nodes(refresh: bool = False) -> dict[str, str]:
+    """
+    {node_id: url} of nodes heard from within NODE_LEASE_SEC, re-read at
+    most once per heartbeat interval.
+    """
+    global _nodes, _nodes_at
+
+    with _lock:
+        if not refresh and time.monotonic() - _nodes_at < settings.node_heartbeat_sec:
+            return _nodes
+
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.node_lease_sec)
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(ClusterNode.id, ClusterNode.url).where(ClusterNode.heartbeat_at >= cutoff)
+        ).all()
+
+    nodes = dict(rows)
+    nodes.setdefault(node_id(), settings.node_url)
+
+    with _lock:
+        _nodes, _nodes_at = nodes, time.monotonic()
+    return nodes
+
+
+def leave():
+    """
+    Deregisters on clean shutdown so peers take over this node's repos
+    and queued sessions without waiting for its heartbeat to lapse.
+    Running sessions keep their leases until this process actually stops
+    heartbeating, so no peer restarts a run that is still going.
+    """
+    with SessionLocal() as db:
+        db.execute(delete(ClusterNode).where(ClusterNode.id == node_id()))
+        db.execute(
+            update(SessionLease)
+            .where(SessionLease.node_id == node_id(), SessionLease.state == "queued")
+            .values(expires_at=datetime.utcnow())
+        )
+        db.commit()
+
+
+# -------------------------------
+# Routing
+# -------------------------------
+
+
+def _score(node: str, repo_url: str) -> int:
+    digest = hashlib.sha256(f"{node}\0{repo_url}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def rendezvous_owner(repo_url: str, nodes) -> str:
+    """
+    Highest-random-weight owner: each repo sticks to one node, and a node
+    joining or leaving only moves the repos it wins or held.
+    """
+    return max(nodes, key=lambda node: (_score(node, repo_url), node))
+
+
+def owner(repo_url: str) -> tuple[str, str]:
+    nodes = live_nodes()
+    node = rendezvous_owner(repo_url, nodes)
+    return node, nodes[node]
+
+
+def redirect_url(repo_url: str) -> str | None:
+    """
+    Base URL of the node that should run `repo_url`, or None to run here.
+    """
+    if not enabled():
+        return None
+
+    node, url = owner(repo_url)
+    return None if node == node_id() else url.rstrip("/")
+
+
+def session_url(session_id: str, repo_url: str | None = None) -> str | None:
+    """
+    Base URL of the node whose event bus carries `session_id`: the live
+    holder of its lease, else the owner of `repo_url` (where /run will
+    land), or None for here.
+    """
+    if not enabled():
+        return None
+
+    with SessionLocal() as db:
+        lease = db.get(SessionLease, session_id)
+
+    if lease is not None:
+        url = live_nodes().get(lease.node_id)
+        if lease.node_id == node_id() or not url:
+            return None
+        return url.rstrip("/")
+
+    return redirect_url(repo_url) if repo_url else None
+
+
+# -------------------------------
+# Leases
+# -------------------------------
+
+
+def _expiry() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=settings.node_lease_sec)
+
+
+def queue(db, session_id: str, repo_url: str, prompt: str, candidates=None, batch_id=None, position=None):
+    """
+    Assigns a session to its repo's owner, in the caller's transaction.
+    The owner picks it up on its next reap().
+    """
+    db.add(
+        SessionLease(
+            session_id=session_id,
+            repo_url=repo_url,
+            prompt=prompt,
+            candidates=candidates,
+            batch_id=batch_id,
+            position=position,
+            node_id=owner(repo_url)[0],
+            state="queued",
+            attempts=0,
+            expires_at=_expiry(),
+        )
+    )
+
+
+_held: set[str] = set()
+
+
+@contextmanager
+def held(session_id: str, repo_url: str | None = None, prompt: str | None = None, candidates=None):
+    """
+    Holds the session's lease while it runs here. With `repo_url` a new
+    running lease is taken (synchronous /run); otherwise the session was
+    already claimed. Only a dead process leaves the lease behind.
+
+    Writes for the session are fenced with holds() while it is held: if a
+    peer has taken the lease over, this node's late writes are dropped.
+    """
+    if not enabled():
+        yield
+        return
+
+    if repo_url is not None:
+        with SessionLocal() as db:
+            db.add(
+                SessionLease(
+                    session_id=session_id,
+                    repo_url=repo_url,
+                    prompt=prompt,
+                    candidates=candidates,
+                    node_id=node_id(),
+                    state="running",
+                    attempts=1,
+                    expires_at=_expiry(),
+                )
+            )
+            db.commit()
+
+    _held.add(session_id)
+    try:
+        yield
+    finally:
+        _held.discard(session_id)
+        with SessionLocal() as db:
+            # a peer that took the session over owns the lease now
+            db.execute(
+                delete(SessionLease).where(
+                    SessionLease.session_id == session_id,
+                    SessionLease.node_id == node_id(),
+                )
+            )
+            db.commit()
+
+
+def holds(db, session_id: str) -> bool:
+    """
+    Fences a write for a session held here, in the caller's transaction:
+    renews this node's lease, or returns False if a peer has claimed it.
+    The renewal locks the lease row until commit, so the peer's claim
+    cannot slip in between the check and the write. Sessions not run
+    under held() are not fenced.
+    """
+    if not enabled() or session_id not in _held:
+        return True
+
+    return bool(
+        db.execute(
+            update(SessionLease)
+            .where(
+                SessionLease.session_id == session_id,
+                SessionLease.node_id == node_id(),
+            )
+            .values(expires_at=_expiry())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    )
+
+
+def _reset_session(db, lease) -> bool:
+    """
+    Clears a partial run before a retry. False if the session already
+    finished and only its lease was left behind.
+    """
+    from app.batch import TERMINAL_STATUSES
+
+    status = db.execute(
+        select(AgentSession.status).where(AgentSession.id == lease.session_id)
+    ).scalar()
+    if status in TERMINAL_STATUSES:
+        return False
+
+    db.execute(delete(AgentSession).where(AgentSession.id == lease.session_id))
+    db.execute(
+        delete(SessionArtifact).where(SessionArtifact.session_id == lease.session_id)
+    )
+    return True
+
+
+def _abandon(db, lease):
+    from app.stats import record_session
+
+    db.add(
+        AgentSession(
+            id=lease.session_id,
+            repo_url=lease.repo_url,
+            prompt=lease.prompt,
+            files_changed=[],
+            status="failed",
+            error=LOST_NODE_ERROR,
+        )
+    )
+    record_session(db, lease.repo_url, "failed", None, None, error=LOST_NODE_ERROR)
+    if lease.batch_id:
+        db.query(BatchItem).filter_by(
+            batch_id=lease.batch_id, position=lease.position
+        ).update(
+            {"status": "failed", "error": LOST_NODE_ERROR, "updated_at": datetime.utcnow()}
+        )
+
+
+def reap() -> int:
+    """
+    Claims this node's queued sessions and the expired leases of dead
+    nodes whose repos now hash here, and schedules them. Claims are
+    compare-and-set updates, so each lease is taken by one node only.
+    Returns the number of sessions scheduled.
+    """
+    from app.batch import schedule
+
+    if not enabled():
+        return 0
+
+    me = node_id()
+    now = datetime.utcnow()
+    nodes = live_nodes(refresh=True)
+
+    with SessionLocal() as db:
+        leases = db.execute(
+            select(SessionLease).where(
+                or_(
+                    (SessionLease.node_id == me) & (SessionLease.state == "queued"),
+                    SessionLease.expires_at < now,
+                )
+            )
+        ).scalars().all()
+
+        claimed = []
+        for lease in leases:
+            state, attempts, holder = lease.state, lease.attempts, lease.node_id
+            if lease.expires_at < now and rendezvous_owner(lease.repo_url, nodes) != me:
+                continue
+
+            won = db.execute(
+                update(SessionLease)
+                .where(
+                    SessionLease.session_id == lease.session_id,
+                    SessionLease.node_id == holder,
+                    SessionLease.state == state,
+                    SessionLease.expires_at == lease.expires_at,
+                )
+                .values(
+                    node_id=me,
+                    state="running",
+                    attempts=attempts + 1,
+                    expires_at=_expiry(),
+                )
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not won:
+                continue
+
+            if state == "running" and not _reset_session(db, lease):
+                finished = True
+            elif attempts >= settings.session_max_attempts:
+                _abandon(db, lease)
+                finished = True
+            else:
+                finished = False
+                claimed.append(
+                    (
+                        lease.repo_url,
+                        lease.prompt,
+                        lease.session_id,
+                        lease.candidates,
+                        lease.batch_id,
+                        lease.position,
+                    )
+                )
+
+            if finished:
+                db.execute(
+                    delete(SessionLease).where(SessionLease.session_id == lease.session_id)
+                )
+
+        db.commit()
+
+    for job in claimed:
+        schedule(*job)
+    return len(claimed)
+
+
+# -------------------------------
+# Background loop
+# -------------------------------
+
+_stop = threading.Event()
+
+
+def _loop():
+    while not _stop.wait(settings.node_heartbeat_sec):
+        try:
+            heartbeat()
+            reap()
+        except Exception:
+            # the database may be briefly unreachable; try again next beat
+            pass
+
+
+def start():
+    """
+    Joins the cluster (when NODE_URL is set) and starts heartbeats and
+    lease reaping.
+    """
+    if not enabled():
+        return
+
+    heartbeat()
+    reap()
+    _stop.clear()
+    threading.Thread(target=_loop, name="safeagent-cluster", daemon=True).start()
+
+
+def stop():
+    if not enabled():
+        return
+
+    _stop.set()
+    leave()
+
+
+def _held_leases():
+    if not enabled():
+        return 0
+    with SessionLocal() as db:
+        return db.execute(
+            select(func.count())
+            .select_from(SessionLease)
+            .where(SessionLease.node_id == node_id())
+        ).scalar()
+
+
+register_gauge(
+    "safeagent_cluster_nodes",
+    "Live nodes in this node's view of the cluster",
+    lambda: len(live_nodes()) if enabled() else 1,
+)
+register_gauge(
+    "safeagent_cluster_leases",
+    "Sessions leased to this node (queued or running)",
+    _held_leases,
+)
@@ -6,8 +6,80 @@ class Settings(BaseSettings):
     workspace_root: str = "/tmp/safeagent"
     require_tests: bool = True
 
-    # DB
+    # Verification pool (0 workers runs verification in-process)
+    verify_workers: int = 2
+    verify_max_tasks_per_child: int = 50
+    verify_cpu_seconds: int = 600
+    verify_memory_mb: int = 4096
+    verify_timeout_sec: int = 900
+    verify_cgroup: str | None = None  # e.g. /sys/fs/cgroup/safeagent-verify
+    verify_cache_size: int = 10_000  # cached verdicts; 0 disables
+
+    # Test environments cached per lockfile hash (0 disables)
+    env_cache_size: int = 20
+    env_build_timeout_sec: int = 1800
+
+    # Warm pytest workers per test environment
+    warm_test_workers: bool = True
+    warm_worker_idle_sec: int = 900
+    warm_worker_start_timeout_sec: int = 60
+
+    # LLM
+    llm_fast_model: str = "gpt-4o-mini"
+    llm_strong_model: str = "gpt-4o"
+    # Pin a stage to one model, bypassing the router
+    llm_select_model: str | None = None
+    llm_plan_model: str | None = None
+    llm_repair_model: str | None = None
+    llm_rewrite_model: str | None = None
+    llm_router_min_success: float = 0.8
+    llm_large_context_chars: int = 20_000
+    llm_stream: bool = True
+    llm_json_mode: bool = True
+    llm_cache_size: int = 1024  # cached responses; 0 disables
+
+    # Speculative planning: candidate plans raced per run (1 = off)
+    plan_candidates: int = 1
+
+    # Batch runs
+    batch_concurrency: int = 4
+
+    # Multi-node: set NODE_URL (this node's base URL as peers reach it) to
+    # join the cluster; repos are routed to nodes by rendezvous hashing
+    node_id: str | None = None  # default: hostname-pid
+    node_url: str | None = None
+    node_heartbeat_sec: float = 5.0
+    node_lease_sec: float = 30.0  # node presumed dead after this
+    session_max_attempts: int = 2
+
+    # Symbol indexes kept on disk per repo (most recent commits)
+    symbol_index_keep: int = 5
+
+    # Idle repo snapshots kept on disk for reuse
+    snapshot_cache_size: int = 8
+
+    # /analyze file listings cached per commit SHA (0 disables)
+    listing_cache_size: int = 256
+
+    # Audit log
+    audit_log_path: str = "audit.log"
+    audit_fsync: str = "always"  # always | interval | never
+    audit_fsync_interval: float = 1.0
+    audit_batch_size: int = 100
+    audit_flush_interval: float = 0.2
+    audit_rotate_bytes: int = 100_000_000
+    audit_rotate_seconds: int = 86_400
+    audit_compress: bool = True
+    audit_checkpoint_every: int = 10_000
+
+    # DB (postgresql://... or sqlite:///path/to/safeagent.db)
     database_url: str = "postgresql://safeagent:safeagent@db:5432/safeagent"
+    sqlite_busy_timeout_ms: int = 5000
+    async_database_url: str | None = None
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_recycle: int = 1800
+    db_pool_timeout: int = 30
 
     # GitHub
     github_token: str | None = None
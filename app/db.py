@@ -1,26 +1,126 @@
-from sqlalchemy import create_engine, Column, String, JSON, Float, DateTime, Text
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import (
+    create_engine,
+    event,
+    Column,
+    String,
+    JSON,
+    Float,
+    DateTime,
+    Text,
+    Index,
+    Integer,
+    LargeBinary,
+    Boolean,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, declarative_base, deferred, sessionmaker
 from datetime import datetime
 from uuid import uuid4
 
 from app.config import settings
+from app.metrics import register_gauge
 
 # -------------------------
 # Database setup
 # -------------------------
 
-engine = create_engine(
-    settings.database_url,
-    pool_pre_ping=True,
-    future=True,
-)
+def _is_sqlite(url: str) -> bool:
+    return url.split(":", 1)[0].split("+")[0] == "sqlite"
+
+
+def _engine_options(url: str) -> dict:
+    if _is_sqlite(url):
+        # SQLite pools per file; connections are shared across threadpool workers
+        return {"connect_args": {"check_same_thread": False}}
+
+    return {
+        "pool_pre_ping": True,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_timeout": settings.db_pool_timeout,
+    }
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets API readers proceed while a pipeline thread writes.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")
+    cursor.close()
+
+
+def async_database_url(url: str) -> str:
+    """
+    Maps the sync DATABASE_URL onto the matching async driver.
+    """
+    if settings.async_database_url:
+        return settings.async_database_url
+
+    scheme, rest = url.split("://", 1)
+    if scheme.split("+")[0] == "postgresql":
+        return f"postgresql+asyncpg://{rest}"
+    if _is_sqlite(url):
+        return f"sqlite+aiosqlite://{rest}"
+
+    raise ValueError(f"No async driver configured for {scheme}")
 
-SessionLocal = sessionmaker(
-    bind=engine,
+
+# Engines are created on first use, so importing app modules never
+# connects to (or requires drivers for) the database.
+_engine = None
+_async_engine = None
+
+
+def get_engine():
+    global _engine
+
+    if _engine is None:
+        _engine = create_engine(
+            settings.database_url,
+            future=True,
+            **_engine_options(settings.database_url),
+        )
+        if _is_sqlite(settings.database_url):
+            event.listen(_engine, "connect", _sqlite_pragmas)
+
+    return _engine
+
+
+def get_async_engine():
+    """
+    Async engine for read endpoints; only processes that serve them
+    need the async driver.
+    """
+    global _async_engine
+
+    if _async_engine is None:
+        url = async_database_url(settings.database_url)
+        _async_engine = create_async_engine(url, **_engine_options(url))
+        if _is_sqlite(url):
+            event.listen(_async_engine.sync_engine, "connect", _sqlite_pragmas)
+
+    return _async_engine
+
+
+_session_factory = sessionmaker(
     autoflush=False,
     autocommit=False,
 )
 
+
+def SessionLocal() -> Session:
+    return _session_factory(bind=get_engine())
+
+
+def AsyncSessionLocal() -> AsyncSession:
+    return AsyncSession(get_async_engine(), expire_on_commit=False)
+
+
 Base = declarative_base()
 
 
@@ -44,15 +144,157 @@ class AgentSession(Base):
     prompt = Column(String, nullable=False)
 
     files_changed = Column(JSON)
-    plan = Column(JSON)
     result = Column(JSON)
     status = Column(String)
     duration_sec = Column(Float)
 
     error = Column(String, nullable=True)
 
-    diff = Column(Text, nullable=True)
-    trace = Column(JSON, nullable=True)
+    # Legacy inline artifacts. New sessions store plan/diff/trace in
+    # session_artifacts; these are only read as a fallback for old rows.
+    plan = deferred(Column(JSON))
+    diff = deferred(Column(Text, nullable=True))
+    trace = deferred(Column(JSON, nullable=True))
+
+    # Keyset pagination for /sessions: newest first, optionally filtered
+    __table_args__ = (
+        Index("ix_agent_sessions_created_at_id", "created_at", "id"),
+        Index("ix_agent_sessions_status_created_at", "status", "created_at", "id"),
+        Index("ix_agent_sessions_repo_created_at", "repo_url", "created_at", "id"),
+    )
+
+
+class Blob(Base):
+    """
+    Content-addressed, zlib-compressed artifact payload.
+    Identical artifacts across sessions are stored once.
+    """
+
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SessionArtifact(Base):
+    """
+    Links a session to its large artifacts (plan, diff, trace).
+    """
+
+    __tablename__ = "session_artifacts"
+
+    session_id = Column(String, primary_key=True)
+    kind = Column(String, primary_key=True)
+    blob_sha256 = Column(String(64), nullable=False)
+    size = Column(Integer, nullable=False)
+
+
+class SessionRollup(Base):
+    """
+    Incrementally maintained counters behind /stats.
+
+    One row per (repo, hour, metric, key): histogram bins for timings,
+    plain counts for status, failure reason and repair attempts.
+    """
+
+    __tablename__ = "session_rollups"
+
+    repo_url = Column(String, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    metric = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (Index("ix_session_rollups_bucket", "bucket"),)
+
+
+class Batch(Base):
+    """
+    One prompt fanned out over many repositories.
+    """
+
+    __tablename__ = "batches"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid4()))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    prompt = Column(String, nullable=False)
+
+
+class BatchItem(Base):
+    """
+    One repository of a batch and the session that ran it.
+    """
+
+    __tablename__ = "batch_items"
+
+    batch_id = Column(String, primary_key=True)
+    position = Column(Integer, primary_key=True)
+    repo_url = Column(String, nullable=False)
+    session_id = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued")
+    error = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class VerificationResult(Base):
+    """
+    Cached verdict for a post-patch tree under a given verifier
+    configuration and test environment.
+    """
+
+    __tablename__ = "verification_results"
+
+    key = Column(String(64), primary_key=True)
+    tree_id = Column(String(40), nullable=False)
+    ok = Column(Boolean, nullable=False)
+    error = Column(String, nullable=True)
+    report = Column(Text, nullable=True)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index("ix_verification_results_last_used", "last_used_at"),)
+
+
+class ClusterNode(Base):
+    """
+    A SafeAgent node and its last heartbeat.
+    """
+
+    __tablename__ = "cluster_nodes"
+
+    id = Column(String, primary_key=True)
+    url = Column(String, nullable=False)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    heartbeat_at = Column(DateTime, nullable=False)
+
+
+class SessionLease(Base):
+    """
+    Work assigned to a node: queued until the node claims it, then running
+    until the session finishes. Leases of dead nodes expire and are
+    claimed by the repo's next owner.
+    """
+
+    __tablename__ = "session_leases"
+
+    session_id = Column(String, primary_key=True)
+    repo_url = Column(String, nullable=False)
+    prompt = Column(String, nullable=False)
+    candidates = Column(Integer, nullable=True)
+    batch_id = Column(String, nullable=True)
+    position = Column(Integer, nullable=True)
+    node_id = Column(String, nullable=False)
+    state = Column(String, nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_session_leases_node_state", "node_id", "state"),
+        Index("ix_session_leases_expires_at", "expires_at"),
+    )
 
 
 # -------------------------
@@ -60,12 +302,28 @@ class AgentSession(Base):
 # -------------------------
 
 
+def insert_stmt(db, model):
+    """
+    Dialect-specific INSERT supporting ON CONFLICT (Postgres and SQLite).
+    """
+    dialect = db.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    return insert(model.__table__)
+
+
 def init_db():
     """
     Call once on app startup to create tables.
+    Indexes are created separately so they also reach tables that
+    existed before the index was declared.
     """
+    engine = get_engine()
     Base.metadata.create_all(bind=engine)
 
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
 
 def get_db():
     """
@@ -76,3 +334,38 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# -------------------------
+# Pool metrics
+# -------------------------
+
+
+def _pool_stat(stat: str):
+    def provider():
+        pools = []
+        if _engine is not None:
+            pools.append(({"pool": "sync"}, _engine.pool))
+        if _async_engine is not None:
+            pools.append(({"pool": "async"}, _async_engine.pool))
+        return [(labels, getattr(pool, stat)()) for labels, pool in pools]
+
+    return provider
+
+
+register_gauge("safeagent_db_pool_size", "Configured pool size", _pool_stat("size"))
+register_gauge(
+    "safeagent_db_pool_checked_out",
+    "Connections currently in use",
+    _pool_stat("checkedout"),
+)
+register_gauge(
+    "safeagent_db_pool_checked_in",
+    "Idle connections in the pool",
+    _pool_stat("checkedin"),
+)
+register_gauge(
+    "safeagent_db_pool_overflow",
+    "Connections opened beyond pool_size",
+    _pool_stat("overflow"),
+)
@@ -0,0 +1,217 @@
+import fcntl
+import glob
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import time
+import tomllib
+from contextlib import contextmanager
+
+from app.config import settings
+
+READY_MARKER = ".safeagent-ready"
+
+# -------------------------------
+# Environment key
+# -------------------------------
+
+
+def lockfiles(repo_path: str) -> list[str]:
+    """
+    Dependency manifests that define a repo's test environment.
+    """
+    names = ["poetry.lock", "pyproject.toml"]
+    names += sorted(
+        os.path.basename(p) for p in glob.glob(os.path.join(repo_path, "requirements*.txt"))
+    )
+    return [n for n in names if os.path.isfile(os.path.join(repo_path, n))]
+
+
+def env_key(repo_path: str) -> str | None:
+    """
+    Hash of the lockfiles plus the interpreter version, or None when the
+    repo declares no dependencies.
+    """
+    names = lockfiles(repo_path)
+    if not names:
+        return None
+
+    h = hashlib.sha256(f"python{sys.version_info[0]}.{sys.version_info[1]}".encode())
+    for name in names:
+        h.update(b"\0" + name.encode() + b"\0")
+        with open(os.path.join(repo_path, name), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:24]
+
+
+# -------------------------------
+# Building
+# -------------------------------
+
+
+def _lock_marker(pkg: dict) -> str | None:
+    """
+    Environment marker of a poetry.lock package. Poetry 2 keys markers by
+    dependency group; every group is installed, so they are ORed, and a
+    group without a marker makes the package unconditional.
+    """
+    markers = pkg.get("markers")
+    if not isinstance(markers, dict):
+        return markers or None
+
+    groups = pkg.get("groups") or list(markers)
+    if any(not markers.get(g) for g in groups):
+        return None
+
+    unique = list(dict.fromkeys(markers[g] for g in groups))
+    if len(unique) == 1:
+        return unique[0]
+    return " or ".join(f"({m})" for m in unique)
+
+
+def requirements(repo_path: str) -> tuple[list[str], list[str]]:
+    """
+    Returns (requirement specs, requirement files) to install.
+
+    poetry.lock pins win over pyproject ranges; the project itself is never
+    installed, since every run tests its own patched checkout.
+    """
+    specs = ["pytest"]
+    files = [
+        os.path.join(repo_path, n)
+        for n in lockfiles(repo_path)
+        if n.startswith("requirements")
+    ]
+
+    lock = os.path.join(repo_path, "poetry.lock")
+    pyproject = os.path.join(repo_path, "pyproject.toml")
+
+    if os.path.exists(lock):
+        with open(lock, "rb") as f:
+            for pkg in tomllib.load(f).get("package", []):
+                if pkg.get("optional"):
+                    continue
+                spec = f"{pkg['name']}=={pkg['version']}"
+                # keep platform-only pins (colorama on Windows) for pip to judge
+                marker = _lock_marker(pkg)
+                if marker:
+                    spec += f"; {marker}"
+                specs.append(spec)
+    elif os.path.exists(pyproject):
+        with open(pyproject, "rb") as f:
+            project = tomllib.load(f).get("project", {})
+        specs += project.get("dependencies", [])
+        for extra in ("test", "tests", "dev"):
+            specs += project.get("optional-dependencies", {}).get(extra, [])
+
+    return specs, files
+
+
+def _build(repo_path: str, path: str):
+    shutil.rmtree(path, ignore_errors=True)
+    subprocess.check_call(
+        [sys.executable, "-m", "venv", path],
+        stdout=subprocess.DEVNULL,
+    )
+
+    specs, files = requirements(repo_path)
+    cmd = [os.path.join(path, "bin", "python"), "-m", "pip", "install", "-q", *specs]
+    for f in files:
+        cmd += ["-r", f]
+
+    try:
+        subprocess.run(
+            cmd,
+            check=True,
+            capture_output=True,
+            text=True,
+            timeout=settings.env_build_timeout_sec,
+        )
+    except subprocess.CalledProcessError as e:
+        shutil.rmtree(path, ignore_errors=True)
+        raise RuntimeError(f"Test environment build failed:\n{e.stderr[-2000:]}")
+    except subprocess.TimeoutExpired:
+        shutil.rmtree(path, ignore_errors=True)
+        raise RuntimeError("Test environment build timed out")
+
+    with open(os.path.join(path, READY_MARKER), "w") as f:
+        f.write(str(time.time()))
+
+
+# -------------------------------
+# Cache
+# -------------------------------
+
+
+def _root() -> str:
+    return os.path.join(settings.workspace_root, "envs")
+
+
+@contextmanager
+def cached_env(repo_path: str):
+    """
+    Yields (python executable or None, info) for running the repo's tests.
+
+    Environments are built once per lockfile hash under an exclusive lock
+    and then shared: users hold a shared lock, so eviction never removes
+    an environment that a test run is using.
+    """
+    key = env_key(repo_path) if settings.env_cache_size > 0 else None
+    if key is None:
+        yield None, {"env": None}
+        return
+
+    os.makedirs(_root(), exist_ok=True)
+    path = os.path.join(_root(), key)
+    info = {"env": key, "env_cache": "hit"}
+
+    with open(path + ".lock", "a+") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+
+        if not os.path.exists(os.path.join(path, READY_MARKER)):
+            # upgrade: another process may finish the build while we wait
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(os.path.join(path, READY_MARKER)):
+                t0 = time.time()
+                _build(repo_path, path)
+                info["env_cache"] = "miss"
+                info["env_build_ms"] = round((time.time() - t0) * 1000, 2)
+            fcntl.flock(lock, fcntl.LOCK_SH)
+
+        os.utime(os.path.join(path, READY_MARKER))
+
+        try:
+            yield os.path.join(path, "bin", "python"), info
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    if info["env_cache"] == "miss":
+        evict()
+
+
+def evict(keep: int | None = None):
+    """
+    Removes least recently used environments beyond ENV_CACHE_SIZE,
+    skipping any that are in use.
+    """
+    keep = settings.env_cache_size if keep is None else keep
+    root = _root()
+
+    envs = []
+    for name in os.listdir(root):
+        marker = os.path.join(root, name, READY_MARKER)
+        if os.path.exists(marker):
+            envs.append((os.path.getmtime(marker), name))
+    envs.sort(reverse=True)
+
+    for _, name in envs[keep:]:
+        path = os.path.join(root, name)
+        with open(path + ".lock", "a+") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            fcntl.flock(lock, fcntl.LOCK_UN)
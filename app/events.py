@@ -0,0 +1,188 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Optional
+
+from app.resources import measure
+
+HISTORY_PER_SESSION = 200
+MAX_TRACKED_SESSIONS = 1000
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+# -------------------------------
+# In-process event bus
+# -------------------------------
+
+
+class Subscription:
+    """
+    One SSE client. Events are pushed from pipeline threads onto the
+    subscriber's event loop, dropping the oldest when the client lags.
+    """
+
+    def __init__(self, session_id: Optional[str], loop: asyncio.AbstractEventLoop):
+        self.session_id = session_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def push(self, event: dict):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class EventBus:
+    """
+    Fan-out of pipeline progress events to live subscribers.
+    Keeps a short per-session history so late subscribers see what they missed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: set[Subscription] = set()
+        self._history: OrderedDict[str, deque] = OrderedDict()
+
+    def publish(self, session_id: str, type: str, **data):
+        event = {"session_id": session_id, "type": type, "ts": time.time(), **data}
+
+        with self._lock:
+            history = self._history.get(session_id)
+            if history is None:
+                history = self._history[session_id] = deque(maxlen=HISTORY_PER_SESSION)
+                if len(self._history) > MAX_TRACKED_SESSIONS:
+                    self._history.popitem(last=False)
+            history.append(event)
+
+            targets = [
+                s
+                for s in self._subscribers
+                if s.session_id is None or s.session_id == session_id
+            ]
+
+        for sub in targets:
+            try:
+                sub.push(event)
+            except RuntimeError:
+                # subscriber's loop already closed
+                self.unsubscribe(sub)
+
+    def subscribe(self, session_id: Optional[str] = None) -> Subscription:
+        """
+        Must be called from the subscriber's event loop.
+        """
+        sub = Subscription(session_id, asyncio.get_running_loop())
+
+        with self._lock:
+            self._subscribers.add(sub)
+            if session_id is not None:
+                for event in self._history.get(session_id, ()):
+                    sub._put(event)
+
+        return sub
+
+    def seen(self, session_id: str) -> bool:
+        """
+        Whether this process has published events for the session recently.
+        """
+        with self._lock:
+            return session_id in self._history
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+
+bus = EventBus()
+
+
+def publish(session_id: str, type: str, **data):
+    bus.publish(session_id, type, **data)
+
+
+@contextmanager
+def stage(session_id: str, name: str, trace: Optional[dict] = None):
+    """
+    Times a pipeline stage, records `<name>_ms` in the trace and publishes
+    start/finish (or failure) events. Resource usage goes to the session's
+    resource log (see app.resources).
+    """
+    publish(session_id, "stage_started", stage=name)
+    t0 = time.time()
+
+    try:
+        with measure(name):
+            yield
+    except Exception as e:
+        ms = round((time.time() - t0) * 1000, 2)
+        publish(session_id, "stage_failed", stage=name, ms=ms, error=str(e))
+        raise
+
+    ms = round((time.time() - t0) * 1000, 2)
+    if trace is not None:
+        trace[f"{name}_ms"] = ms
+    publish(session_id, "stage_finished", stage=name, ms=ms)
+
+
+# -------------------------------
+# Server-sent events
+# -------------------------------
+
+KEEPALIVE_SEC = 15
+# how long a subscriber that announced its repo waits for /run to start
+START_TIMEOUT_SEC = 60
+TERMINAL_EVENTS = {"session_finished"}
+
+
+def _frame(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+async def sse_stream(session_id: Optional[str] = None, start_timeout: float = 0):
+    """
+    Yields SSE frames for one session (ending when it finishes) or for all
+    sessions when session_id is None.
+
+    The bus only carries this process's sessions: a session it has no
+    events for gets `start_timeout` seconds to start here, after which
+    the stream ends with an `error` event instead of idling forever.
+    """
+    sub = bus.subscribe(session_id)
+    waiting = session_id is not None and not bus.seen(session_id)
+    deadline = time.monotonic() + start_timeout
+
+    try:
+        while True:
+            timeout = KEEPALIVE_SEC
+            if waiting:
+                timeout = min(timeout, max(0, deadline - time.monotonic()))
+
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                if waiting and time.monotonic() >= deadline:
+                    yield _frame(
+                        {
+                            "session_id": session_id,
+                            "type": "error",
+                            "ts": time.time(),
+                            "error": "Session is not running on this node",
+                        }
+                    )
+                    return
+                yield ": keepalive\n\n"
+                continue
+
+            waiting = False
+            yield _frame(event)
+
+            if session_id is not None and event["type"] in TERMINAL_EVENTS:
+                return
+    finally:
+        bus.unsubscribe(sub)
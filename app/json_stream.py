@@ -0,0 +1,139 @@
+import json
+from typing import Callable, Iterable, Optional
+
+
+class StreamAbort(ValueError):
+    """
+    Raised as soon as a partial model response is known to be unusable.
+    """
+
+
+class JSONStreamGuard:
+    """
+    Incremental scanner for a streamed JSON completion.
+
+    Tracks string/nesting state character by character so that:
+    - the top-level container type is checked on its first character
+    - object keys are checked against `keys` ({depth: allowed names})
+    - every completed string value is handed to `check` with its key
+    - the end of the top-level value is detected without waiting for
+      trailing commentary
+
+    Anything before the first '{' or '[' (markdown fences, prose) is skipped.
+    """
+
+    def __init__(
+        self,
+        expect: str = "object",
+        check: Optional[Callable[[Optional[str], str, int], None]] = None,
+        keys: Optional[dict[int, set[str]]] = None,
+    ):
+        self.expect = expect
+        self.check = check
+        self.keys = keys
+
+        self.raw = []
+        self.buffer = []
+        self.started = False
+        self.done = False
+
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string = []
+        self._expecting_key = False
+        self._key = None
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Consumes a chunk. Returns True once the top-level value is complete.
+        Raises StreamAbort when the response cannot be valid.
+        """
+        self.raw.append(chunk)
+
+        for ch in chunk:
+            if self.done:
+                return True
+
+            if not self.started:
+                if ch not in "{[":
+                    continue
+                if (ch == "{") != (self.expect == "object"):
+                    raise StreamAbort(
+                        f"Expected a JSON {self.expect}, got one starting with {ch!r}"
+                    )
+                self.started = True
+
+            self.buffer.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    self._string.append(ch)
+                elif ch == "\\":
+                    self._escape = True
+                    self._string.append(ch)
+                elif ch == '"':
+                    self._in_string = False
+                    self._finish_string()
+                else:
+                    self._string.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string = []
+            elif ch in "{[":
+                self._stack.append(ch)
+                self._expecting_key = ch == "{"
+            elif ch in "}]":
+                self._stack.pop()
+                if not self._stack:
+                    self.done = True
+                    return True
+            elif ch == ",":
+                self._expecting_key = self._stack[-1] == "{"
+            elif ch == ":":
+                self._expecting_key = False
+
+        return self.done
+
+    def _finish_string(self):
+        value = json.loads('"' + "".join(self._string) + '"', strict=False)
+        depth = len(self._stack)
+
+        if self._stack[-1] == "{" and self._expecting_key:
+            allowed = self.keys.get(depth) if self.keys else None
+            if allowed is not None and value not in allowed:
+                raise StreamAbort(f"Unexpected key {value!r} at depth {depth}")
+            self._key = value
+            return
+
+        key = self._key if self._stack[-1] == "{" else None
+        if self.check:
+            self.check(key, value, depth)
+
+    def text(self) -> str:
+        return "".join(self.buffer)
+
+
+def path_checker(allowed: Iterable[str], key: Optional[str] = "file_path"):
+    """
+    Builds a `check` callback that aborts on the first path outside `allowed`.
+
+    With key=None, every string directly inside the top-level array is a path
+    (the file selection format); otherwise only values stored under `key`.
+    """
+    allowed = set(allowed)
+
+    def check(k: Optional[str], value: str, depth: int):
+        if key is None:
+            if depth != 1:
+                return
+        elif k != key:
+            return
+
+        if value not in allowed:
+            raise StreamAbort(f"Model referenced a file that does not exist: {value}")
+
+    return check
@@ -1,14 +1,34 @@
+import hashlib
 import json
 import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
 from typing import List
-from openai import OpenAI
 
 from app.models import AgentPlan
 from app.config import settings
+from app.json_stream import JSONStreamGuard, path_checker
+from app.metrics import register_gauge
+from app.model_router import DEFERRED_STAGES, record_call, router
 
-client = OpenAI(api_key=settings.openai_api_key)
 
-MODEL = "gpt-4o-mini"
+@lru_cache(maxsize=1)
+def get_client():
+    """
+    Created on first use so importing the pipeline needs neither
+    credentials nor the openai package's import time.
+    """
+    from openai import OpenAI
+
+    return OpenAI(api_key=settings.openai_api_key)
+
+
+PLAN_KEYS = {1: {"edits"}, 3: {"file_path", "original_hash", "unified_diff"}}
 
 SYSTEM_SELECT = """\
 You are SafeAgent.
@@ -26,9 +46,12 @@ Example:
 ["README.md", "app/main.py"]
 """
 
-SYSTEM_PATCH = """\
+# Shared by planning and repair so both stages send an identical prefix
+SYSTEM_EDIT = """\
 You are SafeAgent, a secure code modification assistant.
 
+You will be given repository files with their hashes, then a task.
+
 You must output ONLY valid JSON in this schema:
 
 {
@@ -45,37 +68,56 @@ Rules:
 - No explanations
 - Do not invent files
 - unified_diff must be valid git apply format
+- Do not change unrelated lines
+"""
+
+TASK_PLAN = """\
+Task: produce a patch plan for the user request below.
 - Only include minimal required changes
 """
 
-SYSTEM_REPAIR = """\
-You are SafeAgent fixing a failed git patch.
+TASK_REPAIR = """\
+Task: a previous diff for the user request below failed to apply.
+Return a corrected plan.
+- Must apply cleanly with git apply
+- The previous diff and the git apply error follow the request
+"""
 
-You will be given:
-- The original user intent
-- The file content
-- The previous diff
-- The git apply error
 
-You must return ONLY valid JSON in this schema:
+# -------------------------------
+# Prompt assembly
+# -------------------------------
 
-{
-  "edits": [
-    {
-      "file_path": "string",
-      "original_hash": "string",
-      "unified_diff": "string"
-    }
-  ]
-}
+# Providers reuse the longest previously seen prompt prefix. Content that is
+# identical across a session's attempts (system prompt, file context,
+# manifest) goes first in a deterministic order and encoding; the request,
+# failed diff and error go last, so retries and repairs only pay for the tail.
 
-Rules:
-- unified_diff must be valid git diff format
-- Must apply cleanly with git apply
-- Do not change unrelated lines
-- Do not invent files
-- No explanations
-"""
+MAX_CONTEXT_CHARS = 4000
+
+
+def file_context(files: dict) -> str:
+    return "".join(
+        f"### {path}\n{files[path][:MAX_CONTEXT_CHARS]}\n\n" for path in sorted(files)
+    )
+
+
+def compact_manifest(files: dict, manifest: dict) -> str:
+    return json.dumps(
+        {path: manifest[path] for path in sorted(files)}, separators=(",", ":")
+    )
+
+
+def assemble(system: str, stable: list[str], volatile: str) -> list[dict]:
+    """
+    System prompt, then the stable parts, then the volatile tail as its own
+    message so the stable prefix ends on the same token boundary each time.
+    """
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": "\n\n".join(stable)},
+        {"role": "user", "content": volatile},
+    ]
 
 
 # -------------------------------
@@ -116,37 +158,255 @@ def extract_json(text: str) -> str:
     return match.group(1)
 
 
+# -------------------------------
+# Response cache
+# -------------------------------
+
+# Completions run at temperature 0, so identical prompts (same request,
+# same file contents and hashes) can share one response. This is what lets
+# a batch over many repos with identical files pay for the model once.
+# Only calls inside response_cache() use it, and entries are scoped to that
+# batch: a retried /run, or a new batch, asks the model again.
+_cache: OrderedDict[str, str] = OrderedDict()
+_cache_scope: ContextVar[str | None] = ContextVar("llm_cache_scope", default=None)
+_inflight: dict[str, Future] = {}
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0}
+
+
+@contextmanager
+def response_cache(scope: str):
+    """
+    Enables the response cache for calls in this context, shared only with
+    other calls under the same `scope` (a batch id).
+    """
+    token = _cache_scope.set(scope)
+    try:
+        yield
+    finally:
+        _cache_scope.reset(token)
+
+
+def _cache_key(*parts: str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _single_flight(key: str, compute) -> str:
+    """
+    Returns the cached value for `key`, or computes it once while concurrent
+    callers with the same key wait for that result. Failures are not cached.
+    """
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            _cache_stats["hits"] += 1
+            return _cache[key]
+
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+            _cache_stats["misses"] += 1
+        else:
+            _cache_stats["hits"] += 1
+
+    if not owner:
+        return future.result()
+
+    try:
+        value = compute()
+    except BaseException as e:
+        with _cache_lock:
+            _inflight.pop(key, None)
+        future.set_exception(e)
+        raise
+
+    with _cache_lock:
+        _inflight.pop(key, None)
+        _cache[key] = value
+        while len(_cache) > settings.llm_cache_size:
+            _cache.popitem(last=False)
+
+    future.set_result(value)
+    return value
+
+
+register_gauge(
+    "safeagent_llm_cache_hits",
+    "LLM responses served from the cache or an in-flight call",
+    lambda: _cache_stats["hits"],
+)
+register_gauge(
+    "safeagent_llm_cache_misses",
+    "LLM responses that required a model call",
+    lambda: _cache_stats["misses"],
+)
+
+
 # -------------------------------
 # Core JSON LLM caller
 # -------------------------------
 
 
-def _ask_json(system: str, user: str, retries: int = 3):
-    last_raw = None
+def _usage(usage) -> dict:
+    if usage is None:
+        return {}
 
-    for i in range(retries):
-        resp = client.chat.completions.create(
-            model=MODEL,
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+    }
+
+
+# Chunks read after the JSON value is complete, waiting for the usage chunk
+USAGE_DRAIN_CHUNKS = 8
+
+
+def _complete(
+    messages: list[dict], guard: JSONStreamGuard, model: str
+) -> tuple[str, dict]:
+    """
+    Runs one completion through `guard`. Returns the raw text and token usage.
+
+    With streaming enabled the stream is closed as soon as the guard aborts,
+    or shortly after it sees the end of the JSON value, so bad or chatty
+    generations stop consuming output tokens.
+    """
+    kwargs = {}
+    if settings.llm_json_mode and guard.expect == "object":
+        kwargs["response_format"] = {"type": "json_object"}
+
+    if not settings.llm_stream:
+        resp = get_client().chat.completions.create(
+            model=model,
             temperature=0,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": user},
-            ],
+            messages=messages,
+            **kwargs,
         )
-
         raw = resp.choices[0].message.content.strip()
-        last_raw = raw
+        guard.feed(raw)
+        return raw, _usage(resp.usage)
+
+    stream = get_client().chat.completions.create(
+        model=model,
+        temperature=0,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs,
+    )
+
+    usage = {}
+    drain = USAGE_DRAIN_CHUNKS
+
+    try:
+        for chunk in stream:
+            if chunk.usage:
+                usage = _usage(chunk.usage)
+            if guard.done:
+                drain -= 1
+                if usage or drain <= 0:
+                    break
+                continue
+            if chunk.choices:
+                guard.feed(chunk.choices[0].delta.content or "")
+    finally:
+        stream.close()
+
+    return "".join(guard.raw).strip(), usage
+
+
+def _ask_json(
+    messages: list[dict],
+    retries: int = 3,
+    expect: str = "object",
+    check=None,
+    keys=None,
+    cache: bool = False,
+    stage: str = "plan",
+):
+    return _ask_json_call(messages, retries, expect, check, keys, cache, stage)[0]
+
+
+def _ask_json_call(
+    messages: list[dict],
+    retries: int = 3,
+    expect: str = "object",
+    check=None,
+    keys=None,
+    cache: bool = False,
+    stage: str = "plan",
+) -> tuple[object, dict | None]:
+    """
+    _ask_json, also returning the call-log entry of the LLM call that
+    produced the answer (None when another caller's answer was reused),
+    so a plan's outcome can be scored against exactly that call.
+    """
+    scope = _cache_scope.get()
+    if cache and scope and settings.llm_cache_size > 0:
+        # keyed on the model too: once the router escalates a stage, cached
+        # answers from the weaker model must not be served for it
+        model = router.choose(stage, sum(len(m["content"]) for m in messages))
+        key = _cache_key(
+            scope, stage, model, expect, json.dumps(messages, sort_keys=True)
+        )
+        produced = {}
+
+        def compute():
+            data, produced["call"] = _ask_json_call(
+                messages, retries, expect, check, keys, stage=stage
+            )
+            return json.dumps(data)
+
+        text = _single_flight(key, compute)
+        return json.loads(text), produced.get("call")
+
+    last_raw = None
+
+    for i in range(retries):
+        guard = JSONStreamGuard(expect, check=check, keys=keys)
+        model = router.choose(stage, sum(len(m["content"]) for m in messages))
+        t0 = time.time()
+        usage = {}
 
         try:
-            cleaned = extract_json(raw)
-            return json.loads(cleaned)
-        except Exception as e:
+            raw, usage = _complete(messages, guard, model)
+
+            if guard.done:
+                data = json.loads(guard.text())
+            else:
+                data = json.loads(extract_json(raw))
+
+            return data, _record(stage, model, t0, True, usage)
+        except ValueError:
+            _record(stage, model, t0, False, usage)
+            last_raw = "".join(guard.raw)
             if i == retries - 1:
                 raise RuntimeError(
                     f"LLM failed JSON after {retries} attempts.\n\nRaw output:\n{last_raw}"
                 )
 
 
+def _record(stage: str, model: str, t0: float, ok: bool, usage: dict):
+    """
+    Logs the call for the session trace and feeds the router. Successful
+    plan/repair calls are scored later, when the plan is applied; the
+    returned log entry travels with the plan for that.
+    """
+    ms = round((time.time() - t0) * 1000, 2)
+    call = record_call(stage, model, ms, ok, usage)
+
+    deferred = ok and stage in DEFERRED_STAGES
+    router.record(stage, model, None if deferred else ok, ms)
+    return call
+
+
 # -------------------------------
 # File selection
 # -------------------------------
@@ -156,8 +416,15 @@ def choose_files(prompt: str, file_list: List[str]) -> List[str]:
     limited = file_list[:300]
 
     data = _ask_json(
-        SYSTEM_SELECT,
-        f"User request:\n{prompt}\n\nFiles:\n{json.dumps(limited, indent=2)}",
+        assemble(
+            SYSTEM_SELECT,
+            [f"Files:\n{json.dumps(limited, separators=(',', ':'))}"],
+            f"User request:\n{prompt}",
+        ),
+        expect="array",
+        check=path_checker(limited, key=None),
+        cache=True,
+        stage="select",
     )
 
     if not isinstance(data, list):
@@ -174,54 +441,48 @@ def choose_files(prompt: str, file_list: List[str]) -> List[str]:
 # Patch planning
 # -------------------------------
 
-
-def build_plan(prompt: str, files: dict, manifest: dict) -> AgentPlan:
-    context = ""
-    for path, content in files.items():
-        context += f"\n### {path}\n{content[:4000]}\n"
-
-    payload = {
-        "prompt": prompt,
-        "files": list(files.keys()),
-        "hashes": {k: manifest[k] for k in files.keys()},
-    }
-
-    data = _ask_json(
-        SYSTEM_PATCH,
-        f"""
-User request:
-{prompt}
-
-Context:
-{context}
-
-Manifest:
-{json.dumps(payload, indent=2)}
-""",
+# Extra instructions for speculative candidates; variant 0 is the plain plan.
+# Each one steers the model towards a different way of expressing the edit.
+PLAN_VARIANTS = [
+    "",
+    "Keep every hunk as small as possible, with exactly three lines of "
+    "unchanged context around each change.",
+    "Replace whole functions or blocks rather than individual lines, so "
+    "hunks do not depend on exact line positions.",
+    "Before answering, re-check every hunk header's line numbers and counts "
+    "against the file content shown above.",
+]
+
+
+def build_plan(prompt: str, files: dict, manifest: dict, variant: int = 0) -> AgentPlan:
+    data, call = _ask_json_call(
+        assemble(
+            SYSTEM_EDIT,
+            [file_context(files), f"Manifest:\n{compact_manifest(files, manifest)}"],
+            f"{TASK_PLAN}\nUser request:\n{prompt}\n{PLAN_VARIANTS[variant]}",
+        ),
+        check=path_checker(files.keys()),
+        keys=PLAN_KEYS,
+        cache=True,
     )
 
-    return AgentPlan(**data)
+    return AgentPlan(**data).produced_by(call)
 
 
 def repair_plan(prompt: str, files: dict, manifest: dict, failed_diff: str, error: str):
-    context = ""
-    for path, content in files.items():
-        context += f"\n### {path}\n{content[:4000]}\n"
-
-    payload = {
-        "prompt": prompt,
-        "files": list(files.keys()),
-        "hashes": {k: manifest[k] for k in files.keys()},
-        "previous_diff": failed_diff,
-        "git_error": error,
-    }
-
-    data = _ask_json(
-        SYSTEM_REPAIR,
-        f"Context:\n{context}\n\nFailure info:\n{json.dumps(payload, indent=2)}",
+    data, call = _ask_json_call(
+        assemble(
+            SYSTEM_EDIT,
+            [file_context(files), f"Manifest:\n{compact_manifest(files, manifest)}"],
+            f"{TASK_REPAIR}\nUser request:\n{prompt}\n\n"
+            f"Previous diff:\n{failed_diff}\n\nGit apply error:\n{error}",
+        ),
+        check=path_checker(files.keys()),
+        keys=PLAN_KEYS,
+        stage="repair",
     )
 
-    return AgentPlan(**data)
+    return AgentPlan(**data).produced_by(call)
 
 
 SYSTEM_REWRITE = """\
@@ -236,27 +497,20 @@ Just the raw file.
 
 
 def repair_full_file(prompt: str, file_path: str, content: str) -> str:
-    resp = client.chat.completions.create(
-        model=MODEL,
-        temperature=0,
-        messages=[
-            {"role": "system", "content": SYSTEM_REWRITE},
-            {
-                "role": "user",
-                "content": f"""
-User intent:
-{prompt}
-
-File: {file_path}
+    model = router.choose("rewrite", len(content))
+    t0 = time.time()
 
-Current content:
-{content}
-
-Task:
-Return the full updated file content with minimal changes.
-""",
-            },
-        ],
+    resp = get_client().chat.completions.create(
+        model=model,
+        temperature=0,
+        messages=assemble(
+            SYSTEM_REWRITE,
+            [f"File: {file_path}\n\nCurrent content:\n{content}"],
+            f"User intent:\n{prompt}\n\n"
+            "Task:\nReturn the full updated file content with minimal changes.",
+        ),
     )
 
-    return resp.choices[0].message.content.strip()
+    text = resp.choices[0].message.content.strip()
+    _record("rewrite", model, t0, bool(text), _usage(resp.usage))
+    return text
@@ -1,10 +1,28 @@
-from fastapi import FastAPI, HTTPException
-from app.models import AgentRequest
-from app.llm import choose_files, build_plan
-from app.sandbox import execute_plan
-from app.snapshot import clone_repo, load_files, hash_files
-from app.db import init_db, SessionLocal, AgentSession
-from app.models import AgentSessionOut
+import base64
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
+from sqlalchemy import select, tuple_
+from sqlalchemy.exc import IntegrityError
+
+from app import cluster
+from app.models import AgentRequest, BatchRequest
+from app.batch import batch_progress, submit_batch
+from app.pipeline import run_pipeline
+from app.sandbox import execute_plan, replay_session
+from app.snapshot import clone_repo
+from app.workspace import list_files
+from app.db import init_db, AsyncSessionLocal, AgentSession, SessionLocal
+from app.models import AgentSessionOut, AgentSessionDetail
+from app.artifacts import aget_artifact, aartifact_sizes
+from app.audit import audit_status
+from app.events import START_TIMEOUT_SEC, sse_stream
+from app.metrics import render as render_metrics
+from app.model_router import seed_router
+from app.stats import BUCKET_SIZES, rollup_query, summarize
 
 app = FastAPI()
 
@@ -12,59 +30,88 @@ app = FastAPI()
 @app.on_event("startup")
 def startup():
     init_db()
+    seed_router()
+    cluster.start()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    cluster.stop()
 
 
 @app.post("/analyze")
 def analyze(req: AgentRequest):
-    repo = clone_repo(req.repo_url)
-    files = load_files(repo, content=False)
-    return {"files": list(files.keys())}
+    """
+    Lists the repo's files at its remote HEAD. Repeat calls for an
+    unchanged repo cost one ls-remote and leave nothing on disk.
+    """
+    commit, files = list_files(req.repo_url)
+    return {"commit": commit, "files": files}
 
 
 @app.post("/run")
-def run(req: AgentRequest):
-    repo = clone_repo(req.repo_url)
-
-    # Phase 1: discover files
-    all_files = load_files(repo, content=False)
-    file_list = list(all_files.keys())
-
-    # Phase 2: model selects relevant files
-    selected = choose_files(req.prompt, file_list)
-
-    if not selected:
-        db = SessionLocal()
-        try:
-            session = AgentSession(
+def run(req: AgentRequest, routed: bool = False):
+    """
+    In a cluster, requests for a repo owned by another node are redirected
+    there (307 keeps the method and body) so its caches stay warm. A
+    redirected request is always run where it lands.
+
+    Clients that want live events pass their own `session_id` and open
+    /sessions/{id}/events?repo_url=... before posting; that stream is
+    redirected to the same node.
+    """
+    target = None if routed else cluster.redirect_url(req.repo_url)
+    if target:
+        return RedirectResponse(f"{target}/run?routed=true", status_code=307)
+
+    session_id = str(req.session_id or uuid4())
+    with SessionLocal() as db:
+        # reserves the id: of two concurrent runs with one id, one insert fails
+        db.add(
+            AgentSession(
+                id=session_id,
                 repo_url=req.repo_url,
                 prompt=req.prompt,
                 files_changed=[],
-                status="rejected",
-                error="Model did not select any files",
-                trace={"rejection_reason": "no_files_selected"},
+                status="queued",
             )
-            db.add(session)
+        )
+        try:
             db.commit()
-        finally:
-            db.close()
+        except IntegrityError:
+            raise HTTPException(409, "Session id already in use")
 
-        raise HTTPException(400, "Model did not select any files")
+    with cluster.held(session_id, req.repo_url, req.prompt, req.candidates):
+        result = run_pipeline(
+            req.repo_url, req.prompt, session_id, candidates=req.candidates
+        )
 
-    # Phase 3: load only selected files
-    files = load_files(repo, include=selected)
-    manifest = hash_files(repo)
+    if result["status"] == "rejected":
+        raise HTTPException(400, result["error"])
 
-    # Phase 4: build patch plan
-    plan = build_plan(req.prompt, files, manifest)
+    return result
 
-    # Phase 5: execute plan
-    pr = execute_plan(req.repo_url, plan, req.prompt)
 
-    return {
-        "status": "success",
-        "files_used": selected,
-        "pull_request": pr,
-    }
+@app.post("/batch", status_code=202)
+def batch(req: BatchRequest):
+    """
+    Queues one prompt against many repositories. Progress is polled
+    from GET /batch/{id}.
+    """
+    if not req.repo_urls:
+        raise HTTPException(400, "repo_urls must not be empty")
+
+    return {"batch_id": submit_batch(req.repo_urls, req.prompt, req.candidates)}
+
+
+@app.get("/batch/{batch_id}")
+async def get_batch(batch_id: str):
+    async with AsyncSessionLocal() as db:
+        progress = await batch_progress(db, batch_id)
+
+    if progress is None:
+        raise HTTPException(404, "Batch not found")
+    return progress
 
 
 @app.post("/run_manual")
@@ -119,57 +166,201 @@ def run_manual(req: AgentRequest):
     return {"status": "validated", "pr": pr}
 
 
-@app.get("/sessions", response_model=list[AgentSessionOut])
-def list_sessions(limit: int = 20):
-    db = SessionLocal()
+MAX_PAGE_SIZE = 200
+
+
+def _naive_utc(value: datetime | None) -> datetime | None:
+    """
+    Stored timestamps are naive UTC; aware query bounds are converted to
+    match so Postgres and SQLite compare them the same way.
+    """
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _encode_cursor(row: AgentSession) -> str:
+    raw = f"{row.created_at.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, str]:
     try:
-        rows = (
-            db.query(AgentSession)
-            .order_by(AgentSession.created_at.desc())
-            .limit(limit)
-            .all()
+        created, session_id = base64.urlsafe_b64decode(cursor).decode().split("|", 1)
+        return datetime.fromisoformat(created), session_id
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
+
+@app.get("/sessions", response_model=list[AgentSessionOut])
+async def list_sessions(
+    response: Response,
+    limit: int = 20,
+    cursor: str | None = None,
+    repo_url: str | None = None,
+    status: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """
+    Newest sessions first. When more rows exist, the X-Next-Cursor header
+    holds the cursor for the next page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    since, until = _naive_utc(since), _naive_utc(until)
+
+    query = select(AgentSession)
+
+    if repo_url:
+        query = query.where(AgentSession.repo_url == repo_url)
+    if status:
+        query = query.where(AgentSession.status == status)
+    if since:
+        query = query.where(AgentSession.created_at >= since)
+    if until:
+        query = query.where(AgentSession.created_at < until)
+    if cursor:
+        query = query.where(
+            tuple_(AgentSession.created_at, AgentSession.id)
+            < tuple_(*_decode_cursor(cursor))
         )
-        return rows
-    finally:
-        db.close()
 
+    query = query.order_by(
+        AgentSession.created_at.desc(), AgentSession.id.desc()
+    ).limit(limit + 1)
 
-@app.get("/sessions/{session_id}")
-def get_session(session_id: str):
-    db = SessionLocal()
-    try:
-        row = db.query(AgentSession).filter_by(id=session_id).first()
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(query)).scalars().all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1])
+
+    return rows
+
+
+@app.get("/sessions/{session_id}", response_model=AgentSessionDetail)
+async def get_session(session_id: str):
+    """
+    Session metadata only; large artifacts are served by /plan, /diff, /trace.
+    """
+    async with AsyncSessionLocal() as db:
+        row = await db.get(AgentSession, session_id)
         if not row:
             raise HTTPException(404, "Session not found")
-        return row
-    finally:
-        db.close()
 
+        detail = AgentSessionDetail.model_validate(row)
+        detail.artifacts = await aartifact_sizes(db, session_id)
+        return detail
 
-@app.get("/diff/{session_id}")
-def get_diff(session_id: str):
-    db = SessionLocal()
+
+@app.post("/sessions/{session_id}/replay")
+def replay(session_id: str):
+    """
+    Deterministically re-runs a stored session (same commit, same plan,
+    no LLM calls, no PR) and diffs the new trace against the original.
+    """
     try:
-        row = db.query(AgentSession).filter_by(id=session_id).first()
-        if not row:
+        return replay_session(session_id)
+    except LookupError:
+        raise HTTPException(404, "Session not found")
+    except ValueError as e:
+        raise HTTPException(409, str(e))
+
+
+@app.get("/sessions/{session_id}/events")
+def session_events(session_id: str, repo_url: str | None = None, routed: bool = False):
+    """
+    Live progress of one session as server-sent events.
+
+    Events only exist on the node running the session, so in a cluster
+    the stream is redirected there: to the lease holder, or for a session
+    not started yet to the owner of `repo_url`. Passing `repo_url` also
+    lets the stream wait for the session to start; a session unknown here
+    otherwise ends with an `error` event.
+    """
+    target = None if routed else cluster.session_url(session_id, repo_url)
+    if target:
+        params = {"repo_url": repo_url} if repo_url else {}
+        query = urlencode({**params, "routed": "true"})
+        return RedirectResponse(
+            f"{target}/sessions/{session_id}/events?{query}", status_code=307
+        )
+
+    return StreamingResponse(
+        sse_stream(session_id, START_TIMEOUT_SEC if repo_url else 0),
+        media_type="text/event-stream",
+    )
+
+
+@app.get("/events")
+async def all_events():
+    """
+    Live progress of every session handled by this worker.
+    """
+    return StreamingResponse(sse_stream(), media_type="text/event-stream")
+
+
+async def _artifact_or_404(session_id: str, kind: str):
+    async with AsyncSessionLocal() as db:
+        exists = (
+            await db.execute(select(AgentSession.id).where(AgentSession.id == session_id))
+        ).first()
+        if not exists:
             raise HTTPException(404, "Session not found")
-        return {"diff": row.diff}
-    finally:
-        db.close()
+        return await aget_artifact(db, session_id, kind)
+
+
+@app.get("/plan/{session_id}")
+async def get_plan(session_id: str):
+    return {"plan": await _artifact_or_404(session_id, "plan")}
+
+
+@app.get("/diff/{session_id}")
+async def get_diff(session_id: str):
+    return {"diff": await _artifact_or_404(session_id, "diff")}
 
 
 @app.get("/trace/{session_id}")
-def get_trace(session_id: str):
-    db = SessionLocal()
-    try:
-        row = db.query(AgentSession).filter_by(id=session_id).first()
-        if not row:
-            raise HTTPException(404, "Session not found")
-        return {"trace": row.trace}
-    finally:
-        db.close()
+async def get_trace(session_id: str):
+    return {"trace": await _artifact_or_404(session_id, "trace")}
+
+
+@app.get("/stats")
+async def stats(
+    repo_url: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    bucket: str = "day",
+):
+    """
+    Timing percentiles, repair-attempt and failure-reason distributions per
+    repo and time bucket, served from the hourly rollups.
+    """
+    if bucket not in BUCKET_SIZES:
+        raise HTTPException(400, f"bucket must be one of {sorted(BUCKET_SIZES)}")
+
+    async with AsyncSessionLocal() as db:
+        rows = (
+            await db.execute(rollup_query(repo_url, _naive_utc(since), _naive_utc(until)))
+        ).all()
+
+    return {"bucket": bucket, "groups": summarize(rows, bucket)}
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics())
 
 
 @app.get("/health")
-def health():
+def health(response: Response):
+    """
+    503 while audit entries cannot be written, so the node is taken out
+    of rotation instead of running sessions without an audit trail.
+    """
+    audit = audit_status()
+    if audit["pending"] or audit["dropped"]:
+        response.status_code = 503
+        return {"status": "degraded", "audit": audit}
     return {"status": "ok"}
@@ -0,0 +1,37 @@
+from typing import Callable
+
+# name -> (help text, provider returning a value or [(labels, value), ...])
+_gauges: dict[str, tuple[str, Callable]] = {}
+
+
+def register_gauge(name: str, help: str, provider: Callable):
+    _gauges[name] = (help, provider)
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return "{" + inner + "}"
+
+
+def render() -> str:
+    """
+    Prometheus text exposition of all registered gauges.
+    """
+    lines = []
+
+    for name, (help, provider) in sorted(_gauges.items()):
+        try:
+            value = provider()
+        except Exception:
+            continue
+
+        samples = value if isinstance(value, list) else [({}, value)]
+
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, v in samples:
+            lines.append(f"{name}{_labels(labels)} {v}")
+
+    return "\n".join(lines) + "\n"
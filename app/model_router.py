@@ -0,0 +1,236 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.config import settings
+from app.metrics import register_gauge
+
+STAGES = ("select", "plan", "repair", "rewrite")
+
+# Stages whose success is only known once the plan has been applied
+DEFERRED_STAGES = {"plan", "repair"}
+
+# Outcomes kept per (stage, model)
+WINDOW = 200
+
+# Fewer observations than this and a model is assumed to be good enough
+MIN_SAMPLES = 10
+
+# -------------------------------
+# Per-session call log
+# -------------------------------
+
+_calls: ContextVar[list | None] = ContextVar("llm_calls", default=None)
+_outcome_lock = threading.Lock()
+
+
+@contextmanager
+def llm_call_log():
+    """
+    Collects every LLM call made in this context (and in threads started
+    with its copied context). Nested uses share the outer log.
+    """
+    calls = _calls.get()
+    if calls is not None:
+        yield calls
+        return
+
+    calls = []
+    token = _calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _calls.reset(token)
+
+
+def record_call(stage: str, model: str, ms: float, ok: bool, usage=None) -> dict:
+    """
+    Logs a call for the session trace and returns its entry, which
+    record_outcome() later scores.
+    """
+    entry = {"stage": stage, "model": model, "ms": ms, "ok": ok}
+    if usage:
+        entry.update(usage)
+
+    calls = _calls.get()
+    if calls is not None:
+        calls.append(entry)
+    return entry
+
+
+def llm_call_count() -> int:
+    return len(_calls.get() or [])
+
+
+def llm_tokens(start: int = 0) -> dict:
+    """
+    Token totals of the calls logged from index `start` on.
+    """
+    tokens = {"prompt": 0, "completion": 0, "cached": 0}
+    for call in (_calls.get() or [])[start:]:
+        tokens["prompt"] += call.get("prompt_tokens", 0)
+        tokens["completion"] += call.get("completion_tokens", 0)
+        tokens["cached"] += call.get("cached_tokens", 0)
+    return tokens
+
+
+def llm_trace() -> dict:
+    """
+    Trace fields for the calls logged so far: the calls and token totals,
+    with the share of prompt tokens served from the provider's prefix cache.
+    """
+    calls = list(_calls.get() or [])
+    if not calls:
+        return {}
+
+    tokens = llm_tokens()
+    if tokens["prompt"]:
+        tokens["cached_ratio"] = round(tokens["cached"] / tokens["prompt"], 3)
+
+    return {"llm_calls": calls, "llm_tokens": tokens}
+
+
+def record_outcome(call: dict | None, ok: bool):
+    """
+    Attributes a downstream result (e.g. whether a plan applied) to the
+    model of the LLM call that produced it: the `llm_call` of the plan.
+    Each call is scored once; plans reused from the response cache carry
+    no call and score nothing.
+    """
+    if not call:
+        return
+
+    with _outcome_lock:
+        if not call["ok"] or "outcome" in call:
+            return
+        call["outcome"] = ok
+    router.record(call["stage"], call["model"], ok)
+
+
+# -------------------------------
+# Router
+# -------------------------------
+
+
+class ModelRouter:
+    """
+    Chooses a model per pipeline stage from observed success and latency.
+
+    Models are tried in escalation order (fast, then strong). Select and
+    first-attempt plans start at the fast model; repairs and large-context
+    rewrites start at the strong one. The first model in order whose
+    success rate meets LLM_ROUTER_MIN_SUCCESS is used, unless a later
+    eligible model has been clearly faster.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._outcomes: dict[tuple[str, str], deque] = {}
+        self._latency: dict[tuple[str, str], float] = {}
+
+    def record(self, stage: str, model: str, ok: bool | None, ms: float | None = None):
+        """
+        Records an outcome and/or a latency sample (ok=None: latency only).
+        """
+        key = (stage, model)
+        with self._lock:
+            if ok is not None:
+                self._outcomes.setdefault(key, deque(maxlen=WINDOW)).append(bool(ok))
+            if ms is not None:
+                prev = self._latency.get(key)
+                self._latency[key] = ms if prev is None else 0.8 * prev + 0.2 * ms
+
+    def success_rate(self, stage: str, model: str) -> float | None:
+        with self._lock:
+            outcomes = self._outcomes.get((stage, model))
+            if not outcomes or len(outcomes) < MIN_SAMPLES:
+                return None
+            return sum(outcomes) / len(outcomes)
+
+    def latency(self, stage: str, model: str) -> float | None:
+        with self._lock:
+            return self._latency.get((stage, model))
+
+    def order(self, stage: str, context_chars: int = 0) -> list[str]:
+        fast, strong = settings.llm_fast_model, settings.llm_strong_model
+        if stage == "repair":
+            return [strong]
+        if stage == "rewrite" and context_chars >= settings.llm_large_context_chars:
+            return [strong]
+        return [fast, strong] if fast != strong else [fast]
+
+    def choose(self, stage: str, context_chars: int = 0) -> str:
+        pinned = getattr(settings, f"llm_{stage}_model", None)
+        if pinned:
+            return pinned
+
+        order = self.order(stage, context_chars)
+        eligible = []
+        for model in order:
+            rate = self.success_rate(stage, model)
+            if rate is None or rate >= settings.llm_router_min_success:
+                eligible.append(model)
+
+        if not eligible:
+            # nothing meets the bar: take the most reliable
+            return max(order, key=lambda m: self.success_rate(stage, m) or 0.0)
+
+        chosen = eligible[0]
+        for model in eligible[1:]:
+            a, b = self.latency(stage, chosen), self.latency(stage, model)
+            if a is not None and b is not None and b < 0.8 * a:
+                chosen = model
+        return chosen
+
+    def seed(self, traces):
+        """
+        Replays `llm_calls` from stored session traces, oldest first.
+        """
+        for trace in traces:
+            for call in (trace or {}).get("llm_calls", []):
+                stage = call.get("stage")
+                if stage not in STAGES:
+                    continue
+
+                ok = call.get("ok")
+                if stage in DEFERRED_STAGES and ok:
+                    ok = call.get("outcome")
+                self.record(stage, call["model"], ok, call.get("ms"))
+
+    def snapshot(self) -> list[tuple[dict, float]]:
+        with self._lock:
+            keys = list(self._outcomes)
+        samples = []
+        for stage, model in keys:
+            rate = self.success_rate(stage, model)
+            if rate is not None:
+                samples.append(({"stage": stage, "model": model}, round(rate, 3)))
+        return samples
+
+
+router = ModelRouter()
+
+
+def seed_router(limit: int = 500):
+    """
+    Warms the router with the LLM calls of the most recent sessions.
+    """
+    from sqlalchemy import select
+
+    from app.artifacts import get_artifact
+    from app.db import SessionLocal, AgentSession
+
+    with SessionLocal() as db:
+        ids = db.execute(
+            select(AgentSession.id).order_by(AgentSession.created_at.desc()).limit(limit)
+        ).scalars().all()
+        traces = [get_artifact(db, sid, "trace") for sid in reversed(ids)]
+
+    router.seed(traces)
+
+register_gauge(
+    "safeagent_llm_success_rate",
+    "Observed success rate per stage and model",
+    router.snapshot,
+)
@@ -1,6 +1,7 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, PrivateAttr
+from typing import Dict, List, Optional
 from datetime import datetime
+from uuid import UUID
 
 
 class FileEdit(BaseModel):
@@ -12,10 +13,34 @@ class FileEdit(BaseModel):
 class AgentPlan(BaseModel):
     edits: List[FileEdit]
 
+    # Call-log entry of the LLM call that produced the plan, scored once
+    # the plan has been applied (see model_router.record_outcome). Never
+    # serialized or accepted from clients.
+    _llm_call: Optional[dict] = PrivateAttr(default=None)
+
+    def produced_by(self, call: Optional[dict]) -> "AgentPlan":
+        self._llm_call = call
+        return self
+
+    @property
+    def llm_call(self) -> Optional[dict]:
+        return self._llm_call
+
 
 class AgentRequest(BaseModel):
     repo_url: str
     prompt: str
+    # Speculative plan candidates to race; defaults to PLAN_CANDIDATES
+    candidates: Optional[int] = None
+    # Chosen by the client so it can follow /sessions/{id}/events from the
+    # start; generated when omitted
+    session_id: Optional[UUID] = None
+
+
+class BatchRequest(BaseModel):
+    repo_urls: List[str]
+    prompt: str
+    candidates: Optional[int] = None
 
 
 class AgentSessionOut(BaseModel):
@@ -30,3 +55,8 @@ class AgentSessionOut(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class AgentSessionDetail(AgentSessionOut):
+    result: Optional[dict] = None
+    artifacts: Dict[str, int] = {}
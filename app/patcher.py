@@ -1,5 +1,7 @@
 import subprocess, tempfile
 
+from app.resources import check_output
+
 
 def apply_patch(repo_path: str, unified_diff: str):
     import tempfile
@@ -10,7 +12,7 @@ def apply_patch(repo_path: str, unified_diff: str):
         patch_file = f.name
 
     try:
-        subprocess.check_output(
+        check_output(
             [
                 "git",
                 "apply",
@@ -0,0 +1,203 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from contextvars import copy_context
+from uuid import uuid4
+
+from app import cluster
+from app.artifacts import put_artifact
+from app.db import SessionLocal, AgentSession
+from app.events import publish, stage
+from app.config import settings
+from app.llm import PLAN_VARIANTS, choose_files, build_plan
+from app.model_router import llm_call_log, llm_trace
+from app.resources import resource_log, resource_trace
+from app.sandbox import execute_plan
+from app.snapshot import load_files
+from app.workspace import snapshot
+from app.stats import record_session
+
+NO_FILES_SELECTED = "Model did not select any files"
+
+
+def _finish_early(
+    session_id: str,
+    repo_url: str,
+    prompt: str,
+    status: str,
+    error: str,
+    trace: dict,
+    duration_sec: float | None = None,
+):
+    """
+    Records a session that ended before its plan was executed (rejected,
+    or failed while discovering, selecting or planning) and publishes
+    session_finished.
+    """
+    failed = status == "failed"
+
+    with SessionLocal() as db:
+        if not cluster.holds(db, session_id):
+            return
+        # merge: /run reserves the row up front
+        db.merge(
+            AgentSession(
+                id=session_id,
+                repo_url=repo_url,
+                prompt=prompt,
+                files_changed=[],
+                status=status,
+                error=error,
+                duration_sec=duration_sec,
+            )
+        )
+        put_artifact(
+            db,
+            session_id,
+            "trace",
+            {**trace, **llm_trace(), **resource_trace()},
+        )
+        record_session(
+            db, repo_url, status, trace, duration_sec, error=error if failed else None
+        )
+        db.commit()
+
+    if failed:
+        publish(
+            session_id,
+            "session_finished",
+            status=status,
+            duration_sec=duration_sec,
+            error=error,
+        )
+    else:
+        publish(session_id, "session_finished", status=status)
+
+
+def build_candidates(prompt: str, files: dict, manifest: dict, k: int):
+    """
+    Requests `k` plan variants concurrently. Returns the first plan to
+    arrive and an iterator yielding the others as they arrive, so each can
+    start racing without waiting for the slowest call. Variants whose
+    generation fails are dropped; raises only if none succeed.
+    """
+    pool = ThreadPoolExecutor(max_workers=k)
+    # copied contexts keep the calls in this session's LLM call log
+    futures = [
+        pool.submit(copy_context().run, build_plan, prompt, files, manifest, variant)
+        for variant in range(k)
+    ]
+    pool.shutdown(wait=False)
+
+    arrivals = as_completed(futures)
+    errors = []
+    for future in arrivals:
+        try:
+            return future.result(), _succeeded(arrivals)
+        except Exception as e:
+            errors.append(e)
+
+    raise errors[0]
+
+
+def _succeeded(futures):
+    for future in futures:
+        try:
+            yield future.result()
+        except Exception:
+            pass
+
+
+def run_pipeline(
+    repo_url: str,
+    prompt: str,
+    session_id: str | None = None,
+    candidates: int | None = None,
+) -> dict:
+    """
+    Full prompt-to-PR run for one repository: discover, select, plan, execute.
+    Shared by /run and batch workers.
+    """
+    start = time.time()
+    session_id = session_id or str(uuid4())
+    k = max(1, min(candidates or settings.plan_candidates, len(PLAN_VARIANTS)))
+    publish(session_id, "session_started", repo_url=repo_url, prompt=prompt)
+
+    with ExitStack() as cleanup:
+        cleanup.enter_context(llm_call_log())
+        cleanup.enter_context(resource_log())
+
+        try:
+            # Phase 1: discover files (clone and listing are shared with
+            # concurrent runs on the same commit)
+            with stage(session_id, "discover"):
+                snap = cleanup.enter_context(snapshot(repo_url))
+                file_list = snap.files
+
+            # Phase 2: model selects relevant files
+            with stage(session_id, "select"):
+                selected = choose_files(prompt, file_list)
+
+            if not selected:
+                _finish_early(
+                    session_id,
+                    repo_url,
+                    prompt,
+                    "rejected",
+                    NO_FILES_SELECTED,
+                    {"rejection_reason": "no_files_selected"},
+                )
+                return {
+                    "session_id": session_id,
+                    "status": "rejected",
+                    "error": NO_FILES_SELECTED,
+                }
+
+            # Phase 3: load only selected files
+            files = load_files(snap.path, include=selected)
+            manifest = snap.manifest
+
+            # Phase 4: build patch plan (or k speculative candidates; the
+            # first is returned as soon as it exists, the rest stream into
+            # the race in phase 5)
+            with stage(session_id, "plan"):
+                plan, alternatives = build_candidates(prompt, files, manifest, k)
+
+        except Exception as e:
+            # execute_plan records its own failures; these happen before it
+            _finish_early(
+                session_id,
+                repo_url,
+                prompt,
+                "failed",
+                str(e),
+                {},
+                round(time.time() - start, 2),
+            )
+            return {"session_id": session_id, "status": "failed", "error": str(e)}
+
+        # Phase 5: execute plan in a worktree forked from the snapshot
+        pr = execute_plan(
+            repo_url,
+            plan,
+            prompt,
+            session_id=session_id,
+            snapshot=snap,
+            alternatives=alternatives if k > 1 else None,
+            files=files,
+        )
+
+    if isinstance(pr, dict):
+        return {
+            "session_id": session_id,
+            "status": "failed",
+            "files_used": selected,
+            "error": pr["error"],
+        }
+
+    return {
+        "session_id": session_id,
+        "status": "success",
+        "files_used": selected,
+        "pull_request": pr,
+    }
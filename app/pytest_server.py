@@ -0,0 +1,216 @@
+"""
+Warm pytest worker, run by a cached test environment's interpreter:
+
+    python -I pytest_server.py SOCKET_PATH PRELOAD_JSON IDLE_SECONDS
+
+Imports pytest, its plugins and the given third-party modules once, then
+forks a fresh child per request, so each run starts with those imports
+already done. Standard library only: this runs outside SafeAgent's
+environment.
+
+Protocol (one request per connection):
+    client -> {"cwd": ..., "args": [...], "limits": {...}}\\n
+    server -> \\0PID <pid>\\n, the child's output, [\\0ERROR "..."\\n,]
+              \\0RUSAGE {...}\\n, \\0EXIT <code>\\n
+
+Each child leads its own process group, so the client can kill it together
+with any subprocesses its tests started.
+"""
+
+import importlib
+import json
+import os
+import select
+import signal
+import socket
+import sys
+
+
+def preload(modules):
+    import pytest  # noqa: F401
+
+    try:
+        from importlib.metadata import entry_points
+
+        for ep in entry_points(group="pytest11"):
+            try:
+                ep.load()
+            except Exception:
+                pass
+    except Exception:
+        pass
+
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except BaseException:
+            # a module failing to import here just stays cold
+            pass
+
+
+def apply_limits(limits):
+    import resource
+
+    if limits.get("cpu_seconds"):
+        cpu = limits["cpu_seconds"]
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+    if limits.get("memory_mb"):
+        mem = limits["memory_mb"] * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (mem, mem))
+    if limits.get("cgroup"):
+        with open(os.path.join(limits["cgroup"], "cgroup.procs"), "w") as f:
+            f.write("0")
+
+
+def run_child(listener, conn, request, err_w):
+    listener.close()
+    os.dup2(conn.fileno(), 1)
+    os.dup2(conn.fileno(), 2)
+    sys.stdout = os.fdopen(1, "w", buffering=1)
+    sys.stderr = sys.stdout
+
+    code = 1
+    try:
+        apply_limits(request.get("limits") or {})
+        os.chdir(request["cwd"])
+        sys.path.insert(0, request["cwd"])
+
+        import pytest
+
+        code = int(pytest.main(request.get("args") or ["-q"]))
+    except BaseException as e:
+        # pytest may have swapped sys.stdout, so report through the server
+        os.write(err_w, repr(e).encode()[:4096])
+    finally:
+        sys.stdout.flush()
+        os._exit(code)
+
+
+def handle(listener, conn, active, wake):
+    with conn.makefile("rb") as f:
+        request = json.loads(f.readline())
+
+    # the child waits on `go` so the PID line precedes its output
+    go_r, go_w = os.pipe()
+    err_r, err_w = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for fd in wake:
+            os.close(fd)
+        os.setpgid(0, 0)
+        os.close(go_w)
+        os.close(err_r)
+        os.read(go_r, 1)
+        os.close(go_r)
+        run_child(listener, conn, request, err_w)
+
+    try:
+        os.setpgid(pid, pid)
+    except OSError:
+        # the child got there first
+        pass
+    os.close(go_r)
+    os.close(err_w)
+    os.set_blocking(err_r, False)
+    active[pid] = (conn, err_r)
+
+    try:
+        conn.sendall(f"\0PID {pid}\n".encode())
+    except OSError:
+        pass
+    os.write(go_w, b"1")
+    os.close(go_w)
+
+
+def finish(conn, err_r, status, rusage):
+    code = os.waitstatus_to_exitcode(status)
+    try:
+        error = os.read(err_r, 4096).decode(errors="replace")
+    except BlockingIOError:
+        error = ""
+    os.close(err_r)
+    usage = {
+        "user": rusage.ru_utime,
+        "sys": rusage.ru_stime,
+        "maxrss": rusage.ru_maxrss,
+        "inblock": rusage.ru_inblock,
+        "oublock": rusage.ru_oublock,
+    }
+
+    trailer = f"\n\0RUSAGE {json.dumps(usage)}\n\0EXIT {code}\n"
+    if error:
+        trailer = f"\n\0ERROR {json.dumps(error)}" + trailer
+    try:
+        conn.sendall(trailer.encode())
+    except OSError:
+        pass
+    conn.close()
+
+
+def reap(active):
+    """
+    Finishes every child that has exited, without blocking.
+    """
+    while active:
+        try:
+            pid, status, rusage = os.wait4(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        if pid in active:
+            finish(*active.pop(pid), status, rusage)
+
+
+def main():
+    path, modules, idle = sys.argv[1], json.loads(sys.argv[2]), float(sys.argv[3])
+
+    preload(modules)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    tmp = f"{path}.{os.getpid()}"
+    listener.bind(tmp)
+    listener.listen(64)
+    os.rename(tmp, path)
+    inode = os.stat(path).st_ino
+
+    # children are reaped from this loop, woken by SIGCHLD through a pipe:
+    # no threads run next to os.fork()
+    wake = os.pipe()
+    for fd in wake:
+        os.set_blocking(fd, False)
+    signal.set_wakeup_fd(wake[1])
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    active = {}
+
+    while True:
+        ready, _, _ = select.select([listener, wake[0]], [], [], idle)
+
+        if wake[0] in ready:
+            while True:
+                try:
+                    os.read(wake[0], 4096)
+                except BlockingIOError:
+                    break
+            reap(active)
+
+        if listener in ready:
+            conn, _ = listener.accept()
+            conn.settimeout(None)
+            handle(listener, conn, active, wake)
+        elif not ready and not active:
+            break
+
+    try:
+        if os.stat(path).st_ino == inode:
+            os.unlink(path)
+    except OSError:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import os
+import resource
+import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.model_router import llm_call_count, llm_tokens
+
+# ru_maxrss is in KiB on Linux and bytes on macOS
+_RSS_TO_MB = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024
+
+# High-water marks: merged with max() instead of summed. The server's
+# own peak is process-wide and covers its whole lifetime, not one stage.
+PEAK_FIELDS = ("process_peak_rss_mb", "children_peak_rss_mb")
+
+_THREAD = getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF)
+
+# -------------------------------
+# Sampling
+# -------------------------------
+
+
+def _io() -> tuple[int, int]:
+    """
+    Storage bytes read and written by the calling thread (Linux only).
+    """
+    read = written = 0
+    try:
+        with open("/proc/thread-self/io") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name == "read_bytes":
+                    read = int(value)
+                elif name == "write_bytes":
+                    written = int(value)
+    except OSError:
+        pass
+    return read, written
+
+
+def sample() -> dict:
+    """
+    CPU and storage I/O of the calling thread, as cumulative counters,
+    and the server's process-wide peak RSS. Subprocesses are measured one
+    by one as they are reaped (see reap()).
+    """
+    me = resource.getrusage(_THREAD)
+    proc = resource.getrusage(resource.RUSAGE_SELF)
+    read, written = _io()
+
+    return {
+        "cpu_user_s": me.ru_utime,
+        "cpu_sys_s": me.ru_stime,
+        "read_bytes": read,
+        "write_bytes": written,
+        "process_peak_rss_mb": proc.ru_maxrss * _RSS_TO_MB,
+    }
+
+
+def rusage_fields(ru) -> dict:
+    """
+    The parts of a child's struct rusage that child_usage() needs, as
+    sent by the warm pytest worker.
+    """
+    return {
+        "user": ru.ru_utime,
+        "sys": ru.ru_stime,
+        "maxrss": ru.ru_maxrss,
+        "inblock": ru.ru_inblock,
+        "oublock": ru.ru_oublock,
+    }
+
+
+def child_usage(rusage: dict) -> dict:
+    """
+    Usage of one reaped subprocess, in sample() fields. Block counts are
+    512-byte units.
+    """
+    return {
+        "children_user_s": rusage["user"],
+        "children_sys_s": rusage["sys"],
+        "read_bytes": rusage["inblock"] * 512,
+        "write_bytes": rusage["oublock"] * 512,
+        "children_peak_rss_mb": round(rusage["maxrss"] * _RSS_TO_MB, 1),
+    }
+
+
+def delta(before: dict, after: dict) -> dict:
+    out = {}
+    for key, value in after.items():
+        if key in PEAK_FIELDS:
+            out[key] = round(value, 1)
+        elif isinstance(value, float):
+            out[key] = round(value - before.get(key, 0), 3)
+        else:
+            out[key] = value - before.get(key, 0)
+    return out
+
+
+def merge(into: dict, usage: dict) -> dict:
+    for key, value in usage.items():
+        if key in PEAK_FIELDS:
+            into[key] = max(into.get(key, 0), value)
+        elif isinstance(value, float):
+            into[key] = round(into.get(key, 0) + value, 3)
+        else:
+            into[key] = into.get(key, 0) + value
+    return into
+
+
+# -------------------------------
+# Per-session log
+# -------------------------------
+
+_log: ContextVar[dict | None] = ContextVar("resource_log", default=None)
+_stage: ContextVar[str | None] = ContextVar("resource_stage", default=None)
+_lock = threading.Lock()
+
+
+@contextmanager
+def resource_log():
+    """
+    Collects per-stage resource usage for this context (and threads
+    started with its copied context). Nested uses share the outer log.
+    """
+    log = _log.get()
+    if log is not None:
+        yield log
+        return
+
+    log = {}
+    token = _log.set(log)
+    try:
+        yield log
+    finally:
+        _log.reset(token)
+
+
+def record(usage: dict | None, name: str | None = None):
+    """
+    Adds usage measured elsewhere (a verification worker, a warm pytest
+    child) to stage `name`, by default the stage being measured.
+    """
+    log, name = _log.get(), name or _stage.get()
+    if log is None or name is None or not usage:
+        return
+
+    with _lock:
+        merge(log.setdefault(name, {}), usage)
+
+
+@contextmanager
+def measure(name: str):
+    """
+    Records the resources used while the block runs under stage `name`.
+    Repeated stages (repairs, candidates) accumulate.
+    """
+    if _log.get() is None:
+        yield
+        return
+
+    token = _stage.set(name)
+    calls = llm_call_count()
+    before = sample()
+    try:
+        yield
+    finally:
+        usage = delta(before, sample())
+        tokens = llm_tokens(calls)
+        if tokens["prompt"] or tokens["completion"]:
+            usage["llm_prompt_tokens"] = tokens["prompt"]
+            usage["llm_completion_tokens"] = tokens["completion"]
+
+        _stage.reset(token)
+        record(usage, name)
+
+
+def resource_trace() -> dict:
+    with _lock:
+        log = {name: dict(usage) for name, usage in (_log.get() or {}).items()}
+    return {"resources": log} if log else {}
+
+
+# -------------------------------
+# Subprocesses
+# -------------------------------
+
+
+def reap(proc: subprocess.Popen) -> int:
+    """
+    Waits for `proc` with wait4 and records that child's own usage under
+    the current stage, so concurrent sessions never see each other's
+    subprocesses. Returns its exit code.
+    """
+    try:
+        _, status, ru = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        # already reaped by Popen (e.g. a kill() racing the exit)
+        return proc.wait()
+
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    record(child_usage(rusage_fields(ru)))
+    return proc.returncode
+
+
+def check_call(cmd: list, **kwargs):
+    """
+    subprocess.check_call, recording the child's usage (see reap()).
+    """
+    with subprocess.Popen(cmd, **kwargs) as proc:
+        code = reap(proc)
+    if code:
+        raise subprocess.CalledProcessError(code, cmd)
+
+
+def check_output(cmd: list, **kwargs) -> bytes:
+    """
+    subprocess.check_output, recording the child's usage (see reap()).
+    stderr must not be a pipe.
+    """
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, **kwargs) as proc:
+        out = proc.stdout.read()
+        code = reap(proc)
+    if code:
+        raise subprocess.CalledProcessError(code, cmd, output=out)
+    return out
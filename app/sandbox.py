@@ -1,70 +1,179 @@
+import itertools
 import os
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Iterable
+from uuid import uuid4
 
-from app.snapshot import clone_repo, hash_files
+from app import cluster
+from app.workspace import Snapshot, acquire_snapshot, release_snapshot
 from app.patcher import apply_patch
-from app.verifier import run_ast_checks, run_tests
+from app.verify_cache import cached_verify
 from app.policy import enforce_policy, validate_diff_safety
 from app.audit import write_audit_log
 from app.github_pr import GitHubPRClient
 from app.llm import repair_plan, repair_full_file
 from app.db import SessionLocal, AgentSession
+from app.artifacts import get_artifact, put_artifact
+from app.stats import record_session
+from app.events import publish, stage
+from app.models import AgentPlan
+from app.model_router import llm_call_log, llm_trace, record_outcome
+from app.resources import resource_log, resource_trace
 
 MAX_PATCH_ATTEMPTS = 3
 
 
-def execute_plan(repo_url: str, plan, prompt: str | None = None):
-    start = time.time()
-    trace = {}
-    db = SessionLocal()
-
-    session_row = AgentSession(
-        repo_url=repo_url,
-        prompt=prompt or "",
-        files_changed=[e.file_path for e in plan.edits],
-        plan=plan.model_dump(),
-        status="started",
-    )
+def _update_session(
+    session_id: str,
+    artifacts: dict | None = None,
+    rollup: dict | None = None,
+    **fields,
+):
+    """
+    Persists a status change in its own short transaction so no pooled
+    connection is held while the pipeline clones, patches or verifies.
+    Final updates also fold the session into the /stats rollups.
+    Dropped if another node has taken the session over.
+    """
+    with SessionLocal() as db:
+        if not cluster.holds(db, session_id):
+            return
+        if fields:
+            db.query(AgentSession).filter_by(id=session_id).update(fields)
+        for kind, value in (artifacts or {}).items():
+            put_artifact(db, session_id, kind, value)
+        if rollup:
+            record_session(db, **rollup)
+        db.commit()
+
 
-    db.add(session_row)
-    db.commit()
+def _open_pull_request(repo: str, plan) -> tuple[str, str | None]:
+    """
+    Pushes the verified files to a new branch and opens a PR.
+    Falls back to a placeholder when GitHub is not configured.
+    """
+    pr_url = None
+    branch = None
 
     try:
-        # 1. Clone repo into isolated workspace
-        t0 = time.time()
-        repo = clone_repo(repo_url)
-        trace["clone_ms"] = round((time.time() - t0) * 1000, 2)
+        client = GitHubPRClient()
+        branch = f"safeagent-{int(time.time())}"
+        client.create_branch(branch)
 
-        # 2. Hash real files (ground truth)
-        t1 = time.time()
-        manifest = hash_files(repo)
-        trace["hash_ms"] = round((time.time() - t1) * 1000, 2)
+        for edit in plan.edits:
+            full_path = os.path.join(repo, edit.file_path)
 
-        # 3. Attempt patch with self-repair loop
-        t2 = time.time()
-        repair_attempts = 0
+            with open(full_path, "r", encoding="utf-8") as f:
+                content = f.read()
 
-        for attempt in range(MAX_PATCH_ATTEMPTS):
-            try:
-                # Always re-enforce policy before every attempt
-                enforce_policy(plan.edits)
+            client.commit_file(
+                branch=branch,
+                file_path=edit.file_path,
+                new_content=content,
+                message=f"SafeAgent update: {edit.file_path}",
+            )
+
+        pr_url = client.open_pull_request(
+            branch=branch,
+            title="SafeAgent Proposed Changes",
+            body=(
+                "This PR was generated by SafeAgent after:\n"
+                "- hash verification\n"
+                "- policy enforcement\n"
+                "- diff safety validation\n"
+                "- AST checks\n"
+                "- optional test validation"
+            ),
+        )
+
+        client.comment_on_pr(
+            pr_url,
+            body=(
+                "🤖 SafeAgent applied this change after:\n"
+                "- Hash verification\n"
+                "- Policy enforcement\n"
+                "- Diff safety validation\n"
+                "- AST checks\n"
+                "- Optional test execution\n\n"
+                "This PR was generated autonomously."
+            ),
+        )
+
+    except Exception:
+        pr_url = "(skipped: GitHub not configured)"
+
+    return pr_url, branch
+
+
+def _apply_plan(repo: str, manifest: dict, plan):
+    """
+    Policy, diff-safety and hash checks, then git apply of every edit.
+    """
+    enforce_policy(plan.edits)
+
+    for edit in plan.edits:
+        validate_diff_safety(edit.unified_diff)
 
-                for edit in plan.edits:
-                    validate_diff_safety(edit.unified_diff)
+        if manifest.get(edit.file_path) != edit.original_hash:
+            raise RuntimeError(f"Hash mismatch for {edit.file_path}")
 
-                    if manifest.get(edit.file_path) != edit.original_hash:
-                        raise RuntimeError(f"Hash mismatch for {edit.file_path}")
+        apply_patch(repo, edit.unified_diff)
 
-                    apply_patch(repo, edit.unified_diff)
+
+def _patch_and_verify(
+    session_id: str,
+    repo: str,
+    manifest: dict,
+    plan,
+    prompt: str | None,
+    trace: dict,
+    replay_of: str | None,
+    files: dict | None = None,
+):
+    """
+    Serial path: apply with the LLM self-repair loop, then verify.
+    Repairs see the plan's `files` when given, keeping the prompt prefix
+    of the plan; otherwise the edited files as found in the worktree.
+    Returns the plan that was finally applied.
+    """
+    _update_session(session_id, status="patching")
+    repair_attempts = 0
+
+    with stage(session_id, "patch", trace):
+        for attempt in range(MAX_PATCH_ATTEMPTS):
+            try:
+                # Always re-enforce policy before every attempt
+                try:
+                    _apply_plan(repo, manifest, plan)
+                except Exception:
+                    record_outcome(plan.llm_call, False)
+                    raise
+                record_outcome(plan.llm_call, True)
 
                 # If patch applied cleanly, exit retry loop
                 break
 
             except Exception as patch_error:
+                if replay_of:
+                    # replays never call the model
+                    raise
+
                 repair_attempts += 1
+                publish(
+                    session_id,
+                    "repair_attempt",
+                    attempt=repair_attempts,
+                    error=str(patch_error),
+                    full_rewrite=attempt == MAX_PATCH_ATTEMPTS - 1,
+                )
 
                 if attempt == MAX_PATCH_ATTEMPTS - 1:
                     # FINAL FALLBACK: full rewrite instead of diff
+                    trace["full_rewrite"] = True
                     for edit in plan.edits:
                         path = os.path.join(repo, edit.file_path)
 
@@ -84,88 +193,265 @@ def execute_plan(repo_url: str, plan, prompt: str | None = None):
                     break  # exit retry loop and continue to verification
 
                 # Gather file contents for repair
-                files = {}
-                for edit in plan.edits:
-                    full_path = os.path.join(repo, edit.file_path)
-                    with open(full_path, "r", encoding="utf-8") as f:
-                        files[edit.file_path] = f.read()
+                context = files
+                if not context:
+                    context = {}
+                    for edit in plan.edits:
+                        full_path = os.path.join(repo, edit.file_path)
+                        with open(full_path, "r", encoding="utf-8") as f:
+                            context[edit.file_path] = f.read()
 
                 # Ask model to repair the plan
                 plan = repair_plan(
                     prompt=prompt or "",
-                    files=files,
+                    files=context,
                     manifest=manifest,
-                    failed_diff=edit.unified_diff,
+                    failed_diff=plan.edits[-1].unified_diff if plan.edits else "",
                     error=str(patch_error),
                 )
 
-        trace["patch_ms"] = round((time.time() - t2) * 1000, 2)
-        trace["repair_attempts"] = repair_attempts
+    trace["repair_attempts"] = repair_attempts
 
-        # 4. Deterministic verification
-        t3 = time.time()
-        run_ast_checks(repo)
-        run_tests(repo)
-        trace["verification_ms"] = round((time.time() - t3) * 1000, 2)
-
-        # Store final diff for observability/debugging
-        session_row.diff = "\n\n".join(
-            [e.unified_diff for e in plan.edits if e.unified_diff]
+    # Deterministic verification
+    _update_session(session_id, status="verifying")
+    with stage(session_id, "verification", trace):
+        trace.update(
+            cached_verify(
+                repo,
+                on_output=lambda line: publish(
+                    session_id, "verifier_output", line=line
+                ),
+                trace=trace,
+            )
         )
 
-        # Store trace
-        session_row.trace = trace
-
-        # 5. Attempt PR creation (safe fallback for local dev)
-        pr_url = None
-        branch = None
+    return plan
+
+
+def _race_candidates(session_id: str, snap: Snapshot, plans: Iterable, trace: dict):
+    """
+    Applies and verifies candidate plans in their own worktrees at once,
+    starting each as soon as `plans` yields it (plans may still be being
+    generated). Returns (plan, worktree) of the first to pass, or None if
+    all fail.
+
+    Once a winner is found, candidates not started yet are skipped and the
+    others are cancelled: queued verification jobs are dropped and running
+    test processes killed.
+    """
+    won = threading.Event()
+    lock = threading.Lock()
+    finished = queue.Queue()
+    started = []
+    result = {}
+    errors = {}
+    manifest = snap.manifest
+
+    def emit(event: str, **fields):
+        # once a winner is picked the session moves on (and may finish);
+        # losers still winding down stay quiet
+        if not won.is_set():
+            publish(session_id, event, **fields)
+
+    def attempt(index: int, plan):
+        # each candidate holds its own snapshot reference, since losers
+        # may outlive the session
+        own = acquire_snapshot(snap.repo_url, snap.commit)
+        repo = own.fork()
 
         try:
-            client = GitHubPRClient()
-            branch = f"safeagent-{int(time.time())}"
-            client.create_branch(branch)
+            if won.is_set():
+                return
+            t0 = time.time()
+            try:
+                _apply_plan(repo, manifest, plan)
+            except Exception:
+                record_outcome(plan.llm_call, False)
+                raise
+            record_outcome(plan.llm_call, True)
+            patch_ms = round((time.time() - t0) * 1000, 2)
+
+            if won.is_set():
+                return
+            t0 = time.time()
+            verdict = {}
+            info = cached_verify(
+                repo,
+                on_output=lambda line: emit(
+                    "verifier_output", candidate=index, line=line
+                ),
+                trace=verdict,
+                cancel=won,
+            )
+            info = {
+                **verdict,
+                **info,
+                "patch_ms": patch_ms,
+                "verification_ms": round((time.time() - t0) * 1000, 2),
+                "repair_attempts": 0,
+            }
 
-            for edit in plan.edits:
-                full_path = os.path.join(repo, edit.file_path)
+            with lock:
+                if not won.is_set():
+                    won.set()
+                    result.update(index=index, plan=plan, repo=repo, info=info)
+                    publish(session_id, "candidate_won", candidate=index)
+                    return
 
-                with open(full_path, "r", encoding="utf-8") as f:
-                    content = f.read()
+        except Exception as e:
+            with lock:
+                errors[index] = str(e)
+            emit("candidate_failed", candidate=index, error=str(e))
 
-                client.commit_file(
-                    branch=branch,
-                    file_path=edit.file_path,
-                    new_content=content,
-                    message=f"SafeAgent update: {edit.file_path}",
-                )
+        finally:
+            if result.get("repo") != repo:
+                own.discard(repo)
+            release_snapshot(own)
+            finished.put(index)
 
-            pr_url = client.open_pull_request(
-                branch=branch,
-                title="SafeAgent Proposed Changes",
-                body=(
-                    "This PR was generated by SafeAgent after:\n"
-                    "- hash verification\n"
-                    "- policy enforcement\n"
-                    "- diff safety validation\n"
-                    "- AST checks\n"
-                    "- optional test validation"
-                ),
+    pool = ThreadPoolExecutor(thread_name_prefix="safeagent-candidate")
+
+    def feed():
+        try:
+            for index, plan in enumerate(plans):
+                with lock:
+                    if won.is_set():
+                        break
+                    # each candidate runs in a copy of this context, so its
+                    # LLM outcomes and verification resources land in the
+                    # session's logs
+                    pool.submit(copy_context().run, attempt, index, plan)
+                    started.append(index)
+        finally:
+            finished.put(None)
+            pool.shutdown(wait=False)
+
+    threading.Thread(
+        target=copy_context().run, args=(feed,), name="safeagent-candidate-feed", daemon=True
+    ).start()
+
+    done, fed = 0, False
+    while not won.is_set() and not (fed and done == len(started)):
+        if finished.get() is None:
+            fed = True
+        else:
+            done += 1
+
+    with lock:
+        trace["candidates"] = len(started)
+        trace["candidate_errors"] = {str(i): e for i, e in sorted(errors.items())}
+
+    if not result:
+        return None
+
+    trace["winner"] = result["index"]
+    trace.update(result["info"])
+    return result["plan"], result["repo"]
+
+
+def execute_plan(*args, **kwargs):
+    """
+    Applies, verifies and publishes a plan; see _execute_plan.
+    LLM calls and per-stage resource usage are recorded in its trace.
+    """
+    with llm_call_log(), resource_log():
+        return _execute_plan(*args, **kwargs)
+
+
+def _execute_plan(
+    repo_url: str,
+    plan,
+    prompt: str | None = None,
+    session_id: str | None = None,
+    commit: str | None = None,
+    replay_of: str | None = None,
+    snapshot: Snapshot | None = None,
+    alternatives: Iterable | None = None,
+    files: dict | None = None,
+):
+    """
+    Applies, verifies and publishes a plan.
+
+    Patching and verification happen in a private worktree forked from the
+    shared snapshot of the repo (the caller's `snapshot` when given).
+
+    With `alternatives` (a list, or an iterator yielding plans as they are
+    generated), the plan and its alternatives are tried speculatively in
+    parallel and the first to verify is published.
+    `files` are the file contents the plan was built from, reused as the
+    context of any repair.
+
+    With `replay_of` set the run is a deterministic replay: the repo is
+    pinned to `commit`, no LLM repair is attempted and no PR is opened.
+    """
+    start = time.time()
+    trace = {}
+    snap, repo = None, None
+    submitted = plan
+    if replay_of:
+        trace["replay_of"] = replay_of
+
+    if session_id is None:
+        session_id = str(uuid4())
+        publish(session_id, "session_started", repo_url=repo_url, prompt=prompt or "")
+
+    with SessionLocal() as db:
+        if not cluster.holds(db, session_id):
+            raise RuntimeError(cluster.LOST_LEASE_ERROR)
+        # merge: /run reserves the row up front
+        db.merge(
+            AgentSession(
+                id=session_id,
+                repo_url=repo_url,
+                prompt=prompt or "",
+                files_changed=[e.file_path for e in plan.edits],
+                status="started",
             )
+        )
+        put_artifact(db, session_id, "plan", plan.model_dump())
+        db.commit()
 
-            client.comment_on_pr(
-                pr_url,
-                body=(
-                    "🤖 SafeAgent applied this change after:\n"
-                    "- Hash verification\n"
-                    "- Policy enforcement\n"
-                    "- Diff safety validation\n"
-                    "- AST checks\n"
-                    "- Optional test execution\n\n"
-                    "This PR was generated autonomously."
-                ),
+    try:
+        # 1. Fork an isolated workspace from the shared snapshot
+        with stage(session_id, "clone", trace):
+            snap = snapshot or acquire_snapshot(repo_url, commit)
+            if not alternatives:
+                repo = snap.fork()
+        trace["commit"] = snap.commit
+
+        # 2. Hash real files (ground truth, computed once per snapshot)
+        with stage(session_id, "hash", trace):
+            manifest = snap.manifest
+
+        # 3-4. Speculative candidates race in parallel worktrees; otherwise
+        # (or if every candidate fails) patch with self-repair and verify
+        winner = None
+        if alternatives:
+            _update_session(session_id, status="speculating")
+            with stage(session_id, "speculate", trace):
+                winner = _race_candidates(
+                    session_id, snap, itertools.chain([plan], alternatives), trace
+                )
+
+        if winner:
+            plan, repo = winner
+        else:
+            repo = repo or snap.fork()
+            plan = _patch_and_verify(
+                session_id, repo, manifest, plan, prompt, trace, replay_of, files
             )
 
-        except Exception:
-            pr_url = "(skipped: GitHub not configured)"
+        # 5. Attempt PR creation (safe fallback for local dev), unless a
+        # peer has taken the session over and will open its own
+        with SessionLocal() as db:
+            if not cluster.holds(db, session_id):
+                raise RuntimeError(cluster.LOST_LEASE_ERROR)
+            db.commit()
+
+        if replay_of:
+            pr_url, branch = "(skipped: replay)", None
+        else:
+            pr_url, branch = _open_pull_request(repo, plan)
 
         # 6. Audit log
         write_audit_log(
@@ -180,22 +466,74 @@ def execute_plan(repo_url: str, plan, prompt: str | None = None):
             }
         )
 
-        # 7. Persist success
-        session_row.status = "success"
-        session_row.result = {
-            "branch": branch,
-            "pr": pr_url,
-        }
-        session_row.duration_sec = round(time.time() - start, 2)
-        db.commit()
+        # 7. Persist success, final diff and trace
+        duration = round(time.time() - start, 2)
+        trace.update(llm_trace())
+        trace.update(resource_trace())
+        _update_session(
+            session_id,
+            artifacts={
+                "diff": "\n\n".join(
+                    [e.unified_diff for e in plan.edits if e.unified_diff]
+                ),
+                "final_plan": plan.model_dump() if plan is not submitted else None,
+                "trace": trace,
+            },
+            # replays are not real sessions: keep them out of /stats
+            rollup=None
+            if replay_of
+            else {
+                "repo_url": repo_url,
+                "status": "success",
+                "trace": trace,
+                "duration_sec": duration,
+            },
+            status="success",
+            result={
+                "branch": branch,
+                "pr": pr_url,
+            },
+            duration_sec=duration,
+        )
+
+        publish(
+            session_id,
+            "session_finished",
+            status="success",
+            duration_sec=duration,
+            pull_request=pr_url,
+        )
 
         return pr_url
 
     except Exception as e:
-        session_row.status = "failed"
-        session_row.error = str(e)
-        session_row.duration_sec = round(time.time() - start, 2)
-        db.commit()
+        duration = round(time.time() - start, 2)
+        trace.update(llm_trace())
+        trace.update(resource_trace())
+        _update_session(
+            session_id,
+            artifacts={"trace": trace},
+            rollup=None
+            if replay_of
+            else {
+                "repo_url": repo_url,
+                "status": "failed",
+                "trace": trace,
+                "duration_sec": duration,
+                "error": str(e),
+            },
+            status="failed",
+            error=str(e),
+            duration_sec=duration,
+        )
+
+        publish(
+            session_id,
+            "session_finished",
+            status="failed",
+            duration_sec=duration,
+            error=str(e),
+        )
 
         return {
             "status": "failed",
@@ -203,4 +541,87 @@ def execute_plan(repo_url: str, plan, prompt: str | None = None):
         }
 
     finally:
-        db.close()
+        if repo:
+            snap.discard(repo)
+        if snap and snapshot is None:
+            release_snapshot(snap)
+
+
+# -------------------------------
+# Replay
+# -------------------------------
+
+
+def diff_traces(original: dict, replay: dict) -> dict:
+    """
+    Per-key comparison of two traces; numeric values get delta and ratio.
+    """
+    out = {}
+
+    for key in sorted(set(original) | set(replay)):
+        a, b = original.get(key), replay.get(key)
+        if a == b:
+            continue
+
+        entry = {"original": a, "replay": b}
+        numeric = (int, float)
+        if isinstance(a, numeric) and isinstance(b, numeric) and not isinstance(a, bool):
+            entry["delta"] = round(b - a, 2)
+            if a:
+                entry["ratio"] = round(b / a, 3)
+        out[key] = entry
+
+    return out
+
+
+def replay_session(session_id: str) -> dict:
+    """
+    Re-runs a stored session's final plan against its original commit,
+    without LLM calls or PR creation, and compares the two traces.
+    """
+    with SessionLocal() as db:
+        original = db.query(AgentSession).filter_by(id=session_id).first()
+        if not original:
+            raise LookupError(f"Session not found: {session_id}")
+
+        repo_url, prompt = original.repo_url, original.prompt
+        plan = get_artifact(db, session_id, "final_plan") or get_artifact(
+            db, session_id, "plan"
+        )
+        original_trace = get_artifact(db, session_id, "trace") or {}
+
+    if not plan:
+        raise ValueError(f"Session {session_id} has no stored plan")
+    if not original_trace.get("commit"):
+        # without the original commit a replay would silently run on HEAD
+        raise ValueError(f"Session {session_id} has no recorded commit")
+    if original_trace.get("full_rewrite"):
+        raise ValueError(
+            f"Session {session_id} used a full-file rewrite and cannot be replayed"
+        )
+
+    replay_id = str(uuid4())
+    publish(replay_id, "session_started", repo_url=repo_url, prompt=prompt, replay_of=session_id)
+
+    execute_plan(
+        repo_url,
+        AgentPlan(**plan),
+        prompt,
+        session_id=replay_id,
+        commit=original_trace.get("commit"),
+        replay_of=session_id,
+    )
+
+    with SessionLocal() as db:
+        row = db.query(AgentSession).filter_by(id=replay_id).first()
+        replay_trace = get_artifact(db, replay_id, "trace") or {}
+
+        return {
+            "session_id": replay_id,
+            "replay_of": session_id,
+            "status": row.status,
+            "error": row.error,
+            "commit": replay_trace.get("commit"),
+            "trace": replay_trace,
+            "trace_diff": diff_traces(original_trace, replay_trace),
+        }
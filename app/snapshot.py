@@ -1,10 +1,13 @@
 import hashlib
 import os
+import shutil
 import subprocess
 import uuid
 from typing import Optional, Iterable
 import time
 
+from app.resources import check_call, check_output
+
 SKIP_DIRS = {
     ".git",
     "__pycache__",
@@ -18,25 +21,35 @@ SKIP_DIRS = {
 MAX_FILE_BYTES = 200_000  # safety cap for LLM context
 
 
-def clone_repo(repo_url: str, retries: int = 3) -> str:
+def clone_repo(
+    repo_url: str,
+    retries: int = 3,
+    commit: str | None = None,
+    dest: str | None = None,
+) -> str:
     """
-    Clones the repo
+    Clones the repo, optionally pinned to a specific commit
     """
     session_id = str(uuid.uuid4())
-    path = f"/tmp/safeagent/{session_id}"
+    path = dest or f"/tmp/safeagent/{session_id}"
 
-    os.makedirs("/tmp/safeagent", exist_ok=True)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
 
     for attempt in range(retries):
         try:
-            subprocess.check_call(
-                ["git", "clone", "--depth=1", repo_url, path],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.STDOUT,
-            )
+            if commit:
+                _fetch_commit(repo_url, commit, path)
+            else:
+                check_call(
+                    ["git", "clone", "--depth=1", repo_url, path],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.STDOUT,
+                    env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+                )
             return path
 
         except subprocess.CalledProcessError as e:
+            shutil.rmtree(path, ignore_errors=True)
             if attempt == retries - 1:
                 raise RuntimeError(
                     f"Git clone failed after {retries} attempts for {repo_url}: {e}"
@@ -44,6 +57,34 @@ def clone_repo(repo_url: str, retries: int = 3) -> str:
             time.sleep(1.5)
 
 
+def _fetch_commit(repo_url: str, commit: str, path: str):
+    """
+    Shallow-fetches a single commit; falls back to a full clone for
+    servers that refuse to serve unadvertised SHAs.
+    """
+
+    def git(*args, cwd=path):
+        check_call(
+            ["git", *args],
+            cwd=cwd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.STDOUT,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+        )
+
+    os.makedirs(path)
+    git("init", "-q")
+    git("remote", "add", "origin", repo_url)
+
+    try:
+        git("fetch", "--depth=1", "origin", commit)
+        git("checkout", "-q", "FETCH_HEAD")
+    except subprocess.CalledProcessError:
+        shutil.rmtree(path)
+        git("clone", "-q", repo_url, path, cwd=None)
+        git("checkout", "-q", commit)
+
+
 def hash_files(root: str) -> dict[str, str]:
     """Returns SHA256 hash of every readable file"""
     manifest = {}
@@ -111,3 +152,32 @@ def load_files(
                 continue
 
     return results
+
+
+def remote_head(repo_url: str) -> str:
+    """
+    Returns the commit the remote's HEAD points at, without cloning.
+    """
+    try:
+        out = check_output(
+            ["git", "ls-remote", repo_url, "HEAD"],
+            stderr=subprocess.DEVNULL,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+        ).decode()
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"git ls-remote failed for {repo_url}: {e}")
+
+    if not out.strip():
+        raise RuntimeError(f"Remote has no HEAD: {repo_url}")
+    return out.split()[0]
+
+
+def resolve_commit(repo_path: str) -> str:
+    """
+    Returns the commit SHA checked out in a local clone.
+    """
+    return (
+        check_output(["git", "rev-parse", "HEAD"], cwd=repo_path)
+        .decode()
+        .strip()
+    )
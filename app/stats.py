@@ -0,0 +1,181 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app.db import SessionRollup, insert_stmt
+
+TIMING_METRICS = ("clone_ms", "hash_ms", "patch_ms", "verification_ms", "duration_sec")
+PERCENTILES = (50, 90, 95, 99)
+
+# Log-spaced histogram bins: each bin spans 5%, so percentiles carry at
+# most ~2.5% relative error while staying mergeable across buckets.
+BIN_GROWTH = 1.05
+
+FAILURE_REASONS = [
+    ("Hash mismatch", "hash_mismatch"),
+    ("Blocked by policy", "policy"),
+    ("Unsafe diff", "unsafe_diff"),
+    ("AST error", "ast_error"),
+    ("Tests failed", "tests_failed"),
+    ("Git clone failed", "clone_failed"),
+    ("LLM failed JSON", "llm_json"),
+]
+
+BUCKET_SIZES = {"hour", "day", "week"}
+
+
+# -------------------------------
+# Histogram bins
+# -------------------------------
+
+
+def bin_key(value: float) -> str:
+    if value <= 0:
+        return "z"
+    return str(math.floor(math.log(value, BIN_GROWTH)))
+
+
+def bin_value(key: str) -> float:
+    """Representative (geometric mid-point) value of a bin."""
+    if key == "z":
+        return 0.0
+    return BIN_GROWTH ** (int(key) + 0.5)
+
+
+def failure_reason(error: str | None) -> str:
+    for prefix, reason in FAILURE_REASONS:
+        if error and prefix in error:
+            return reason
+    return "other"
+
+
+# -------------------------------
+# Write path
+# -------------------------------
+
+
+def record_session(
+    db,
+    repo_url: str,
+    status: str,
+    trace: dict | None,
+    duration_sec: float | None,
+    error: str | None = None,
+    at: datetime | None = None,
+):
+    """
+    Folds one finished session into the hourly rollups.
+    Runs in the caller's transaction; increments are atomic upserts.
+    """
+    trace = trace or {}
+    bucket = (at or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+
+    counters = [("status", status)]
+    if status == "failed":
+        counters.append(("failure_reason", failure_reason(error)))
+    if "repair_attempts" in trace:
+        counters.append(("repair_attempts", str(trace["repair_attempts"])))
+
+    timings = dict(trace)
+    timings["duration_sec"] = duration_sec
+    for metric in TIMING_METRICS:
+        value = timings.get(metric)
+        if isinstance(value, (int, float)):
+            counters.append((metric, bin_key(value)))
+
+    for metric, key in counters:
+        stmt = insert_stmt(db, SessionRollup).values(
+            repo_url=repo_url, bucket=bucket, metric=metric, key=key, count=1
+        )
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["repo_url", "bucket", "metric", "key"],
+                set_={"count": SessionRollup.count + 1},
+            )
+        )
+
+
+# -------------------------------
+# Read path
+# -------------------------------
+
+
+def rollup_query(
+    repo_url: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    query = select(
+        SessionRollup.repo_url,
+        SessionRollup.bucket,
+        SessionRollup.metric,
+        SessionRollup.key,
+        SessionRollup.count,
+    )
+    if repo_url:
+        query = query.where(SessionRollup.repo_url == repo_url)
+    if since:
+        query = query.where(SessionRollup.bucket >= since)
+    if until:
+        query = query.where(SessionRollup.bucket < until)
+    return query
+
+
+def _truncate(ts: datetime, size: str) -> datetime:
+    if size == "hour":
+        return ts
+    day = ts.replace(hour=0)
+    if size == "day":
+        return day
+    return day - timedelta(days=day.weekday())
+
+
+def percentiles(histogram: dict[str, int]) -> dict[str, float]:
+    total = sum(histogram.values())
+    if not total:
+        return {}
+
+    bins = sorted(histogram.items(), key=lambda kv: -1e9 if kv[0] == "z" else int(kv[0]))
+    result = {}
+
+    for p in PERCENTILES:
+        target = math.ceil(total * p / 100)
+        seen = 0
+        for key, count in bins:
+            seen += count
+            if seen >= target:
+                result[f"p{p}"] = round(bin_value(key), 2)
+                break
+
+    return result
+
+
+def summarize(rows, bucket: str = "day") -> list[dict]:
+    """
+    Merges hourly rollup rows into (repo, bucket) groups with counts,
+    timing percentiles, repair-attempt and failure-reason distributions.
+    """
+    groups = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+
+    for repo_url, ts, metric, key, count in rows:
+        groups[(repo_url, _truncate(ts, bucket))][metric][key] += count
+
+    out = []
+    for (repo_url, ts), metrics in sorted(groups.items(), key=lambda kv: (kv[0][1], kv[0][0])):
+        out.append(
+            {
+                "repo_url": repo_url,
+                "bucket": ts.isoformat(),
+                "sessions": sum(metrics["status"].values()),
+                "status": dict(metrics["status"]),
+                "failure_reasons": dict(metrics["failure_reason"]),
+                "repair_attempts": dict(metrics["repair_attempts"]),
+                "timings": {
+                    m: percentiles(metrics[m]) for m in TIMING_METRICS if metrics[m]
+                },
+            }
+        )
+
+    return out
@@ -0,0 +1,262 @@
+import ast
+import gzip
+import hashlib
+import json
+import os
+from typing import Optional
+
+from app.config import settings
+from app.resources import check_output
+from app.snapshot import SKIP_DIRS, resolve_commit
+
+INDEX_VERSION = 1
+
+
+# -------------------------------
+# Parsing
+# -------------------------------
+
+
+def module_name(path: str) -> str:
+    """
+    Maps a repo-relative path to its dotted module name.
+    app/llm.py -> app.llm, app/__init__.py -> app
+    """
+    parts = path[:-3].split("/")
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+def parse_file(path: str, source: str) -> dict:
+    """
+    Extracts top-level definitions and absolute import targets from one file.
+    Files that do not parse are indexed with no symbols.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return {"defs": [], "imports": []}
+
+    defs = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            defs.append(node.name)
+        elif isinstance(node, ast.Assign):
+            defs.extend(t.id for t in node.targets if isinstance(t, ast.Name))
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+            defs.append(node.target.id)
+
+    package = module_name(path).split(".")
+    if not path.endswith("__init__.py"):
+        package = package[:-1]
+
+    imports = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                keep = len(package) - (node.level - 1)
+                if keep < 0:
+                    continue
+                base = package[:keep]
+                if node.module:
+                    base = base + node.module.split(".")
+            else:
+                base = node.module.split(".")
+
+            if base:
+                imports.add(".".join(base))
+            for alias in node.names:
+                if alias.name != "*":
+                    imports.add(".".join(base + [alias.name]))
+
+    return {"defs": sorted(set(defs)), "imports": sorted(imports)}
+
+
+def _tracked_python_files(repo_path: str) -> dict[str, str]:
+    """
+    Returns {path: git blob id} for every tracked .py file.
+    Blob ids come from the git index, so unchanged files are never read.
+    """
+    out = check_output(["git", "ls-files", "-s", "-z"], cwd=repo_path)
+    blobs = {}
+
+    for record in out.decode().split("\0"):
+        if not record:
+            continue
+        meta, path = record.split("\t", 1)
+        if not path.endswith(".py"):
+            continue
+        if any(part in SKIP_DIRS for part in path.split("/")):
+            continue
+        blobs[path] = meta.split()[1]
+
+    return blobs
+
+
+# -------------------------------
+# Index
+# -------------------------------
+
+
+class SymbolIndex:
+    """
+    Per-commit map of definitions, imports and reverse-import edges.
+    All queries are dict lookups over structures built once at load time.
+    """
+
+    def __init__(self, commit: str, files: dict[str, dict]):
+        self.commit = commit
+        self.files = files
+
+        self._modules = {module_name(p): p for p in files}
+        self._definitions: dict[str, list[str]] = {}
+        self._deps: dict[str, list[str]] = {}
+        self._importers: dict[str, list[str]] = {}
+        self._external: set[str] = set()
+
+        top_level = {m.split(".")[0] for m in self._modules}
+
+        for path, info in files.items():
+            for name in info["defs"]:
+                self._definitions.setdefault(name, []).append(path)
+
+            deps = set()
+            for mod in info["imports"]:
+                target = self._modules.get(mod)
+                if target:
+                    deps.add(target)
+                elif mod.split(".")[0] not in top_level:
+                    self._external.add(mod.split(".")[0])
+            deps.discard(path)
+
+            self._deps[path] = sorted(deps)
+            for dep in deps:
+                self._importers.setdefault(dep, []).append(path)
+
+    def definitions_of(self, name: str) -> list[str]:
+        """Files that define a top-level symbol called `name`."""
+        return self._definitions.get(name, [])
+
+    def defined_in(self, path: str) -> list[str]:
+        return self.files.get(path, {}).get("defs", [])
+
+    def imports_of(self, path: str) -> list[str]:
+        """Repo files imported by `path`."""
+        return self._deps.get(path, [])
+
+    def importers_of(self, path: str) -> list[str]:
+        """Repo files that import `path`."""
+        return self._importers.get(path, [])
+
+    def external_imports(self) -> set[str]:
+        """Top-level modules imported from outside the repo (stdlib or third-party)."""
+        return self._external
+
+    def to_dict(self) -> dict:
+        return {"version": INDEX_VERSION, "commit": self.commit, "files": self.files}
+
+
+# -------------------------------
+# Persistence
+# -------------------------------
+
+
+def _index_dir(repo_url: str) -> str:
+    key = hashlib.sha256(repo_url.encode()).hexdigest()[:16]
+    return os.path.join(settings.workspace_root, "index", key)
+
+
+def _load(path: str) -> Optional[SymbolIndex]:
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if data.get("version") != INDEX_VERSION:
+        return None
+
+    return SymbolIndex(data["commit"], data["files"])
+
+
+def _save(directory: str, index: SymbolIndex):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{index.commit}.json.gz")
+    tmp = f"{path}.{os.getpid()}.tmp"
+
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(index.to_dict(), f, separators=(",", ":"))
+
+    os.replace(tmp, path)
+    _prune(directory)
+
+
+def _stored(directory: str) -> list[str]:
+    """
+    Paths of the stored indexes for a repo, oldest first.
+    """
+    try:
+        names = [n for n in os.listdir(directory) if n.endswith(".json.gz")]
+    except FileNotFoundError:
+        return []
+
+    paths = [os.path.join(directory, n) for n in names]
+    paths.sort(key=os.path.getmtime)
+    return paths
+
+
+def _prune(directory: str):
+    """
+    Keeps only the SYMBOL_INDEX_KEEP most recent indexes of a repo.
+    """
+    for path in _stored(directory)[: -max(1, settings.symbol_index_keep)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _latest(directory: str) -> Optional[SymbolIndex]:
+    paths = _stored(directory)
+    return _load(paths[-1]) if paths else None
+
+
+def build_index(repo_path: str, repo_url: str) -> SymbolIndex:
+    """
+    Returns the symbol index for the commit checked out at `repo_path`.
+
+    An index already stored for the commit is loaded as-is. Otherwise the
+    commit's tree is diffed against the most recent stored index for the
+    repo and only added or changed files are re-parsed.
+    """
+    directory = _index_dir(repo_url)
+    commit = resolve_commit(repo_path)
+
+    cached = _load(os.path.join(directory, f"{commit}.json.gz"))
+    if cached:
+        return cached
+
+    previous = _latest(directory)
+    previous_files = previous.files if previous else {}
+
+    files = {}
+    for path, blob in _tracked_python_files(repo_path).items():
+        prior = previous_files.get(path)
+        if prior and prior["blob"] == blob:
+            files[path] = prior
+            continue
+
+        try:
+            with open(os.path.join(repo_path, path), "r", encoding="utf-8") as f:
+                source = f.read()
+        except Exception:
+            continue
+
+        files[path] = {"blob": blob, **parse_file(path, source)}
+
+    index = SymbolIndex(commit, files)
+    _save(directory, index)
+    return index
@@ -1,7 +1,12 @@
 import subprocess
 import ast
 import os
+import shlex
+import signal
+import sys
+import threading
 from app.config import settings
+from app.resources import reap
 
 
 def run_ast_checks(repo_path: str):
@@ -16,24 +21,95 @@ def run_ast_checks(repo_path: str):
                     raise RuntimeError(f"AST error in {path}: {e}")
 
 
-def run_tests(repo_path: str):
-    # Respect config
-    if not settings.require_tests:
-        return
+def _limited(cmd: list[str], limits: dict) -> list[str]:
+    """
+    Wraps `cmd` in a shell that applies rlimits (and optionally joins a
+    cgroup) and then execs it. The limits are set in the child rather than
+    through preexec_fn, which is unsafe in the threaded API process.
+    """
+    steps = []
+    if limits.get("cpu_seconds"):
+        steps.append(f"ulimit -t {int(limits['cpu_seconds'])}")
+    if limits.get("memory_mb"):
+        steps.append(f"ulimit -v {int(limits['memory_mb']) * 1024}")
+    if limits.get("cgroup"):
+        procs = shlex.quote(os.path.join(limits["cgroup"], "cgroup.procs"))
+        steps.append(f"echo $$ > {procs}")
+
+    if not steps:
+        return cmd
+    return ["sh", "-c", " && ".join(steps) + ' && exec "$@"', "sh", *cmd]
 
-    has_tests = (
+
+def has_tests(repo_path: str) -> bool:
+    return (
         os.path.exists(os.path.join(repo_path, "tests"))
         or os.path.exists(os.path.join(repo_path, "pytest.ini"))
         or os.path.exists(os.path.join(repo_path, "pyproject.toml"))
     )
 
-    if not has_tests:
+
+def run_tests(
+    repo_path: str,
+    on_output=None,
+    limits: dict | None = None,
+    python: str | None = None,
+    on_start=None,
+):
+    """
+    Runs pytest in the workspace, with the given interpreter (a cached
+    test environment) or whatever pytest is on PATH.
+
+    pytest leads its own process group, whose id is passed to `on_start`
+    so callers can kill it together with any subprocesses of the tests.
+    """
+    # Respect config
+    if not settings.require_tests:
+        return
+
+    if not has_tests(repo_path):
         return
 
-    result = subprocess.run(
-        ["pytest", "-q"],
+    limits = limits or {}
+
+    cmd = [python, "-m", "pytest", "-q"] if python else ["pytest", "-q"]
+    proc = subprocess.Popen(
+        _limited(cmd, limits),
         cwd=repo_path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        start_new_session=True,
     )
+    if on_start:
+        on_start(proc.pid)
+
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    timer = None
+    if limits.get("timeout_sec"):
+        timer = threading.Timer(limits["timeout_sec"], kill)
+        timer.start()
+
+    try:
+        for line in proc.stdout:
+            if on_output:
+                on_output(line.rstrip("\n"))
+            else:
+                sys.stdout.write(line)
+        code = reap(proc)
+    finally:
+        if timer:
+            timer.cancel()
 
-    if result.returncode != 0:
+    if timed_out.is_set():
+        raise RuntimeError(f"Tests timed out after {limits['timeout_sec']}s")
+    if code != 0:
         raise RuntimeError("Tests failed")
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import sys
+from datetime import datetime
+
+from sqlalchemy import delete, func, select
+
+from app.config import settings
+from app.db import SessionLocal, VerificationResult, insert_stmt
+from app.envcache import env_key
+from app.resources import check_output
+from app.verify_pool import verify
+
+# Bump when verification itself changes meaning, to invalidate old verdicts
+VERIFIER_VERSION = 1
+
+# Failures that follow from the tree itself; anything else (timeouts, dead
+# workers, environment builds) may not recur and is never cached.
+CACHEABLE_ERRORS = ("AST error", "Tests failed")
+
+MAX_REPORT_LINES = 2000
+
+
+def tree_id(repo_path: str) -> str:
+    """
+    Git tree id of the workspace as it is on disk, including untracked
+    (but not ignored) files. Uses the worktree's own index, so unchanged
+    files are not re-hashed.
+    """
+
+    def git(*args):
+        return check_output(["git", *args], cwd=repo_path).decode().strip()
+
+    git("add", "-A")
+    return git("write-tree")
+
+
+def verification_key(repo_path: str, tree: str) -> str:
+    config = {
+        "verifier": VERIFIER_VERSION,
+        "python": f"{sys.version_info[0]}.{sys.version_info[1]}",
+        "require_tests": settings.require_tests,
+        "timeout_sec": settings.verify_timeout_sec,
+        "cpu_seconds": settings.verify_cpu_seconds,
+        "memory_mb": settings.verify_memory_mb,
+        "env": env_key(repo_path),
+    }
+    raw = json.dumps(config, sort_keys=True) + tree
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _lookup(key: str):
+    with SessionLocal() as db:
+        row = db.get(VerificationResult, key)
+        if row is None:
+            return None
+
+        row.hits += 1
+        row.last_used_at = datetime.utcnow()
+        db.commit()
+        return row.ok, row.error, row.report
+
+
+def _store(key: str, tree: str, ok: bool, error: str | None, report: list[str]):
+    now = datetime.utcnow()
+
+    with SessionLocal() as db:
+        db.execute(
+            insert_stmt(db, VerificationResult)
+            .values(
+                key=key,
+                tree_id=tree,
+                ok=ok,
+                error=error,
+                report="\n".join(report),
+                hits=0,
+                created_at=now,
+                last_used_at=now,
+            )
+            .on_conflict_do_nothing(index_elements=["key"])
+        )
+
+        # LRU bound
+        excess = db.execute(select(func.count()).select_from(VerificationResult)).scalar()
+        excess -= settings.verify_cache_size
+        if excess > 0:
+            oldest = (
+                select(VerificationResult.key)
+                .order_by(VerificationResult.last_used_at)
+                .limit(excess)
+            )
+            db.execute(
+                delete(VerificationResult).where(VerificationResult.key.in_(oldest))
+            )
+
+        db.commit()
+
+
+def cached_verify(
+    repo_path: str,
+    on_output=None,
+    trace: dict | None = None,
+    cancel=None,
+) -> dict:
+    """
+    verify() with verdicts reused for identical trees, verifier settings
+    and test environments. On a hit the stored report is replayed through
+    `on_output` and a stored failure is raised again. `cancel` is passed
+    to verify(); a cancelled run is not cached.
+    """
+    if settings.verify_cache_size <= 0:
+        return verify(repo_path, on_output, cancel)
+
+    trace = trace if trace is not None else {}
+    tree = tree_id(repo_path)
+    key = verification_key(repo_path, tree)
+    trace["tree_id"] = tree
+
+    hit = _lookup(key)
+    if hit is not None:
+        ok, error, report = hit
+        trace["verify_cache"] = "hit"
+        if on_output:
+            for line in report.splitlines():
+                on_output(line)
+        if not ok:
+            raise RuntimeError(error)
+        return {}
+
+    trace["verify_cache"] = "miss"
+    report = []
+
+    def collect(line: str):
+        if len(report) < MAX_REPORT_LINES:
+            report.append(line)
+        if on_output:
+            on_output(line)
+
+    try:
+        info = verify(repo_path, collect, cancel)
+    except RuntimeError as e:
+        if str(e).startswith(CACHEABLE_ERRORS):
+            _store(key, tree, False, str(e), report)
+        raise
+
+    _store(key, tree, True, None, report)
+    return info
@@ -0,0 +1,235 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.config import settings
+from app.metrics import register_gauge
+from app.envcache import cached_env
+from app.resources import measure, record, resource_log
+from app.verifier import has_tests, run_ast_checks, run_tests
+from app.warm_tests import WarmWorkerUnavailable, run_warm_tests
+
+CANCELLED = "Verification cancelled"
+
+# -------------------------------
+# Worker side
+# -------------------------------
+
+
+def _run_checks(repo_path: str, on_output, limits: dict, on_start=None) -> dict:
+    """
+    AST checks, then tests in the repo's cached environment, through its
+    warm worker when possible. `on_start` gets the test process group.
+    Returns environment info for the trace.
+    """
+    run_ast_checks(repo_path)
+
+    if not (settings.require_tests and has_tests(repo_path)):
+        return {}
+
+    with cached_env(repo_path) as (python, info):
+        if python and settings.warm_test_workers:
+            try:
+                run_warm_tests(
+                    python, info["env"], repo_path, on_output, limits, on_start
+                )
+                info["warm_tests"] = True
+                return info
+            except WarmWorkerUnavailable as e:
+                info["warm_tests"] = False
+                info["warm_error"] = str(e)
+
+        run_tests(
+            repo_path,
+            on_output=on_output,
+            limits=limits,
+            python=python,
+            on_start=on_start,
+        )
+    return info
+
+
+def _verify_job(repo_path: str, events, limits: dict) -> dict:
+    """
+    Runs in a pool process: AST checks hold that process's GIL, not the
+    API's, and pytest runs under the configured limits. Output lines and
+    the job's resource usage are relayed to the submitting thread through
+    `events`.
+    """
+    events.put(("started", None))
+    with resource_log() as usage:
+        try:
+            with measure("verification"):
+                return _run_checks(
+                    repo_path,
+                    lambda line: events.put(("line", line)),
+                    limits,
+                    lambda pgid: events.put(("pgid", pgid)),
+                )
+        finally:
+            events.put(("resources", usage.get("verification")))
+            events.put(("done", None))
+
+
+# -------------------------------
+# Pool
+# -------------------------------
+
+_pool = None
+_manager = None
+_lock = threading.Lock()
+_counts = {"queued": 0, "running": 0}
+
+
+def _context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+
+
+def get_pool():
+    """
+    Created on first use. forkserver workers start from a small clean
+    process instead of a fork of the API server, and are recycled after
+    VERIFY_MAX_TASKS_PER_CHILD jobs.
+    """
+    global _pool, _manager
+
+    with _lock:
+        if _pool is None:
+            ctx = _context()
+            if ctx.get_start_method() == "forkserver":
+                ctx.set_forkserver_preload(["app.verifier"])
+
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.verify_workers,
+                mp_context=ctx,
+                max_tasks_per_child=settings.verify_max_tasks_per_child or None,
+            )
+            if _manager is None:
+                _manager = ctx.Manager()
+
+    return _pool, _manager
+
+
+def _reset_pool(pool):
+    global _pool
+
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _limits() -> dict:
+    return {
+        "cpu_seconds": settings.verify_cpu_seconds,
+        "memory_mb": settings.verify_memory_mb,
+        "timeout_sec": settings.verify_timeout_sec,
+        "cgroup": settings.verify_cgroup,
+    }
+
+
+def _count(state: str, delta: int):
+    with _lock:
+        _counts[state] += delta
+
+
+def _cancel(future, pgid: int | None) -> bool:
+    """
+    Drops a queued job, or kills the tests of a running one. True once
+    the job is sure not to run to completion.
+    """
+    if future.cancel():
+        return True
+    if pgid:
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        return True
+    # still in AST checks or setting up the environment: retry next tick
+    return False
+
+
+def verify(repo_path: str, on_output=None, cancel: threading.Event | None = None) -> dict:
+    """
+    AST checks and tests for a workspace. Runs on the verification pool,
+    or inline when VERIFY_WORKERS=0. Raises RuntimeError on failure;
+    returns test environment info for the trace.
+
+    Setting `cancel` drops the job if it is still queued and kills its
+    tests if they are running; verify() then raises CANCELLED.
+    """
+    if cancel is not None and cancel.is_set():
+        raise RuntimeError(CANCELLED)
+    if settings.verify_workers <= 0:
+        return _run_checks(repo_path, on_output, _limits())
+
+    pool, manager = get_pool()
+    events = manager.Queue()
+    state = "queued"
+    pgid, cancelled = None, False
+    _count(state, 1)
+
+    try:
+        future = pool.submit(_verify_job, repo_path, events, _limits())
+
+        while True:
+            if cancel is not None and cancel.is_set() and not cancelled:
+                cancelled = _cancel(future, pgid)
+                if future.cancelled():
+                    break
+
+            try:
+                kind, value = events.get(timeout=0.2)
+            except queue.Empty:
+                if future.done():
+                    break
+                continue
+
+            if kind == "started":
+                _count(state, -1)
+                state = "running"
+                _count(state, 1)
+            elif kind == "pgid":
+                pgid = value
+            elif kind == "line" and on_output:
+                on_output(value)
+            elif kind == "resources":
+                record(value)
+            elif kind == "done":
+                break
+
+        if cancelled:
+            raise RuntimeError(CANCELLED)
+        return future.result()
+
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        raise RuntimeError("Verification worker died (likely out of memory or killed)")
+
+    finally:
+        _count(state, -1)
+
+
+register_gauge(
+    "safeagent_verify_queue_depth",
+    "Verification jobs waiting for a worker",
+    lambda: _counts["queued"],
+)
+register_gauge(
+    "safeagent_verify_running",
+    "Verification jobs currently running",
+    lambda: _counts["running"],
+)
+register_gauge(
+    "safeagent_verify_workers",
+    "Configured verification worker processes",
+    lambda: settings.verify_workers,
+)
@@ -0,0 +1,193 @@
+import fcntl
+import json
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+
+from app.config import settings
+from app.resources import child_usage, record
+from app.symbol_index import build_index
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pytest_server.py")
+
+
+class WarmWorkerUnavailable(RuntimeError):
+    """
+    The warm worker could not be started or dropped the connection;
+    callers fall back to a cold pytest run.
+    """
+
+
+def preload_modules(repo_path: str) -> list[str]:
+    """
+    Third-party top-level modules the repo imports, from the symbol index.
+    """
+    try:
+        origin = subprocess.check_output(
+            ["git", "config", "--get", "remote.origin.url"],
+            cwd=repo_path,
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+        index = build_index(repo_path, origin or repo_path)
+    except Exception:
+        return []
+
+    return sorted(index.external_imports())
+
+
+def _connect(path: str):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+# Warm workers this process started, by socket path
+_servers: dict[str, subprocess.Popen] = {}
+
+
+def _replace(path: str):
+    """
+    Stops and waits for the worker this process started on `path`, which
+    no longer accepts connections, before another takes its place.
+    """
+    proc = _servers.pop(path, None)
+    if proc is None:
+        return
+
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def _server(python: str, key: str, repo_path: str):
+    """
+    Connects to the warm worker for an environment, starting it if needed.
+    One worker per environment key serves every verification process.
+    """
+    path = os.path.join(settings.workspace_root, "envs", f"{key}.sock")
+
+    sock = _connect(path)
+    if sock:
+        return sock
+
+    with open(path + ".lock", "a+") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        sock = _connect(path)
+        if sock:
+            return sock
+
+        _replace(path)
+        proc = subprocess.Popen(
+            [
+                python,
+                "-I",
+                SERVER_SCRIPT,
+                path,
+                json.dumps(preload_modules(repo_path)),
+                str(settings.warm_worker_idle_sec),
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        _servers[path] = proc
+        # reaps it as soon as it idles out or crashes
+        threading.Thread(target=proc.wait, daemon=True).start()
+
+        deadline = time.time() + settings.warm_worker_start_timeout_sec
+        while time.time() < deadline:
+            sock = _connect(path)
+            if sock:
+                return sock
+            time.sleep(0.1)
+
+    raise WarmWorkerUnavailable(f"Warm test worker for {key} did not start")
+
+
+def run_warm_tests(
+    python: str,
+    key: str,
+    repo_path: str,
+    on_output=None,
+    limits: dict | None = None,
+    on_start=None,
+):
+    """
+    Runs pytest in a child forked from the environment's warm worker.
+    Same contract as verifier.run_tests.
+    """
+    limits = limits or {}
+    sock = _server(python, key, repo_path)
+
+    request = {"cwd": os.path.abspath(repo_path), "args": ["-q"], "limits": limits}
+    sock.sendall((json.dumps(request) + "\n").encode())
+
+    pid, code, pending, error = None, None, None, None
+    timed_out = threading.Event()
+    timer = None
+
+    def kill():
+        timed_out.set()
+        if pid:
+            # the child leads its own group: take its subprocesses down too
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    if limits.get("timeout_sec"):
+        timer = threading.Timer(limits["timeout_sec"], kill)
+        timer.start()
+
+    try:
+        with sock, sock.makefile("r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.rstrip("\n")
+
+                if line.startswith("\0PID "):
+                    pid = int(line[5:])
+                    if on_start:
+                        on_start(pid)
+                    continue
+                if line.startswith("\0ERROR "):
+                    error = json.loads(line[7:])
+                    continue
+                if line.startswith("\0RUSAGE "):
+                    record(child_usage(json.loads(line[8:])))
+                    continue
+                if line.startswith("\0EXIT "):
+                    code = int(line[6:])
+                    break
+
+                # hold one line back: the server precedes EXIT with a newline
+                if pending is not None and on_output:
+                    on_output(pending)
+                pending = line
+    finally:
+        if timer:
+            timer.cancel()
+
+    if pending and on_output:
+        on_output(pending)
+
+    if code is None:
+        raise WarmWorkerUnavailable("Warm test worker closed the connection")
+    if error and not timed_out.is_set():
+        # the child failed before or around pytest; a cold run gives the verdict
+        raise WarmWorkerUnavailable(f"Warm test worker error: {error}")
+    if timed_out.is_set():
+        raise RuntimeError(f"Tests timed out after {limits['timeout_sec']}s")
+    if code != 0:
+        raise RuntimeError("Tests failed")
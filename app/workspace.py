@@ -0,0 +1,273 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from app.config import settings
+from app.metrics import register_gauge
+from app.resources import check_call, check_output
+from app.snapshot import SKIP_DIRS, clone_repo, hash_files, load_files, remote_head
+
+
+# -------------------------------
+# Shared read-only snapshots
+# -------------------------------
+
+
+class Snapshot:
+    """
+    One clone of (repo_url, commit) shared by every run that targets it.
+
+    The checkout is never modified; its file listing and manifest are
+    computed once. Runs that patch or verify get their own worktree.
+    """
+
+    def __init__(self, repo_url: str, commit: str, path: str):
+        self.repo_url = repo_url
+        self.commit = commit
+        self.path = path
+        self.refs = 0
+        self.error = None
+
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._files = None
+        self._manifest = None
+
+    @property
+    def files(self) -> list[str]:
+        with self._lock:
+            if self._files is None:
+                self._files = list(load_files(self.path, content=False))
+            return self._files
+
+    @property
+    def manifest(self) -> dict[str, str]:
+        with self._lock:
+            if self._manifest is None:
+                self._manifest = hash_files(self.path)
+            return self._manifest
+
+    def fork(self) -> str:
+        """
+        Creates a private worktree at the snapshot commit. Objects are shared
+        with the snapshot, so this only writes the checked-out files.
+        """
+        path = os.path.join(settings.workspace_root, "worktrees", str(uuid.uuid4()))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self._lock:
+            _git(self.path, "worktree", "add", "--detach", path, self.commit)
+        return path
+
+    def discard(self, path: str):
+        with self._lock:
+            try:
+                _git(self.path, "worktree", "remove", "--force", path)
+            except subprocess.CalledProcessError:
+                shutil.rmtree(path, ignore_errors=True)
+                _git(self.path, "worktree", "prune")
+
+
+def _git(cwd: str, *args):
+    check_call(
+        ["git", *args],
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def _snapshot_dir(repo_url: str, commit: str) -> str:
+    key = hashlib.sha256(repo_url.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(settings.workspace_root, "snapshots", key, commit)
+
+
+_snapshots: dict[tuple[str, str], Snapshot] = {}
+_idle: OrderedDict[tuple[str, str], Snapshot] = OrderedDict()
+_lock = threading.Lock()
+
+
+def acquire_snapshot(repo_url: str, commit: str | None = None) -> Snapshot:
+    """
+    Returns the shared snapshot for (repo_url, commit), cloning it if no
+    other run holds it. Concurrent callers for the same key wait on one
+    clone. Without a commit the remote HEAD is resolved first.
+    """
+    commit = commit or remote_head(repo_url)
+    key = (repo_url, commit)
+
+    with _lock:
+        snap = _snapshots.get(key)
+        owner = snap is None
+        if owner:
+            snap = _snapshots[key] = Snapshot(
+                repo_url, commit, _snapshot_dir(repo_url, commit)
+            )
+        snap.refs += 1
+        _idle.pop(key, None)
+
+    if owner:
+        try:
+            shutil.rmtree(snap.path, ignore_errors=True)
+            clone_repo(repo_url, commit=commit, dest=snap.path)
+        except Exception as e:
+            snap.error = e
+            with _lock:
+                _snapshots.pop(key, None)
+        finally:
+            snap._ready.set()
+
+    snap._ready.wait()
+    if snap.error:
+        raise snap.error
+    return snap
+
+
+def release_snapshot(snap: Snapshot):
+    """
+    Drops a reference. Unreferenced snapshots stay cached for reuse
+    until more than SNAPSHOT_CACHE_SIZE are idle.
+    """
+    key = (snap.repo_url, snap.commit)
+    evicted = []
+
+    with _lock:
+        snap.refs -= 1
+        if snap.refs > 0 or _snapshots.get(key) is not snap:
+            return
+
+        _idle[key] = snap
+        while len(_idle) > settings.snapshot_cache_size:
+            old_key, old = _idle.popitem(last=False)
+            del _snapshots[old_key]
+            evicted.append(old)
+
+    for old in evicted:
+        shutil.rmtree(old.path, ignore_errors=True)
+
+
+@contextmanager
+def snapshot(repo_url: str, commit: str | None = None):
+    snap = acquire_snapshot(repo_url, commit)
+    try:
+        yield snap
+    finally:
+        release_snapshot(snap)
+
+
+# -------------------------------
+# File listings
+# -------------------------------
+
+_listings: OrderedDict[str, list[str]] = OrderedDict()
+
+
+def list_tree(repo_url: str, commit: str) -> tuple[str, list[str]]:
+    """
+    Paths at `commit`, read from a blobless, checkout-free fetch into a
+    temporary directory that is removed afterwards. Falls back to the
+    remote's current HEAD for servers that refuse to serve unadvertised
+    SHAs. Returns (commit listed, paths) with the same filtering as
+    load_files(content=False).
+    """
+    env = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+
+    def git(*args, cwd):
+        return check_output(
+            ["git", *args], cwd=cwd, stderr=subprocess.DEVNULL, env=env
+        )
+
+    with tempfile.TemporaryDirectory(prefix="safeagent-ls-") as tmp:
+        try:
+            git("init", "-q", cwd=tmp)
+            git("fetch", "-q", "--depth=1", "--filter=blob:none", repo_url, commit, cwd=tmp)
+            listed = commit
+            tree = git("ls-tree", "-r", "-z", "--full-tree", commit, cwd=tmp)
+        except subprocess.CalledProcessError:
+            path = os.path.join(tmp, "clone")
+            try:
+                git(
+                    "clone",
+                    "-q",
+                    "--depth=1",
+                    "--filter=blob:none",
+                    "--no-checkout",
+                    repo_url,
+                    path,
+                    cwd=tmp,
+                )
+                listed = git("rev-parse", "HEAD", cwd=path).decode().strip()
+                tree = git("ls-tree", "-r", "-z", "--full-tree", "HEAD", cwd=path)
+            except subprocess.CalledProcessError as e:
+                raise RuntimeError(f"Could not list files of {repo_url}: {e}")
+
+    files = []
+    for entry in tree.decode("utf-8", errors="surrogateescape").split("\0"):
+        if not entry:
+            continue
+        meta, rel = entry.split("\t", 1)
+        if meta.split()[1] == "commit":
+            # submodules are not checked out by a plain clone either
+            continue
+        if SKIP_DIRS.intersection(rel.split("/")[:-1]):
+            continue
+        files.append(rel)
+
+    return listed, files
+
+
+def list_files(repo_url: str) -> tuple[str, list[str]]:
+    """
+    (commit, paths) at the remote HEAD without keeping a clone: one
+    ls-remote, then a cached listing for that commit, an on-disk
+    snapshot's listing, or list_tree().
+    """
+    commit = remote_head(repo_url)
+
+    with _lock:
+        if commit in _listings:
+            _listings.move_to_end(commit)
+            return commit, _listings[commit]
+        snap = _snapshots.get((repo_url, commit))
+        if snap is not None and snap._ready.is_set() and snap.error is None:
+            # hold a reference so the snapshot is not evicted while listed
+            snap.refs += 1
+            _idle.pop((repo_url, commit), None)
+        else:
+            snap = None
+
+    if snap is not None:
+        try:
+            files = snap.files
+        finally:
+            release_snapshot(snap)
+    else:
+        commit, files = list_tree(repo_url, commit)
+
+    if settings.listing_cache_size > 0:
+        with _lock:
+            # trees are content-addressed: the SHA alone is the key, so
+            # forks and mirrors share entries
+            _listings[commit] = files
+            while len(_listings) > settings.listing_cache_size:
+                _listings.popitem(last=False)
+
+    return commit, files
+
+
+register_gauge(
+    "safeagent_snapshots_cached",
+    "Repo snapshots on disk",
+    lambda: len(_snapshots),
+)
+register_gauge(
+    "safeagent_snapshots_in_use",
+    "Repo snapshots referenced by running sessions",
+    lambda: len(_snapshots) - len(_idle),
+)
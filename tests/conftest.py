@@ -0,0 +1,61 @@
+import os
+import subprocess
+import tempfile
+
+import pytest
+
+# Run the whole suite against a throwaway SQLite database; must be set
+# before app.config is imported.
+_tmp = tempfile.mkdtemp(prefix="safeagent-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/safeagent.db")
+os.environ.setdefault("AUDIT_LOG_PATH", f"{_tmp}/audit.log")
+os.environ.setdefault("WORKSPACE_ROOT", f"{_tmp}/workspace")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    from app.db import init_db
+
+    init_db()
+
+
+class GitRepos:
+    """
+    Makes throwaway git repositories under a test's tmp_path.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def __call__(self, name: str = "repo", files: dict | None = None):
+        """
+        Initializes `name` and, unless `files` is empty, commits them
+        (by default a single mod.py). Returns the repo's path.
+        """
+        repo = self.root / name
+        repo.mkdir(parents=True, exist_ok=True)
+        self.git(repo, "init", "-q")
+
+        files = {"mod.py": "x = 1\n"} if files is None else files
+        if files:
+            self.commit(repo, "one", files)
+        return repo
+
+    def git(self, repo, *args):
+        subprocess.check_call(
+            ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+            cwd=repo,
+            stdout=subprocess.DEVNULL,
+        )
+
+    def commit(self, repo, message: str, files: dict | None = None):
+        for path, content in (files or {}).items():
+            (repo / path).parent.mkdir(parents=True, exist_ok=True)
+            (repo / path).write_text(content)
+        self.git(repo, "add", "-A")
+        self.git(repo, "commit", "-qm", message)
+
+
+@pytest.fixture
+def git_repo(tmp_path):
+    return GitRepos(tmp_path)
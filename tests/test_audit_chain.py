@@ -0,0 +1,88 @@
+import multiprocessing
+
+from app.audit import AuditWriter
+from app.audit_verify import verify
+
+
+def _write(path, count, **kwargs):
+    writer = AuditWriter(str(path), fsync="never", batch_size=5, **kwargs)
+    for i in range(count):
+        writer.write({"id": str(i), "timestamp": 0.0, "status": "success"})
+    writer.close()
+
+
+def test_chain_verifies_across_rotations_and_ranges(tmp_path):
+    log = tmp_path / "audit.log"
+    _write(log, 300, checkpoint_every=20, rotate_bytes=8_000)
+
+    report = verify(str(log), workers=1)
+    assert report["ok"], report["errors"]
+    assert report["entries"] == 300
+    assert report["head_seq"] == 300
+    assert report["files"] > 1
+
+    partial = verify(str(log), from_seq=150, to_seq=170, workers=1)
+    assert partial["ok"]
+    assert partial["entries"] < 100
+
+
+def _write_concurrently(path, worker):
+    writer = AuditWriter(
+        path, fsync="never", batch_size=7, checkpoint_every=50, rotate_bytes=20_000
+    )
+    for i in range(400):
+        writer.write({"id": f"{worker}-{i}", "timestamp": 0.0, "status": "success"})
+    writer.close()
+
+
+def test_concurrent_writers_keep_one_chain_across_rotations(tmp_path):
+    log = str(tmp_path / "audit.log")
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_write_concurrently, args=(log, w)) for w in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert all(p.exitcode == 0 for p in procs)
+
+    report = verify(log, workers=1)
+    assert report["ok"], report["errors"]
+    assert report["entries"] == report["head_seq"] == 1600
+    assert report["files"] > 1
+
+
+def test_edited_entry_is_detected(tmp_path):
+    log = tmp_path / "audit.log"
+    _write(log, 50, checkpoint_every=10)
+
+    lines = log.read_text().splitlines()
+    lines[7] = lines[7].replace('"status": "success"', '"status": "failed!"')
+    log.write_text("\n".join(lines) + "\n")
+
+    report = verify(str(log), workers=1)
+    assert not report["ok"]
+    assert any("seq 8" in e for e in report["errors"])
+
+
+def test_failed_batch_is_retried_not_dropped(tmp_path, monkeypatch):
+    import pytest
+
+    log = tmp_path / "audit.log"
+    writer = AuditWriter(str(log), fsync="never", batch_size=5)
+    real_write = writer._write_batch
+    monkeypatch.setattr(writer, "_write_batch", lambda batch: 1 / 0)
+
+    for i in range(3):
+        writer.write({"id": str(i), "timestamp": 0.0, "status": "success"})
+    with pytest.raises(RuntimeError, match="3 unwritten"):
+        writer.flush()
+    assert "ZeroDivisionError" in writer.error
+
+    monkeypatch.setattr(writer, "_write_batch", real_write)
+    writer.write({"id": "3", "timestamp": 0.0, "status": "success"})
+    writer.flush()
+    writer.close()
+
+    assert (writer.pending, writer.dropped, writer.error) == (0, 0, None)
+    report = verify(str(log), workers=1)
+    assert report["ok"] and report["entries"] == 4
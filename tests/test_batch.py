@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+
+from app import batch, llm
+from app.db import AsyncSessionLocal
+
+
+def test_single_flight_shares_one_call():
+    calls = []
+    gate = threading.Event()
+
+    def compute():
+        calls.append(1)
+        gate.wait(1)
+        return '["README.md"]'
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(llm._single_flight("k-shared", compute)))
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    gate.set()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert results == ['["README.md"]'] * 5
+    assert llm._single_flight("k-shared", compute) == '["README.md"]'
+    assert len(calls) == 1
+
+
+def test_batch_tracks_item_progress(monkeypatch):
+    def fake_pipeline(repo_url, prompt, session_id, candidates):
+        if repo_url.endswith("broken"):
+            raise RuntimeError("clone failed")
+        return {"session_id": session_id, "status": "success"}
+
+    monkeypatch.setattr(batch, "run_pipeline", fake_pipeline)
+
+    batch_id = batch.submit_batch(["repo-a", "repo-b", "repo-a", "repo-broken"], "bump")
+
+    async def progress():
+        async with AsyncSessionLocal() as db:
+            return await batch.batch_progress(db, batch_id)
+
+    for _ in range(100):
+        report = asyncio.run(progress())
+        if report["done"] == report["total"]:
+            break
+        time.sleep(0.05)
+
+    assert report["total"] == 3
+    assert report["counts"] == {"success": 2, "failed": 1}
+    assert report["items"][2]["error"] == "clone failed"
+
+
+def test_response_cache_is_scoped_to_a_batch(monkeypatch):
+    calls = []
+
+    def fake_complete(messages, guard, model):
+        calls.append(model)
+        return '{"edits": []}', {}
+
+    monkeypatch.setattr(llm, "_complete", fake_complete)
+    messages = llm.assemble("system", ["files"], "request")
+
+    # interactive runs never share responses
+    llm._ask_json(messages, cache=True)
+    llm._ask_json(messages, cache=True)
+    assert len(calls) == 2
+
+    with llm.response_cache("batch-1"):
+        llm._ask_json(messages, cache=True)
+        llm._ask_json(messages, cache=True)
+    assert len(calls) == 3
+
+    with llm.response_cache("batch-2"):
+        llm._ask_json(messages, cache=True)
+    assert len(calls) == 4
+
+    # an escalated stage does not reuse the weaker model's answer
+    monkeypatch.setattr(llm.router, "choose", lambda stage, chars=0: "strong")
+    with llm.response_cache("batch-2"):
+        llm._ask_json(messages, cache=True)
+    assert calls[-1] == "strong" and len(calls) == 5
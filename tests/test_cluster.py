@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta
+
+from app import batch, cluster
+from app.config import settings
+from app.db import SessionLocal, AgentSession, ClusterNode, SessionLease
+
+
+def test_rendezvous_moves_only_repos_won_by_new_node():
+    repos = [f"https://example.com/repo-{i}" for i in range(200)]
+    before = {r: cluster.rendezvous_owner(r, ["a", "b", "c"]) for r in repos}
+    after = {r: cluster.rendezvous_owner(r, ["a", "b", "c", "d"]) for r in repos}
+
+    moved = [r for r in repos if before[r] != after[r]]
+    assert moved and all(after[r] == "d" for r in moved)
+    assert set(before.values()) == {"a", "b", "c"}
+
+
+def test_expired_lease_fails_over_then_gives_up(monkeypatch):
+    monkeypatch.setattr(settings, "node_url", "http://node-b:8000")
+    monkeypatch.setattr(settings, "session_max_attempts", 2)
+    monkeypatch.setattr(cluster, "_node_id", "node-b")
+    scheduled = []
+    monkeypatch.setattr(batch, "schedule", lambda *job: scheduled.append(job))
+
+    stale = datetime.utcnow() - timedelta(minutes=5)
+    with SessionLocal() as db:
+        db.add(ClusterNode(id="node-a", url="http://node-a:8000", heartbeat_at=stale))
+        db.add(
+            SessionLease(
+                session_id="s-failover",
+                repo_url="https://example.com/repo",
+                prompt="bump",
+                node_id="node-a",
+                state="running",
+                attempts=1,
+                expires_at=stale,
+            )
+        )
+        db.add(
+            AgentSession(
+                id="s-failover",
+                repo_url="https://example.com/repo",
+                prompt="bump",
+                status="patching",
+            )
+        )
+        db.commit()
+
+    cluster.heartbeat()
+    assert cluster.reap() == 1
+    assert scheduled[0][:3] == ("https://example.com/repo", "bump", "s-failover")
+
+    with SessionLocal() as db:
+        lease = db.get(SessionLease, "s-failover")
+        assert (lease.node_id, lease.attempts) == ("node-b", 2)
+        assert db.get(AgentSession, "s-failover") is None
+
+        # node-b dies mid-run too: out of attempts
+        lease.expires_at = stale
+        db.commit()
+
+    assert cluster.reap() == 0
+    with SessionLocal() as db:
+        assert db.get(SessionLease, "s-failover") is None
+        row = db.get(AgentSession, "s-failover")
+        assert (row.status, row.error) == ("failed", cluster.LOST_NODE_ERROR)
+
+
+def test_stale_node_is_fenced_off(monkeypatch):
+    monkeypatch.setattr(settings, "node_url", "http://node-a:8000")
+    monkeypatch.setattr(cluster, "_node_id", "node-a")
+
+    with SessionLocal() as db:
+        db.add(
+            SessionLease(
+                session_id="s-fenced",
+                repo_url="https://example.com/repo",
+                prompt="bump",
+                node_id="node-a",
+                state="running",
+                attempts=1,
+                expires_at=datetime.utcnow(),
+            )
+        )
+        for session_id, state in (("s-running", "running"), ("s-queued", "queued")):
+            db.add(
+                SessionLease(
+                    session_id=session_id,
+                    repo_url="https://example.com/repo",
+                    prompt="bump",
+                    node_id="node-a",
+                    state=state,
+                    attempts=1,
+                    expires_at=datetime.utcnow() + timedelta(minutes=5),
+                )
+            )
+        db.commit()
+
+    with cluster.held("s-fenced"):
+        with SessionLocal() as db:
+            assert cluster.holds(db, "s-fenced")
+            db.commit()
+
+        # node-a stalls and node-b claims the session
+        with SessionLocal() as db:
+            db.get(SessionLease, "s-fenced").node_id = "node-b"
+            db.commit()
+
+        with SessionLocal() as db:
+            assert not cluster.holds(db, "s-fenced")
+
+        # a clean shutdown only hands back what has not started
+        cluster.leave()
+        with SessionLocal() as db:
+            assert db.get(SessionLease, "s-queued").expires_at <= datetime.utcnow()
+            assert db.get(SessionLease, "s-running").expires_at > datetime.utcnow()
+
+    # leaving held() does not drop node-b's lease
+    with SessionLocal() as db:
+        assert db.get(SessionLease, "s-fenced").node_id == "node-b"
+
+
+def test_events_follow_the_session_to_its_node(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    monkeypatch.setattr(settings, "node_url", "http://node-b:8000")
+    monkeypatch.setattr(cluster, "_node_id", "node-b")
+    monkeypatch.setattr(cluster, "_nodes_at", 0.0)
+
+    with SessionLocal() as db:
+        db.add(
+            ClusterNode(id="node-c", url="http://node-c:8000", heartbeat_at=datetime.utcnow())
+        )
+        db.add(
+            SessionLease(
+                session_id="s-remote",
+                repo_url="https://example.com/repo",
+                prompt="bump",
+                node_id="node-c",
+                state="running",
+                attempts=1,
+                expires_at=datetime.utcnow() + timedelta(minutes=5),
+            )
+        )
+        db.commit()
+
+    client = TestClient(app)
+
+    res = client.get("/sessions/s-remote/events", follow_redirects=False)
+    assert res.status_code == 307
+    assert res.headers["location"] == "http://node-c:8000/sessions/s-remote/events?routed=true"
+
+    # not running here: the stream ends instead of sending keepalives forever
+    res = client.get("/sessions/s-unknown/events")
+    assert res.text.startswith("event: error\n")
+    assert "Session is not running on this node" in res.text
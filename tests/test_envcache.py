@@ -0,0 +1,75 @@
+import fcntl
+import os
+
+from app import envcache
+from app.config import settings
+
+
+def test_env_key_tracks_lockfiles(tmp_path):
+    assert envcache.env_key(str(tmp_path)) is None
+
+    (tmp_path / "requirements.txt").write_text("requests==2.32.0\n")
+    first = envcache.env_key(str(tmp_path))
+
+    (tmp_path / "app.py").write_text("print('unrelated')\n")
+    assert envcache.env_key(str(tmp_path)) == first
+
+    (tmp_path / "requirements-dev.txt").write_text("pytest\n")
+    assert envcache.env_key(str(tmp_path)) != first
+
+
+def test_poetry_lock_pins_win(tmp_path):
+    (tmp_path / "pyproject.toml").write_text(
+        '[project]\nname = "x"\ndependencies = ["requests>=2"]\n'
+    )
+    (tmp_path / "poetry.lock").write_text(
+        '[[package]]\nname = "requests"\nversion = "2.32.3"\n\n'
+        '[[package]]\nname = "extra-only"\nversion = "1.0"\noptional = true\n\n'
+        '[[package]]\nname = "colorama"\nversion = "0.4.6"\n'
+        'markers = "sys_platform == \\"win32\\""\n'
+    )
+
+    specs, files = envcache.requirements(str(tmp_path))
+
+    assert specs == [
+        "pytest",
+        "requests==2.32.3",
+        'colorama==0.4.6; sys_platform == "win32"',
+    ]
+    assert files == []
+
+
+def test_poetry2_group_markers(tmp_path):
+    (tmp_path / "poetry.lock").write_text(
+        '[[package]]\nname = "colorama"\nversion = "0.4.6"\n'
+        'groups = ["main", "dev"]\n'
+        'markers = {main = "sys_platform == \\"win32\\"", dev = "platform_system == \\"Windows\\""}\n\n'
+        '[[package]]\nname = "tomli"\nversion = "2.0.1"\ngroups = ["main", "dev"]\n'
+        'markers = {dev = "python_version < \\"3.11\\""}\n'
+    )
+
+    specs, _ = envcache.requirements(str(tmp_path))
+
+    assert specs == [
+        "pytest",
+        'colorama==0.4.6; (sys_platform == "win32") or (platform_system == "Windows")',
+        # unconditional in main
+        "tomli==2.0.1",
+    ]
+
+
+def test_evict_keeps_recent_and_in_use(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "workspace_root", str(tmp_path))
+    root = tmp_path / "envs"
+
+    for i, name in enumerate(["old", "busy", "new"]):
+        (root / name).mkdir(parents=True)
+        marker = root / name / envcache.READY_MARKER
+        marker.write_text("")
+        os.utime(marker, (i, i))
+
+    with open(root / "busy.lock", "a+") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        envcache.evict(keep=1)
+
+    assert sorted(os.listdir(root)) == ["busy", "busy.lock", "new", "old.lock"]
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from app.json_stream import JSONStreamGuard, StreamAbort, path_checker
+
+
+def _feed_in_chunks(guard, text, size=3):
+    for i in range(0, len(text), size):
+        if guard.feed(text[i : i + size]):
+            return True
+    return False
+
+
+def test_guard_stops_at_end_of_value_and_skips_fences():
+    plan = {"edits": [{"file_path": "app/main.py", "unified_diff": "x = '{y}'\n"}]}
+    text = "```json\n" + json.dumps(plan) + "\n```\nHope this helps!"
+    guard = JSONStreamGuard("object", check=path_checker(["app/main.py"]))
+
+    assert _feed_in_chunks(guard, text)
+    assert json.loads(guard.text()) == plan
+
+
+def test_guard_aborts_on_invented_path_before_completion():
+    guard = JSONStreamGuard("object", check=path_checker(["app/main.py"]))
+
+    with pytest.raises(StreamAbort, match="does not exist"):
+        _feed_in_chunks(guard, '{"edits": [{"file_path": "app/ghost.py", "unified_diff": "')
+
+
+def test_guard_rejects_wrong_container_and_unknown_keys():
+    with pytest.raises(StreamAbort):
+        JSONStreamGuard("array").feed('{"files": []}')
+
+    guard = JSONStreamGuard("object", keys={1: {"edits"}})
+    with pytest.raises(StreamAbort, match="Unexpected key"):
+        guard.feed('{"changes": [')
+
+
+def test_selection_checker_only_checks_top_level_items():
+    guard = JSONStreamGuard("array", check=path_checker(["README.md"], key=None))
+
+    assert guard.feed('["README.md"]')
+    with pytest.raises(StreamAbort):
+        JSONStreamGuard("array", check=path_checker(["README.md"], key=None)).feed(
+            '["README.md", "nope.md"]'
+        )
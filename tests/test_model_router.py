@@ -0,0 +1,75 @@
+from app import model_router
+from app.config import settings
+from app.models import AgentPlan
+from app.model_router import (
+    ModelRouter,
+    llm_call_log,
+    llm_trace,
+    record_call,
+    record_outcome,
+)
+
+
+def test_router_escalates_on_poor_success(monkeypatch):
+    monkeypatch.setattr(settings, "llm_fast_model", "fast")
+    monkeypatch.setattr(settings, "llm_strong_model", "strong")
+    router = ModelRouter()
+
+    assert router.choose("select") == "fast"
+    assert router.choose("repair") == "strong"
+    assert router.choose("rewrite", context_chars=10) == "fast"
+    assert router.choose("rewrite", context_chars=10**6) == "strong"
+
+    for i in range(20):
+        router.record("plan", "fast", ok=i % 2 == 0, ms=500)
+    assert router.choose("plan") == "strong"
+
+    monkeypatch.setattr(settings, "llm_plan_model", "pinned")
+    assert router.choose("plan") == "pinned"
+
+
+def test_router_prefers_clearly_faster_eligible_model(monkeypatch):
+    monkeypatch.setattr(settings, "llm_fast_model", "fast")
+    monkeypatch.setattr(settings, "llm_strong_model", "strong")
+    router = ModelRouter()
+
+    router.seed(
+        [{"llm_calls": [{"stage": "select", "model": "fast", "ok": True, "ms": 4000}] * 10},
+         {"llm_calls": [{"stage": "select", "model": "strong", "ok": True, "ms": 900}] * 10}]
+    )
+
+    assert router.choose("select") == "strong"
+
+
+def test_call_log_totals_tokens():
+    with llm_call_log():
+        record_call("select", "fast", 10.0, True, {"prompt_tokens": 100, "completion_tokens": 5, "cached_tokens": 64})
+        record_call("plan", "fast", 20.0, True, {"prompt_tokens": 300, "completion_tokens": 50, "cached_tokens": 0})
+        trace = llm_trace()
+
+    assert len(trace["llm_calls"]) == 2
+    assert trace["llm_tokens"] == {"prompt": 400, "completion": 55, "cached": 64, "cached_ratio": 0.16}
+    assert llm_trace() == {}
+
+
+def test_outcomes_score_the_call_that_made_the_plan(monkeypatch):
+    scored = []
+    monkeypatch.setattr(
+        model_router.router, "record", lambda stage, model, ok, ms=None: scored.append((model, ok))
+    )
+
+    with llm_call_log() as calls:
+        fast = AgentPlan(edits=[]).produced_by(record_call("plan", "fast", 10.0, True))
+        strong = AgentPlan(edits=[]).produced_by(record_call("plan", "strong", 10.0, True))
+
+        # candidates finish in any order; each outcome goes to its own call
+        record_outcome(fast.llm_call, False)
+        record_outcome(strong.llm_call, True)
+        # a serial fallback re-applying a scored plan does not count twice
+        record_outcome(fast.llm_call, True)
+        # plans reused from the response cache carry no call
+        record_outcome(AgentPlan(edits=[]).llm_call, True)
+
+    assert scored == [("fast", False), ("strong", True)]
+    assert [c["outcome"] for c in calls] == [False, True]
+    assert "llm_call" not in fast.model_dump()
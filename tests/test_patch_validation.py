@@ -1,4 +1,5 @@
 import pytest
+from app import sandbox
 from app.models import FileEdit, AgentPlan
 from app.policy import enforce_policy
 from app.sandbox import execute_plan
@@ -17,11 +18,13 @@ def test_policy_blocks_github_directory():
         enforce_policy(edits)
 
 
-def test_hash_mismatch_blocks_execution(tmp_path):
+def test_hash_mismatch_blocks_execution(git_repo, monkeypatch):
     """
     Ensures hallucinated or stale edits are rejected.
     """
-    # Fake plan against nonexistent repo
+    repo = git_repo(files={"fake.py": "test\n"})
+
+    # Stale plan: hash does not match the file on disk
     plan = AgentPlan(
         edits=[
             FileEdit(
@@ -32,8 +35,22 @@ def test_hash_mismatch_blocks_execution(tmp_path):
         ]
     )
 
-    with pytest.raises(Exception):
-        execute_plan("https://github.com/nonexistent/repo.git", plan)
+    errors = []
+
+    def stale_repair(**kwargs):
+        errors.append(kwargs["error"])
+        return plan
+
+    def no_rewrite(**kwargs):
+        raise RuntimeError("rewrite unavailable")
+
+    monkeypatch.setattr(sandbox, "repair_plan", stale_repair)
+    monkeypatch.setattr(sandbox, "repair_full_file", no_rewrite)
+
+    result = execute_plan(f"file://{repo}", plan)
+
+    assert result["status"] == "failed"
+    assert errors and all("Hash mismatch for fake.py" in e for e in errors)
 
 
 def test_legit_plan_structure():
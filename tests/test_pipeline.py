@@ -0,0 +1,79 @@
+import threading
+from contextlib import contextmanager
+
+from app import pipeline
+from app.artifacts import get_artifact
+from app.db import SessionLocal, AgentSession
+
+
+def test_failure_before_planning_is_recorded(monkeypatch):
+    events = []
+    monkeypatch.setattr(
+        pipeline, "publish", lambda sid, event, **f: events.append((event, f))
+    )
+
+    @contextmanager
+    def broken_snapshot(repo_url):
+        raise RuntimeError("Git clone failed")
+        yield
+
+    monkeypatch.setattr(pipeline, "snapshot", broken_snapshot)
+
+    result = pipeline.run_pipeline("https://example.com/gone", "bump", "s-early")
+
+    assert result == {
+        "session_id": "s-early",
+        "status": "failed",
+        "error": "Git clone failed",
+    }
+    with SessionLocal() as db:
+        row = db.get(AgentSession, "s-early")
+        assert (row.status, row.error) == ("failed", "Git clone failed")
+        assert get_artifact(db, "s-early", "trace") is not None
+
+    event, fields = events[-1]
+    assert event == "session_finished" and fields["status"] == "failed"
+
+
+def test_first_candidate_is_returned_before_slow_ones(monkeypatch):
+    release = threading.Event()
+
+    def build_plan(prompt, files, manifest, variant):
+        if variant:
+            release.wait(10)
+        return f"plan-{variant}"
+
+    monkeypatch.setattr(pipeline, "build_plan", build_plan)
+
+    first, rest = pipeline.build_candidates("bump", {}, {}, 3)
+    assert first == "plan-0"
+
+    release.set()
+    assert sorted(rest) == ["plan-1", "plan-2"]
+
+
+def test_run_reserves_the_session_id(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from app import main
+
+    ran = []
+
+    def fake_run(repo_url, prompt, session_id, candidates=None):
+        with SessionLocal() as db:
+            ran.append(db.get(AgentSession, session_id).status)
+        return {"session_id": session_id, "status": "success"}
+
+    monkeypatch.setattr(main, "run_pipeline", fake_run)
+    client = TestClient(main.app)
+    body = {
+        "repo_url": "https://example.com/repo",
+        "prompt": "bump",
+        "session_id": "6f1c1d57-3a0e-4c55-9b36-0d5c1f0e2a11",
+    }
+
+    assert client.post("/run", json=body).status_code == 200
+    # the row exists before the pipeline starts, so a second post is refused
+    # by the insert itself rather than by a check that can race
+    assert client.post("/run", json=body).status_code == 409
+    assert ran == ["queued"]
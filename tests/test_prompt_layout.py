@@ -0,0 +1,49 @@
+from app import llm, sandbox
+from app.models import AgentPlan, FileEdit
+
+
+def test_plan_and_repair_share_prompt_prefix(monkeypatch):
+    sent = []
+
+    def fake_ask(messages, **kwargs):
+        sent.append(messages)
+        return {"edits": []}, None
+
+    monkeypatch.setattr(llm, "_ask_json_call", fake_ask)
+
+    files = {"b.py": "y = 2\n", "a.py": "x = 1\n"}
+    manifest = {"a.py": "h1", "b.py": "h2", "c.py": "h3"}
+
+    assert llm.build_plan("rename x", files, manifest, variant=1) == AgentPlan(edits=[])
+
+    # the repair loop gets the plan's files, not just the ones it edited
+    applied = iter([RuntimeError("patch does not apply"), None])
+
+    def apply(repo, manifest, plan):
+        error = next(applied)
+        if error:
+            raise error
+
+    monkeypatch.setattr(sandbox, "_apply_plan", apply)
+    monkeypatch.setattr(sandbox, "repair_plan", llm.repair_plan)
+    monkeypatch.setattr(sandbox, "cached_verify", lambda repo, **kw: {})
+    monkeypatch.setattr(sandbox, "_update_session", lambda *a, **kw: None)
+    monkeypatch.setattr(sandbox, "publish", lambda *a, **kw: None)
+
+    failed = AgentPlan(
+        edits=[FileEdit(file_path="a.py", original_hash="h1", unified_diff="bad diff")]
+    )
+    sandbox._patch_and_verify(
+        "s", "/nonexistent", manifest, failed, "rename x", {}, None, files=files
+    )
+
+    plan, repair = sent
+    assert plan[:2] == repair[:2]
+    assert plan[2] != repair[2]
+
+    # deterministic: sorted paths, compact manifest of the given files only
+    stable = plan[1]["content"]
+    assert stable.index("### a.py") < stable.index("### b.py")
+    assert '{"a.py":"h1","b.py":"h2"}' in stable
+    assert "rename x" not in stable
+    assert "bad diff" in repair[2]["content"]
@@ -0,0 +1,66 @@
+import pytest
+
+from app import sandbox
+from app.artifacts import get_artifact, put_artifact
+from app.db import SessionLocal, AgentSession, SessionRollup
+from app.models import AgentPlan, FileEdit
+from app.sandbox import diff_traces, execute_plan, replay_session
+from app.snapshot import hash_files
+
+
+def test_diff_traces_reports_numeric_deltas():
+    diff = diff_traces(
+        {"patch_ms": 10.0, "commit": "abc", "repair_attempts": 0},
+        {"patch_ms": 15.0, "commit": "abc", "repair_attempts": 0},
+    )
+
+    assert diff == {"patch_ms": {"original": 10.0, "replay": 15.0, "delta": 5.0, "ratio": 1.5}}
+
+
+def test_replay_pins_original_commit(git_repo, monkeypatch):
+    repo = git_repo()
+
+    plan = AgentPlan(
+        edits=[
+            FileEdit(
+                file_path="mod.py",
+                original_hash=hash_files(str(repo))["mod.py"],
+                unified_diff="--- a/mod.py\n+++ b/mod.py\n@@ -1 +1 @@\n-x = 1\n+x = 2\n",
+            )
+        ]
+    )
+    monkeypatch.setattr(sandbox, "_open_pull_request", lambda repo, plan: ("pr", "b"))
+    execute_plan(f"file://{repo}", plan, "bump x", session_id="replay-src")
+
+    # the upstream moves on; the replay must still see the original file
+    git_repo.commit(repo, "two", {"mod.py": "x = 100\n"})
+    git_repo.git(repo, "config", "uploadpack.allowAnySHA1InWant", "true")
+
+    result = replay_session("replay-src")
+
+    with SessionLocal() as db:
+        original = get_artifact(db, "replay-src", "trace")
+
+    assert result["status"] == "success"
+    assert result["commit"] == original["commit"]
+    assert result["trace"]["replay_of"] == "replay-src"
+    assert result["trace_diff"]["replay_of"] == {"original": None, "replay": "replay-src"}
+
+    # only the original run counts towards /stats
+    with SessionLocal() as db:
+        counted = (
+            db.query(SessionRollup)
+            .filter_by(repo_url=f"file://{repo}", metric="status", key="success")
+            .one()
+        )
+        assert counted.count == 1
+
+
+def test_replay_refuses_session_without_commit():
+    with SessionLocal() as db:
+        db.add(AgentSession(id="legacy-1", repo_url="file:///x", prompt="p", status="success"))
+        put_artifact(db, "legacy-1", "plan", {"edits": []})
+        db.commit()
+
+    with pytest.raises(ValueError, match="no recorded commit"):
+        replay_session("legacy-1")
@@ -0,0 +1,51 @@
+import sys
+import threading
+
+from app.model_router import llm_call_log, record_call
+from app.resources import check_call, measure, record, resource_log, resource_trace
+
+
+def test_stages_record_subprocess_cpu_and_tokens():
+    assert resource_trace() == {}
+
+    with llm_call_log(), resource_log():
+        with measure("discover"):
+            check_call([sys.executable, "-c", "sum(i * i for i in range(3_000_000))"])
+        with measure("plan"):
+            record_call("plan", "m", 5.0, True, {"prompt_tokens": 120, "completion_tokens": 30})
+            record({"children_user_s": 1.5, "children_peak_rss_mb": 900.0})
+        with measure("plan"):
+            record_call("plan", "m", 5.0, True, {"prompt_tokens": 80, "completion_tokens": 10})
+
+        resources = resource_trace()["resources"]
+
+    discover, plan = resources["discover"], resources["plan"]
+    assert discover["children_user_s"] + discover["children_sys_s"] > 0
+    assert discover["children_peak_rss_mb"] > 0
+    assert discover["process_peak_rss_mb"] > 0
+    assert "llm_prompt_tokens" not in discover
+
+    # repeated stages accumulate; peaks take the maximum
+    assert (plan["llm_prompt_tokens"], plan["llm_completion_tokens"]) == (200, 40)
+    assert plan["children_user_s"] >= 1.5
+    assert plan["children_peak_rss_mb"] == 900.0
+
+
+def test_concurrent_sessions_do_not_share_subprocess_usage():
+    def session(out, code):
+        with resource_log() as usage, measure("patch"):
+            check_call([sys.executable, "-c", code])
+        out.update(usage["patch"])
+
+    # the idle session's stage spans the busy one's subprocess entirely
+    busy, idle = {}, {}
+    threads = [
+        threading.Thread(target=session, args=(busy, "sum(i * i for i in range(3_000_000))")),
+        threading.Thread(target=session, args=(idle, "import time; time.sleep(1.5)")),
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert busy["children_user_s"] > idle["children_user_s"] + 0.1
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+
+from app.db import SessionLocal, AgentSession
+from app.main import _naive_utc, app
+
+
+def test_aware_bounds_become_naive_utc():
+    aware = datetime(2024, 5, 1, 12, 0, tzinfo=timezone(timedelta(hours=2)))
+    assert _naive_utc(aware) == datetime(2024, 5, 1, 10, 0)
+    assert _naive_utc(datetime(2024, 5, 1, 12, 0)) == datetime(2024, 5, 1, 12, 0)
+    assert _naive_utc(None) is None
+
+
+def _row(session_id, created_at, repo_url, status="success"):
+    return AgentSession(
+        id=session_id,
+        created_at=created_at,
+        repo_url=repo_url,
+        prompt="bump",
+        files_changed=[],
+        status=status,
+    )
+
+
+def test_keyset_pages_have_no_gaps_or_duplicates():
+    repo = "https://example.com/paged"
+    base = datetime(2025, 1, 10, 9, 0)
+
+    expected = []
+    with SessionLocal() as db:
+        for i in range(9):
+            # three sessions per timestamp: pages must split ties by id
+            at = base + timedelta(minutes=i // 3)
+            status = "failed" if i == 4 else "success"
+            db.add(_row(f"page-{i}", at, repo, status))
+            if status == "success":
+                expected.append((at, f"page-{i}"))
+
+        # filtered out by repo, or outside the since/until window
+        for sid, url, at in (
+            ("page-other", repo + "2", base),
+            ("page-early", repo, base - timedelta(hours=1)),
+            ("page-late", repo, base + timedelta(hours=1)),
+        ):
+            db.add(_row(sid, at, url))
+        db.commit()
+
+    expected = [sid for _, sid in sorted(expected, reverse=True)]
+
+    client = TestClient(app)
+    params = {
+        "repo_url": repo,
+        "status": "success",
+        # aware bounds, 09:00 and 09:30 UTC
+        "since": "2025-01-10T10:00:00+01:00",
+        "until": "2025-01-10T09:30:00Z",
+        "limit": 3,
+    }
+
+    seen, pages = [], 0
+    while True:
+        res = client.get("/sessions", params=params)
+        assert res.status_code == 200
+        seen += [row["id"] for row in res.json()]
+        pages += 1
+
+        cursor = res.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        params["cursor"] = cursor
+
+    assert seen == expected
+    assert pages == 3
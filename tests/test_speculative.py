@@ -0,0 +1,126 @@
+import itertools
+import threading
+
+from app import sandbox
+from app.artifacts import get_artifact
+from app.db import SessionLocal
+from app.models import AgentPlan, FileEdit
+from app.sandbox import execute_plan
+from app.snapshot import hash_files
+
+
+def _plan(original_hash, new_value):
+    return AgentPlan(
+        edits=[
+            FileEdit(
+                file_path="mod.py",
+                original_hash=original_hash,
+                unified_diff=f"--- a/mod.py\n+++ b/mod.py\n@@ -1 +1 @@\n-x = 1\n+x = {new_value}\n",
+            )
+        ]
+    )
+
+
+def test_first_verified_candidate_wins(git_repo, monkeypatch):
+    repo = git_repo()
+
+    def no_repair(**kwargs):
+        raise AssertionError("speculative winner should not need repair")
+
+    monkeypatch.setattr(sandbox, "repair_plan", no_repair)
+    monkeypatch.setattr(sandbox, "_open_pull_request", lambda repo, plan: ("pr", "b"))
+
+    good_hash = hash_files(str(repo))["mod.py"]
+    result = execute_plan(
+        f"file://{repo}",
+        _plan("stale", 2),
+        "bump x",
+        session_id="speculative",
+        alternatives=[_plan(good_hash, 3)],
+    )
+
+    with SessionLocal() as db:
+        trace = get_artifact(db, "speculative", "trace")
+        final = get_artifact(db, "speculative", "final_plan")
+
+    assert result == "pr"
+    assert trace["candidates"] == 2
+    assert trace["winner"] == 1
+    assert "Hash mismatch" in trace["candidate_errors"]["0"]
+    assert "+x = 3" in final["edits"][0]["unified_diff"]
+    assert trace["repair_attempts"] == 0
+    assert trace["patch_ms"] >= 0 and trace["verification_ms"] >= 0
+
+
+class _Plan(str):
+    llm_call = None
+
+
+class _Snap:
+    repo_url, commit, manifest = "file:///repo", "c0", {}
+
+    def __init__(self):
+        self.forks = itertools.count()
+
+    def fork(self):
+        return f"wt{next(self.forks)}"
+
+    def discard(self, repo):
+        pass
+
+
+def test_losers_stay_quiet_after_a_winner(monkeypatch):
+    published = []
+    roles = {}
+    released = threading.Semaphore(0)
+    loser_started, loser_may_finish = threading.Event(), threading.Event()
+
+    def verify(repo, on_output, trace, cancel):
+        if roles[repo] == "fast":
+            loser_started.wait(5)
+            return {"tests_passed": True}
+        loser_started.set()
+        loser_may_finish.wait(5)
+        on_output("late line")
+        raise RuntimeError("late failure")
+
+    snap = _Snap()
+    monkeypatch.setattr(sandbox, "publish", lambda sid, event, **f: published.append(event))
+    monkeypatch.setattr(sandbox, "acquire_snapshot", lambda *a: snap)
+    monkeypatch.setattr(sandbox, "release_snapshot", lambda s: released.release())
+    monkeypatch.setattr(sandbox, "_apply_plan", lambda repo, m, plan: roles.update({repo: plan}))
+    monkeypatch.setattr(sandbox, "cached_verify", verify)
+
+    trace = {}
+    plan, _ = sandbox._race_candidates("s", snap, [_Plan("fast"), _Plan("slow")], trace)
+    loser_may_finish.set()
+    assert released.acquire(timeout=5) and released.acquire(timeout=5)
+
+    assert plan == "fast"
+    assert published == ["candidate_won"]
+    assert trace["repair_attempts"] == 0 and "verification_ms" in trace
+
+
+def test_race_starts_before_slow_plans_arrive(monkeypatch):
+    snap = _Snap()
+    roles = {}
+    monkeypatch.setattr(sandbox, "publish", lambda *a, **f: None)
+    monkeypatch.setattr(sandbox, "acquire_snapshot", lambda *a: snap)
+    monkeypatch.setattr(sandbox, "release_snapshot", lambda s: None)
+    monkeypatch.setattr(sandbox, "_apply_plan", lambda repo, m, plan: roles.update({repo: plan}))
+    monkeypatch.setattr(sandbox, "cached_verify", lambda repo, **kw: {})
+
+    slow_plan_generated = threading.Event()
+
+    def plans():
+        yield _Plan("fast")
+        # a slow LLM call still in flight
+        slow_plan_generated.wait(10)
+        yield _Plan("slow")
+
+    trace = {}
+    plan, _ = sandbox._race_candidates("s", snap, plans(), trace)
+    slow_plan_generated.set()
+
+    assert plan == "fast"
+    assert trace["candidates"] == 1
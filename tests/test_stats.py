@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from app.db import SessionLocal
+from app.stats import failure_reason, record_session, rollup_query, summarize
+
+
+def test_rollups_merge_into_percentiles_and_distributions():
+    repo = "https://example.com/stats-repo.git"
+    at = datetime(2026, 3, 2, 10, 30)
+
+    with SessionLocal() as db:
+        for i in range(1, 101):
+            record_session(
+                db,
+                repo,
+                "success",
+                {"patch_ms": float(i), "repair_attempts": i % 2},
+                duration_sec=2.0,
+                at=at,
+            )
+        record_session(db, repo, "failed", {}, 1.0, error="Tests failed", at=at)
+        db.commit()
+
+        rows = db.execute(rollup_query(repo_url=repo)).all()
+
+    [group] = summarize(rows, "day")
+
+    assert group["sessions"] == 101
+    assert group["status"] == {"success": 100, "failed": 1}
+    assert group["failure_reasons"] == {"tests_failed": 1}
+    assert group["repair_attempts"] == {"0": 50, "1": 50}
+
+    patch = group["timings"]["patch_ms"]
+    assert abs(patch["p50"] - 50) / 50 < 0.05
+    assert abs(patch["p95"] - 95) / 95 < 0.05
+
+
+def test_failure_reason_categories():
+    assert failure_reason("Hash mismatch for app.py") == "hash_mismatch"
+    assert failure_reason("boom") == "other"
@@ -0,0 +1,70 @@
+import os
+
+from app import symbol_index
+from app.config import settings
+from app.symbol_index import build_index, parse_file
+
+
+def test_parse_resolves_relative_imports():
+    info = parse_file(
+        "pkg/sub/mod.py",
+        "from . import sibling\nfrom ..core import Thing\nimport requests\n\ndef run(): pass\n",
+    )
+
+    assert info["defs"] == ["run"]
+    assert "pkg.sub.sibling" in info["imports"]
+    assert "pkg.core.Thing" in info["imports"]
+    assert "requests" in info["imports"]
+
+
+def test_index_edges_and_incremental_update(tmp_path, git_repo, monkeypatch):
+    monkeypatch.setattr(settings, "workspace_root", str(tmp_path / "ws"))
+
+    repo = git_repo(
+        files={
+            "app/__init__.py": "",
+            "app/core.py": "import requests\n\nclass Engine: pass\n",
+            "app/api.py": "from app.core import Engine\n",
+        }
+    )
+
+    index = build_index(str(repo), "https://example.com/repo.git")
+
+    assert index.definitions_of("Engine") == ["app/core.py"]
+    assert index.imports_of("app/api.py") == ["app/core.py"]
+    assert index.importers_of("app/core.py") == ["app/api.py"]
+    assert index.external_imports() == {"requests"}
+
+    git_repo.commit(repo, "two", {"app/api.py": "import app.core\n\ndef handler(): pass\n"})
+
+    parsed = []
+    real_parse = symbol_index.parse_file
+
+    def counting_parse(path, source):
+        parsed.append(path)
+        return real_parse(path, source)
+
+    monkeypatch.setattr(symbol_index, "parse_file", counting_parse)
+
+    updated = build_index(str(repo), "https://example.com/repo.git")
+
+    assert parsed == ["app/api.py"]
+    assert updated.commit != index.commit
+    assert updated.definitions_of("handler") == ["app/api.py"]
+    assert updated.files["app/core.py"] == index.files["app/core.py"]
+
+
+def test_stored_indexes_are_bounded(tmp_path, git_repo, monkeypatch):
+    monkeypatch.setattr(settings, "workspace_root", str(tmp_path / "ws"))
+    monkeypatch.setattr(settings, "symbol_index_keep", 2)
+
+    repo = git_repo(files={})
+    url = "https://example.com/bounded.git"
+
+    commits = []
+    for i in range(4):
+        git_repo.commit(repo, f"c{i}", {"mod.py": f"x = {i}\n"})
+        commits.append(build_index(str(repo), url).commit)
+
+    stored = sorted(os.listdir(symbol_index._index_dir(url)))
+    assert stored == sorted(f"{c}.json.gz" for c in commits[-2:])
@@ -0,0 +1,36 @@
+import pytest
+
+from app import verify_cache
+
+
+def test_identical_trees_reuse_the_verdict(git_repo, monkeypatch):
+    calls = []
+
+    def fake_verify(repo_path, on_output=None, cancel=None):
+        calls.append(repo_path)
+        on_output("1 passed")
+        if "broken" in open(f"{repo_path}/mod.py").read():
+            raise RuntimeError("Tests failed")
+        return {}
+
+    monkeypatch.setattr(verify_cache, "verify", fake_verify)
+
+    a, b = git_repo("a"), git_repo("b")
+
+    trace = {}
+    verify_cache.cached_verify(str(a), trace=trace)
+    assert trace["verify_cache"] == "miss"
+
+    lines, trace = [], {}
+    verify_cache.cached_verify(str(b), on_output=lines.append, trace=trace)
+    assert trace["verify_cache"] == "hit"
+    assert lines == ["1 passed"]
+    assert len(calls) == 1
+
+    (b / "mod.py").write_text("broken = 1\n")
+    for expected in ("miss", "hit"):
+        trace = {}
+        with pytest.raises(RuntimeError, match="Tests failed"):
+            verify_cache.cached_verify(str(b), trace=trace)
+        assert trace["verify_cache"] == expected
+    assert len(calls) == 2
@@ -0,0 +1,64 @@
+import pytest
+
+from app.config import settings
+from app.resources import measure, resource_log
+from app.verify_pool import verify
+
+
+def test_pool_relays_output_and_failures(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "verify_workers", 1)
+
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "test_ok.py").write_text("def test_ok():\n    assert True\n")
+
+    lines = []
+    with resource_log() as usage, measure("verification"):
+        verify(str(tmp_path), on_output=lines.append)
+    assert any("1 passed" in line for line in lines)
+    # pytest ran under the worker; its CPU is relayed back to this stage
+    assert usage["verification"]["children_user_s"] > 0
+
+    (tmp_path / "broken.py").write_text("def broken(:\n")
+    with pytest.raises(RuntimeError, match="AST error"):
+        verify(str(tmp_path))
+
+
+def test_inline_limits_are_applied_without_preexec(tmp_path, monkeypatch):
+    import sys
+
+    from app.verifier import _limited, run_tests
+
+    cmd = _limited(["true"], {"cpu_seconds": 7, "memory_mb": 64, "timeout_sec": 5})
+    assert cmd[:2] == ["sh", "-c"] and "ulimit -t 7" in cmd[2] and "ulimit -v 65536" in cmd[2]
+    assert _limited(["true"], {"timeout_sec": 5}) == ["true"]
+
+    monkeypatch.setattr(settings, "require_tests", True)
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "test_limit.py").write_text(
+        "import resource\n\n"
+        "def test_limit():\n"
+        "    assert resource.getrlimit(resource.RLIMIT_CPU)[0] == 7\n"
+    )
+    lines = []
+    run_tests(str(tmp_path), lines.append, {"cpu_seconds": 7}, python=sys.executable)
+    assert any("1 passed" in line for line in lines)
+
+
+def test_cancel_kills_running_tests(tmp_path, monkeypatch):
+    import threading
+    import time
+
+    from app.verify_pool import CANCELLED
+
+    monkeypatch.setattr(settings, "verify_workers", 1)
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "test_slow.py").write_text(
+        "import time\n\ndef test_slow():\n    time.sleep(60)\n"
+    )
+
+    cancel = threading.Event()
+    threading.Timer(3, cancel.set).start()
+    t0 = time.monotonic()
+    with pytest.raises(RuntimeError, match=CANCELLED):
+        verify(str(tmp_path), cancel=cancel)
+    assert time.monotonic() - t0 < 30
@@ -0,0 +1,99 @@
+import sys
+import threading
+import time
+
+import pytest
+
+from app import warm_tests
+from app.config import settings
+from app.resources import measure, resource_log
+from app.warm_tests import WarmWorkerUnavailable, run_warm_tests
+
+
+def test_warm_worker_runs_and_reports(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "workspace_root", str(tmp_path / "ws"))
+    monkeypatch.setattr(settings, "warm_worker_idle_sec", 5)
+    (tmp_path / "ws" / "envs").mkdir(parents=True)
+
+    repo = tmp_path / "repo"
+    (repo / "tests").mkdir(parents=True)
+    (repo / "tests" / "test_ok.py").write_text("def test_ok():\n    assert True\n")
+
+    lines = []
+    with resource_log() as usage, measure("verification"):
+        run_warm_tests(sys.executable, "testenv", str(repo), lines.append)
+    assert any("1 passed" in line for line in lines)
+    assert usage["verification"]["children_user_s"] > 0
+
+    # the second run is served by the same, already warm worker
+    (repo / "tests" / "test_ok.py").write_text("def test_ok():\n    assert False\n")
+    with pytest.raises(RuntimeError, match="Tests failed"):
+        run_warm_tests(sys.executable, "testenv", str(repo))
+
+
+def test_warm_worker_timeout_and_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "workspace_root", str(tmp_path / "ws"))
+    monkeypatch.setattr(settings, "warm_worker_idle_sec", 5)
+    (tmp_path / "ws" / "envs").mkdir(parents=True)
+
+    repo = tmp_path / "repo"
+    (repo / "tests").mkdir(parents=True)
+    pidfile = tmp_path / "sleeper.pid"
+    (repo / "tests" / "test_hang.py").write_text(
+        "import subprocess, time\n"
+        "def test_hang():\n"
+        "    p = subprocess.Popen(['sleep', '60'])\n"
+        f"    open({str(pidfile)!r}, 'w').write(str(p.pid))\n"
+        "    time.sleep(60)\n"
+    )
+
+    # a timeout kills the tests' own subprocesses along with pytest
+    with pytest.raises(RuntimeError, match="timed out"):
+        run_warm_tests(sys.executable, "testenv", str(repo), limits={"timeout_sec": 3})
+    sleeper = int(pidfile.read_text())
+    time.sleep(0.2)
+    assert not _alive(sleeper)
+
+    # failures inside the forked child come back over the socket
+    with pytest.raises(WarmWorkerUnavailable, match="FileNotFoundError"):
+        run_warm_tests(
+            sys.executable, "testenv", str(repo), limits={"cgroup": str(tmp_path / "none")}
+        )
+
+
+def test_dead_worker_is_reaped_and_replaced(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "workspace_root", str(tmp_path / "ws"))
+    monkeypatch.setattr(settings, "warm_worker_idle_sec", 5)
+    (tmp_path / "ws" / "envs").mkdir(parents=True)
+
+    repo = tmp_path / "repo"
+    (repo / "tests").mkdir(parents=True)
+    (repo / "tests" / "test_ok.py").write_text("def test_ok():\n    assert True\n")
+
+    # concurrent runs are reaped by the worker's main loop
+    threads = [
+        threading.Thread(target=run_warm_tests, args=(sys.executable, "reapenv", str(repo)))
+        for _ in range(3)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    path = str(tmp_path / "ws" / "envs" / "reapenv.sock")
+    first = warm_tests._servers[path]
+    first.kill()
+    time.sleep(0.2)
+    assert first.returncode is not None and not _alive(first.pid)
+
+    # the stale socket is left behind; the next run starts a new worker
+    run_warm_tests(sys.executable, "reapenv", str(repo))
+    assert warm_tests._servers[path] is not first
+
+
+def _alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().split(") ")[1][0] != "Z"
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,69 @@
+import threading
+
+from app import snapshot as snapshot_mod
+from app import workspace
+from app.config import settings
+
+
+def test_concurrent_runs_share_one_clone(tmp_path, git_repo, monkeypatch):
+    monkeypatch.setattr(settings, "workspace_root", str(tmp_path / "ws"))
+    url = f"file://{git_repo()}"
+
+    clones = []
+    real_clone = snapshot_mod.clone_repo
+
+    def counting_clone(*args, **kwargs):
+        clones.append(args)
+        return real_clone(*args, **kwargs)
+
+    monkeypatch.setattr(workspace, "clone_repo", counting_clone)
+
+    snaps = []
+    threads = [
+        threading.Thread(target=lambda: snaps.append(workspace.acquire_snapshot(url)))
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(clones) == 1
+    assert len({id(s) for s in snaps}) == 1
+
+    snap = snaps[0]
+    fork = snap.fork()
+    with open(f"{fork}/mod.py", "w") as f:
+        f.write("x = 2\n")
+
+    # edits in a fork never reach the shared snapshot
+    with open(f"{snap.path}/mod.py") as f:
+        assert f.read() == "x = 1\n"
+    assert "mod.py" in snap.manifest
+
+    snap.discard(fork)
+    for s in snaps:
+        workspace.release_snapshot(s)
+
+    assert workspace.acquire_snapshot(url) is snap
+    workspace.release_snapshot(snap)
+
+
+def test_listing_matches_checkout_and_is_cached_by_commit(tmp_path, git_repo, monkeypatch):
+    monkeypatch.setattr(settings, "workspace_root", str(tmp_path / "ws"))
+    repo = git_repo()
+    (repo / "pkg" / "__pycache__").mkdir(parents=True)
+    (repo / "pkg" / "__pycache__" / "mod.pyc").write_bytes(b"\0")
+    git_repo.commit(repo, "two", {"pkg/util.py": "y = 2\n"})
+    url = f"file://{repo}"
+
+    commit, files = workspace.list_files(url)
+    assert commit == snapshot_mod.resolve_commit(str(repo))
+    assert sorted(files) == sorted(snapshot_mod.load_files(str(repo), content=False))
+    assert not (tmp_path / "ws" / "snapshots").exists()
+
+    def no_fetch(*args):
+        raise AssertionError("listing should come from the cache")
+
+    monkeypatch.setattr(workspace, "list_tree", no_fetch)
+    assert workspace.list_files(url) == (commit, files)